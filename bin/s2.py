@@ -13,21 +13,34 @@ import time
 import os
 import re
 import random
-
-import BaseHTTPServer
-from SimpleHTTPServer import SimpleHTTPRequestHandler
+import tarfile
 
 from simplystatic import s2site
+from simplystatic import s2import
+from simplystatic import s2server
+from simplystatic import s2links
+from simplystatic import s2deploy
+from simplystatic import s2many
+from simplystatic import s2pack
+from simplystatic import s2cache
+from simplystatic import s2daemon
+from simplystatic import s2storage
 from simplystatic import util
 
 THIS_MODULE = sys.modules[__name__]
 
-#site = None
+# the site kept in memory by s2 daemon; while it's set, make_site_obj
+# returns it, and commands are not sent to a daemon
+DAEMON_SITE = None
+# commands that are sent to the daemon of the site, if there's one
+DAEMON_COMMANDS = ('gen', 'ls', 'add')
 
 def setup_parser():
     '''Set up the command-line options.'''
     p = argparse.ArgumentParser(description='Create and manage a \
 SimplyStatic site.')
+    p.add_argument('--no-daemon', action='store_true', dest='no_daemon',
+                   help="Run the command here, even if there's a s2 daemon for the site.")
     subparsers = p.add_subparsers(help='commands', dest='command')
 
     # aliases are not supported in 2.7 for add_parser
@@ -59,6 +72,46 @@ SimplyStatic site.')
     generate_cmd_parser.add_argument('-d', '--dirname',
         help="Directory of site root, or any place under site root.",
         action='store')
+    generate_cmd_parser.add_argument('-l', '--check-links', action='store_true',
+        dest='check_links', help='Check the internal links after generating.')
+    generate_cmd_parser.add_argument('-k', '--pack', action='store', default=None,
+        help='Generate in www as usual, then move it into this pack file (www is left empty).')
+    shard_group = generate_cmd_parser.add_mutually_exclusive_group()
+    shard_group.add_argument('-s', '--shard', action='store', default=None,
+        type=shard_spec, metavar='I/N',
+        help='Generate only shard I of N (0 <= I < N) of the pages; finish with --merge.')
+    shard_group.add_argument('-m', '--merge', action='store_true',
+        help='Finish a site generated in shards, from the summaries in s2/shards.')
+    shard_group.add_argument('-p', '--page', action='append', default=None,
+        dest='pages', metavar='SLUG',
+        help='Generate only this page (can be repeated), and update the listings.')
+    shard_group.add_argument('-g', '--git', action='store_true',
+        help='Generate only the pages changed in git since the last gen --git.')
+
+    # gen-many command
+    genmany_cmd_parser = subparsers.add_parser('gen-many',
+                        help='Generate several sites in one go.')
+    genmany_cmd_parser.add_argument('sites',
+        help="Directory of sites (or a site), or file listing one site dir per line.",
+        action='store')
+    genmany_cmd_parser.add_argument('-j', '--processes', action='store',
+        type=int, default=None, help='Number of processes (default: one per CPU).')
+    genmany_cmd_parser.add_argument('-c', '--cache-dir', action='store',
+        dest='cache_dir', default=None,
+        help='Directory for the caches and compiled templates shared by the sites.')
+
+    # check-links command
+    links_cmd_parser = subparsers.add_parser('check-links',
+                        help='Check the internal links of the generated site.')
+    links_cmd_parser.add_argument('-d', '--dirname',
+        help="Directory of site root, or any place under site root.",
+        action='store')
+    links_cmd_parser.add_argument('-p', '--page', action='append',
+        dest='pages', help="Only check this page (a slug). Can be repeated.")
+    links_cmd_parser.add_argument('-c', '--changed', action='store_true',
+        help='Only check the pages added or changed by the last generation.')
+    links_cmd_parser.add_argument('-j', '--processes', action='store',
+        type=int, default=None, help='Number of processes (default: one per CPU).')
 
     # rename command
     rename_cmd_parser = subparsers.add_parser('rename',
@@ -73,6 +126,34 @@ SimplyStatic site.')
             help="Directory of site root, or any place under site root.",
             action='store')
 
+    # import command
+    import_cmd_parser = subparsers.add_parser('import',
+                    help='Import pages in bulk from Markdown files or JSON lines.')
+    import_cmd_parser.add_argument('source',
+        help="Directory of Markdown files, or JSON-lines file ('-' for stdin).",
+        action='store')
+    import_cmd_parser.add_argument('-d', '--dirname',
+        help="Directory of site root, or any place under site root.",
+        action='store')
+    import_cmd_parser.add_argument('-t', '--threads', action='store', type=int,
+                                   default=8, help='Number of writer threads.')
+    import_cmd_parser.add_argument('-b', '--batchsize', action='store', type=int,
+                                   default=100, help='Pages written per batch.')
+
+    # deploy command
+    deploy_cmd_parser = subparsers.add_parser('deploy',
+                    help='Copy the changes in the generated site to a directory.')
+    deploy_cmd_parser.add_argument('target',
+        help="Directory to deploy to (e.g. a mounted web root).",
+        action='store')
+    deploy_cmd_parser.add_argument('-d', '--dirname',
+        help="Directory of site root, or any place under site root.",
+        action='store')
+    deploy_cmd_parser.add_argument('-n', '--dry-run', action='store_true',
+        dest='dry_run', help='Only print what would be copied and deleted.')
+    deploy_cmd_parser.add_argument('-t', '--threads', action='store', type=int,
+                                   default=8, help='Number of copying threads.')
+
     # servecommand
 
     serve_cmd_parser = subparsers.add_parser('serve',
@@ -82,6 +163,49 @@ SimplyStatic site.')
 
     serve_cmd_parser.add_argument('-i','--ip', action='store', default = '127.0.0.1',
                                  help='IP address for the server.')
+    serve_cmd_parser.add_argument('-l','--live', action='store_true',
+                help='Render pages from their source when requested, without generating.')
+    serve_cmd_parser.add_argument('-k','--pack', action='store', default=None,
+                help='Serve the site in this pack file instead of www.')
+    serve_cmd_parser.add_argument('-r','--reload', action='store_true',
+                help='Dev mode: open pages reload when a generation changes them.')
+
+    # unpack command
+    unpack_cmd_parser = subparsers.add_parser('unpack',
+                                    help='Extract a pack file into a directory.')
+    unpack_cmd_parser.add_argument('pack', help="Pack file (see s2 gen --pack).",
+                                   action='store')
+    unpack_cmd_parser.add_argument('dest', help="Directory to extract the files to.",
+                                   action='store')
+
+    # cache command
+    cache_cmd_parser = subparsers.add_parser('cache',
+                        help='Export or import the build cache (e.g. between CI runs).')
+    cache_cmd_parser.add_argument('action', choices=['export', 'import'],
+        help='export writes the cache to a tarball; import adds a tarball to it.')
+    cache_cmd_parser.add_argument('tarball', help='Tarball (.tar.gz) file.',
+                                  action='store')
+    cache_cmd_parser.add_argument('-d', '--dirname',
+        help="Directory of site root, or any place under site root.",
+        action='store')
+
+    # daemon command
+    daemon_cmd_parser = subparsers.add_parser('daemon',
+                        help='Keep the site in memory and run gen, ls and add for other s2 calls.')
+    daemon_cmd_parser.add_argument('-d', '--dirname',
+        help="Directory of site root, or any place under site root.",
+        action='store')
+    daemon_cmd_parser.add_argument('--stop', action='store_true',
+        help='Stop the daemon of the site.')
+
+    # storage command
+    storage_cmd_parser = subparsers.add_parser('storage',
+                        help='Move the page files to another storage (files or sqlite).')
+    storage_cmd_parser.add_argument('to', choices=s2storage.STORAGE_NAMES,
+        help='files: a .md file in each page directory; sqlite: s2/pages.sqlite.')
+    storage_cmd_parser.add_argument('-d', '--dirname',
+        help="Directory of site root, or any place under site root.",
+        action='store')
 
     # ls command
     ls_cmd_parser = subparsers.add_parser('ls',
@@ -103,6 +227,8 @@ SimplyStatic site.')
 def make_site_obj(argdict):
     '''Instantiate and return the site. This will be used for all commands'''
     #d = '.'
+    if DAEMON_SITE is not None:
+        return DAEMON_SITE
     d = None
     if 'dirname' in argdict:
         d = argdict['dirname']
@@ -115,10 +241,59 @@ def make_site_obj(argdict):
 
 def dispatch(argdict):
     '''Call the command-specific function, depending on the command.'''
-    cmd = argdict['command']
+    cmd = argdict['command'].replace('-', '_')
+    if cmd in DAEMON_COMMANDS and DAEMON_SITE is None and \
+            not argdict.get('no_daemon'):
+        run_in_daemon(argdict)
     ftc = getattr(THIS_MODULE, 'do_'+cmd)
     ftc(argdict)
 
+def run_in_daemon(argdict):
+    '''Run the command in the daemon of the site and exit, if there's one.
+
+    If there's no daemon running for the site, just return.
+
+    '''
+    base = s2site.discover_base_dir(argdict.get('dirname') or os.getcwd())
+    if base is None:
+        return
+    request = dict(argdict)
+    if request.get('pack'):
+        # the daemon runs in another directory
+        request['pack'] = os.path.abspath(request['pack'])
+    answer = s2daemon.send_request(base, request)
+    if answer is None:
+        return
+    sys.stdout.write(answer['output'].encode('utf-8'))
+    sys.exit(answer['status'])
+
+def do_daemon(argdict):
+    '''Run the daemon of the site (or stop it.)'''
+    global DAEMON_SITE
+    site = make_site_obj(argdict)
+    if not site.tree_ready:
+        print "Cannot start the daemon. You are not within a simplystatic \
+tree and you didn't specify a directory."
+        sys.exit(1)
+    if argdict['stop']:
+        answer = s2daemon.send_request(site.dirs['base'], {'stop': True})
+        if answer is None:
+            print "There's no daemon running for this site."
+            sys.exit(1)
+        sys.stdout.write(answer['output'].encode('utf-8'))
+        return
+    DAEMON_SITE = site
+    site.get_catalog()  # warm it up
+    try:
+        s2daemon.serve(site, dispatch)
+    except ValueError as e:
+        print "Cannot start the daemon: %s" % e
+        sys.exit(1)
+    except KeyboardInterrupt: # pragma: no cover
+        print "Daemon stopped."
+    finally:
+        DAEMON_SITE = None
+
 def do_init(argdict):
     '''Create the structure of a s2site.'''
     site = make_site_obj(argdict)
@@ -165,17 +340,219 @@ def do_rename(argdict):
         print "Cannot rename. A page with the given slug does not exist."
         sys.exit()
 
+def shard_spec(text):
+    '''Return (index, count) for a shard spec 'index/count'.'''
+    m = re.match(r'^(\d+)/(\d+)$', text)
+    if not m or int(m.group(1)) >= int(m.group(2)):
+        raise argparse.ArgumentTypeError("'%s' is not a shard spec like 0/4." % text)
+    return (int(m.group(1)), int(m.group(2)))
+
 def do_gen(argdict):
-    '''Generate the whole site.'''
+    '''Generate the whole site (or a shard of it, or some pages.)'''
     site = make_site_obj(argdict)
+    shard = argdict.get('shard')
+    if shard and (argdict.get('check_links') or argdict.get('pack')):
+        print "--check-links and --pack need the whole site; use them with --merge."
+        sys.exit(1)
     try:
         st = time.time()
-        site.generate()
-        et = time.time()
-        print "Generated Site in %f seconds."% (et-st)
+        if shard:
+            n = site.generate_shard(*shard)
+            et = time.time()
+            print "Generated %d pages of shard %d/%d in %f seconds." % \
+                  (n, shard[0], shard[1], et - st)
+        elif argdict.get('pages'):
+            done = site.generate_pages(argdict['pages'])
+            et = time.time()
+            print "Generated %d pages in %f seconds." % (len(done), et - st)
+        elif argdict.get('git'):
+            done = site.generate_from_git()
+            et = time.time()
+            if done is None:
+                print "Generated Site in %f seconds (no usable git history)." % (et - st)
+            else:
+                print "Generated %d pages changed in git in %f seconds." % \
+                      (len(done), et - st)
+        elif argdict.get('merge'):
+            n = site.merge_shards()
+            et = time.time()
+            print "Merged %d shards in %f seconds." % (n, et - st)
+        else:
+            site.generate()
+            et = time.time()
+            print "Generated Site in %f seconds."% (et-st)
+        print_cache_stats(site)
     except ValueError as e: # pragma: no cover
+        if site.tree_ready and str(e):
+            print "Cannot generate: " + str(e)
+            sys.exit(1)
         print "Cannot generate. You are not within a simplystatic \
 tree and you didn't specify a directory."
+        sys.exit()
+    problems = 0
+    if argdict.get('check_links'):
+        pages = None
+        if argdict.get('pages') or argdict.get('git'):
+            (added, changed, removed) = site.get_build_changes()
+            pages = [f for f in added + changed
+                     if os.path.splitext(f)[1].lower() in s2links.HTML_EXTENSIONS]
+        problems = report_links(site, pages)
+    if argdict.get('pack'):
+        n = site.pack_www(os.path.abspath(argdict['pack']))
+        print "Packed %d files into %s." % (n, argdict['pack'])
+    if problems > 0:
+        sys.exit(1)
+
+def print_cache_stats(site):
+    '''Print the hits and misses of the caches used by site.'''
+    if site.cache_dir is not None:
+        print "Build cache: " + site.cache_dir
+    for name in sorted(site.caches):
+        c = site.caches[name]
+        print "Cache '%s': %d hits, %d misses." % (name, c.hits, c.misses)
+    print "Templates: %d compiled, %d already compiled." % \
+          (site.template_misses, site.template_hits)
+
+def do_cache(argdict):
+    '''Export or import the build cache of the site.'''
+    site = make_site_obj(argdict)
+    if not site.tree_ready: # pragma: no cover
+        print "You are not within a simplystatic tree and you didn't \
+specify a directory."
+        sys.exit(1)
+    cache_dir = site.cache_dir
+    if cache_dir is None:
+        cache_dir = os.path.join(site.dirs['s2'], 'cache')
+    st = time.time()
+    if argdict['action'] == 'export':
+        n = s2cache.export_cache(cache_dir, argdict['tarball'])
+        print "Exported %d files from %s in %f seconds." % \
+              (n, cache_dir, time.time() - st)
+    else:
+        try:
+            n = s2cache.import_cache(argdict['tarball'], cache_dir)
+        except (IOError, tarfile.TarError) as e:
+            print "Cannot import cache: %s" % e
+            sys.exit(1)
+        print "Imported %d files into %s in %f seconds." % \
+              (n, cache_dir, time.time() - st)
+
+def do_gen_many(argdict):
+    '''Generate several sites.'''
+    dirs = s2many.find_sites(argdict['sites'])
+    if not dirs:
+        print "No simplystatic sites found in " + argdict['sites'] + "."
+        sys.exit(1)
+    st = time.time()
+    failed = 0
+    for r in s2many.generate_many(dirs, argdict['processes'],
+                                  argdict['cache_dir']):
+        if r['ok']:
+            caches = ', '.join(["%s %d/%d" % (name, h, h + m) for (name, (h, m))
+                                in sorted(r['caches'].items())])
+            print "Generated %s: %d pages in %f seconds (cache hits: %s)." % \
+                  (r['dir'], r['pages'], r['seconds'], caches or 'none')
+        else:
+            failed += 1
+            print "FAILED %s after %f seconds: %s" % (r['dir'], r['seconds'],
+                                                      r['error'])
+    et = time.time()
+    print "Generated %d of %d sites in %f seconds." % \
+          (len(dirs) - failed, len(dirs), et - st)
+    if failed:
+        sys.exit(1)
+
+def report_links(site, pages=None, processes=None):
+    '''Check the links of the generated site, print the problems found.
+
+    Return the number of problems.
+
+    '''
+    st = time.time()
+    report = s2links.check_links(site.dirs['www'], pages, processes)
+    et = time.time()
+    n = 0
+    for page in sorted(report):
+        print page + ":"
+        for (line, url, problem) in report[page]:
+            print "    line %d: %s (%s)" % (line, url, problem)
+            n += 1
+    print "Checked links in %f seconds: %d problems in %d pages." % \
+          (et - st, n, len(report))
+    return n
+
+def do_check_links(argdict):
+    '''Check the internal links of the generated site.'''
+    site = make_site_obj(argdict)
+    if not site.tree_ready:
+        print "Cannot check links. You are not within a simplystatic \
+tree and you didn't specify a directory."
+        sys.exit()
+    pages = None
+    if argdict['pages']:
+        pages = [slug + '/index.html' for slug in argdict['pages']]
+    if argdict.get('changed'):
+        (added, changed, removed) = site.get_build_changes()
+        pages = (pages or []) + [f for f in added + changed
+                    if os.path.splitext(f)[1].lower() in s2links.HTML_EXTENSIONS]
+    if report_links(site, pages, argdict['processes']) > 0:
+        sys.exit(1)
+
+def do_import(argdict):
+    '''Import pages in bulk.'''
+    site = make_site_obj(argdict)
+    if not site.tree_ready:
+        print "Cannot import pages. You are not within a simplystatic \
+tree and you didn't specify a directory."
+        sys.exit()
+    last = [0]
+    def progress(done, total, elapsed):
+        if done == total or elapsed - last[0] >= 1:
+            last[0] = elapsed
+            print "Imported %d/%d pages (%.1f pages/s)." % \
+                  (done, total, done / max(elapsed, 0.001))
+    def bulk_import(records):
+        return site.bulk_import(records, threads=argdict['threads'],
+                                batch_size=argdict['batchsize'],
+                                progress=progress)
+    src = argdict['source']
+    st = time.time()
+    if src == '-':
+        (imported, skipped) = bulk_import(s2import.read_jsonl(sys.stdin))
+    elif os.path.isdir(src):
+        (imported, skipped) = bulk_import(s2import.read_markdown_dir(src))
+    else:
+        with open(src, 'r') as fin:
+            (imported, skipped) = bulk_import(s2import.read_jsonl(fin))
+    et = time.time()
+    for (title, reason) in skipped:
+        if title is None:
+            print "Skipped a record: %s." % reason
+        else:
+            print "Skipped '%s': %s." % (title, reason)
+    print "Imported %d pages in %f seconds (%d skipped)." % \
+          (len(imported), et - st, len(skipped))
+
+def do_deploy(argdict):
+    '''Deploy the generated site to a directory.'''
+    site = make_site_obj(argdict)
+    if not site.tree_ready:
+        print "Cannot deploy. You are not within a simplystatic \
+tree and you didn't specify a directory."
+        sys.exit()
+    st = time.time()
+    (added, changed, removed) = s2deploy.deploy(site.dirs['www'],
+                                                argdict['target'],
+                                                dry_run=argdict['dry_run'],
+                                                threads=argdict['threads'])
+    et = time.time()
+    if argdict['dry_run']:
+        for (mark, files) in (('+', added), ('*', changed), ('-', removed)):
+            for f in files:
+                print mark, f
+    print "%s %d added, %d changed, %d removed files in %f seconds." % \
+          ('Would deploy' if argdict['dry_run'] else 'Deployed',
+           len(added), len(changed), len(removed), et - st)
 
 def do_ls(argdict):
     '''List pages.'''
@@ -186,53 +563,74 @@ tree and you didn't specify a directory."
         sys.exit()
     drafts = argdict['drafts']
     recent = argdict['recent']
-    dir = site.dirs['source']
+    storage = site.storage
 
-    r = site.get_page_names()
+    r = [pn for pn in site.get_page_names() if storage.exists(pn)]
     if drafts:
-        fr = [os.path.join(dir,pn , pn+".md") for pn in r]
         cpat = re.compile('status:\s+draft') #compiled pattern
-        i=0
         print ''
-        for f in fr:
-            fcontent = open(f,'r').read().lower()
+        for pn in r:
+            fcontent = storage.read(pn).lower()
             res = cpat.search(fcontent)
             if res:
-                print r[i]
-            i += 1
+                print pn
         print ''
     else:
         if recent:
-            fr = [os.path.join(dir,pn , pn+".md") for pn in r]
             bmt = 0
-            i = 0
-            for f in fr:
-                mt = os.path.getmtime(f)
+            for pn in r:
+                mt = storage.sig(pn)[0]
                 if mt > bmt:
                     bmt = mt
-                    fname = r[i]
-                i += 1
+                    fname = pn
             print '\n' + fname + '\n'
         else:
             print  '\n' + '\n'.join(r) + '\n'
 
 
 
+def do_storage(argdict):
+    '''Move the page files of the site to another storage.'''
+    site = make_site_obj(argdict)
+    if not site.tree_ready: # pragma: no cover
+        print "You are not within a simplystatic tree and you didn't \
+specify a directory."
+        sys.exit(1)
+    st = time.time()
+    try:
+        n = s2storage.migrate(site, argdict['to'])
+    except ValueError as e:
+        print "Cannot move the pages: %s" % e
+        sys.exit(1)
+    print "Moved %d pages to the '%s' storage in %f seconds." % \
+          (n, argdict['to'], time.time() - st)
+
 def do_serve(argdict):
     '''Serve the site on localhost, for testing/development.'''
     site = make_site_obj(argdict)
-    os.chdir(site.dirs['www'])
-
-    HandlerClass = SimpleHTTPRequestHandler
-    ServerClass  = BaseHTTPServer.HTTPServer
-    Protocol     = "HTTP/1.0"
-    server_address = (argdict['ip'], argdict['port'])
-    HandlerClass.protocol_version = Protocol
-    httpd = ServerClass(server_address, HandlerClass)
-
-    sa = httpd.socket.getsockname()
-    print "Serving HTTP on", sa[0], "port", sa[1], "..."
-    httpd.serve_forever()
+    pack_path = argdict.get('pack')
+    if pack_path and argdict.get('reload'):
+        print "--reload is for development, it can't be used with --pack."
+        sys.exit(1)
+    if pack_path:
+        pack_path = os.path.abspath(pack_path)
+        if not site.tree_ready:
+            site = None   # no redirects, just the pack
+    s2server.serve(site, argdict['ip'], argdict['port'],
+                   live=argdict.get('live', False), pack_path=pack_path,
+                   reload=argdict.get('reload', False))
+
+def do_unpack(argdict):
+    '''Extract a pack file into a directory.'''
+    try:
+        pack = s2pack.PackReader(argdict['pack'])
+    except (IOError, ValueError) as e:
+        print "Cannot read pack: %s" % e
+        sys.exit(1)
+    st = time.time()
+    n = pack.extract(argdict['dest'])
+    pack.close()
+    print "Extracted %d files in %f seconds." % (n, time.time() - st)
 
 if __name__ == "__main__": # pragma: no cover
     PARSER = setup_parser()
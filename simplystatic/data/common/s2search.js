@@ -0,0 +1,96 @@
+/* Client for the search index that s2 writes to /search/.
+ *
+ * Usage:
+ *
+ *     s2Search('/search/', 'some words', function (results) {
+ *         // results: [{url: ..., title: ..., date: ..., score: ...}, ...]
+ *     });
+ *
+ * Only docs.json and the shards for the prefixes of the words searched
+ * for are fetched (and kept for later searches). Every word must match
+ * (as a prefix of a term) for a page to be in the results.
+ */
+(function () {
+    var cache = {};
+
+    function getJSON(url, callback) {
+        if (cache[url]) { return callback(cache[url]); }
+        var req = new XMLHttpRequest();
+        req.onreadystatechange = function () {
+            if (req.readyState !== 4) { return; }
+            cache[url] = req.status === 200 ? JSON.parse(req.responseText) : {};
+            callback(cache[url]);
+        };
+        req.open('GET', url, true);
+        req.send();
+    }
+
+    // same as shard_name in s2search.py: hex of the utf-8 bytes
+    function shardName(prefix) {
+        var bytes = unescape(encodeURIComponent(prefix)), r = '', i, h;
+        for (i = 0; i < bytes.length; i++) {
+            h = bytes.charCodeAt(i).toString(16);
+            r += (h.length < 2 ? '0' : '') + h;
+        }
+        return r;
+    }
+
+    function words(query) {
+        return query.toLowerCase().split(/[^0-9a-z_\u00c0-\uffff]+/).filter(
+            function (w) { return w.length >= 2; });
+    }
+
+    window.s2Search = function (root, query, callback) {
+        var ws = words(query);
+        if (ws.length === 0) { return callback([]); }
+        getJSON(root + 'docs.json', function (index) {
+            var n = index.prefixLength, wanted = {}, names = [], pending;
+            ws.forEach(function (w) {
+                var p = shardName(w.substr(0, n));
+                // short words need every shard that starts with them
+                (index.shards || []).forEach(function (s) {
+                    if (s.indexOf(p) === 0) { wanted[s] = true; }
+                });
+            });
+            names = Object.keys(wanted);
+            pending = names.length;
+            if (pending === 0) { return callback([]); }
+            names.forEach(function (s) {
+                getJSON(root + s + '.json', function () {
+                    if (--pending === 0) { done(root, index, names, ws, callback); }
+                });
+            });
+        });
+    };
+
+    function done(root, index, names, ws, callback) {
+        var totals = null;
+        ws.forEach(function (w) {
+            var scores = {};
+            names.forEach(function (s) {
+                var shard = cache[root + s + '.json'] || {};
+                Object.keys(shard).forEach(function (term) {
+                    if (term.indexOf(w) !== 0) { return; }
+                    shard[term].forEach(function (p) {
+                        scores[p[0]] = (scores[p[0]] || 0) + p[1];
+                    });
+                });
+            });
+            if (totals === null) {
+                totals = scores;
+            } else {
+                Object.keys(totals).forEach(function (d) {
+                    if (scores[d] === undefined) { delete totals[d]; }
+                    else { totals[d] += scores[d]; }
+                });
+            }
+        });
+        var results = Object.keys(totals).map(function (d) {
+            var doc = index.docs[d];
+            return {url: '/' + doc.url, title: doc.title, date: doc.date,
+                    score: totals[d]};
+        });
+        results.sort(function (a, b) { return b.score - a.score; });
+        callback(results);
+    }
+}());
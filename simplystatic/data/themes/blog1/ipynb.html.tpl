@@ -6,7 +6,7 @@
         <title>${pageTitle}</title>
         <meta name="viewport" content="width=device-width, initial-scale=1.0, maximum-scale=1.0, user-scalable=no" />
         <link rel="stylesheet" href="${themePath}style.css" type="text/css" media="screen,print" />
-        <link rel="stylesheet" href="${themePath}ipynb.css" type="text/css" media="screen,print" 
+        <link rel="stylesheet" href="${themePath}ipynb.css" type="text/css" media="screen,print" />
         <link rel="stylesheet" href="/font-awesome/css/font-awesome.css" type="text/css" media="screen,print" />
         <script src="https://c328740.ssl.cf1.rackcdn.com/mathjax/latest/MathJax.js?config=TeX-AMS_HTML" type="text/javascript"></script>
         <script src="${themePath}initmath.js"></script>
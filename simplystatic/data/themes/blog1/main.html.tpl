@@ -9,6 +9,10 @@
         <link rel="stylesheet" href="${themePath}style.css" type="text/css" media="screen,print" />
         <link rel="stylesheet" href="${themePath}pygments_default.css" type="text/css" media="screen,print" />
         <link rel="stylesheet" href="/font-awesome/css/font-awesome.css" type="text/css" media="screen,print" />
+        % if context.get('mdProfile') == 'math':
+        <script src="https://c328740.ssl.cf1.rackcdn.com/mathjax/latest/MathJax.js?config=TeX-AMS_HTML" type="text/javascript"></script>
+        <script src="${themePath}initmath.js"></script>
+        % endif
     </head>
 
     <body>
@@ -40,6 +44,16 @@
             <article class="page-content">
                 ${pageContent}
             </article>
+            % if context.get('relatedPages'):
+            <aside class="related-pages">
+                <h3>Related</h3>
+                <ul>
+                % for rp in relatedPages:
+                    <li><a href="${rp['url']}">${rp['title']}</a></li>
+                % endfor
+                </ul>
+            </aside>
+            % endif
         </div>
 
 
@@ -0,0 +1,138 @@
+'''Markdown extension that caches the output of the CodeHilite extension.
+
+It works exactly like the codehilite extension (and accepts the same
+configs), but before calling Pygments it looks up the highlighted html
+in a s2cache.DiskCache, using a key made of the language, the
+highlighting options and the code itself. Fenced code blocks go through
+the same cache if the fenced_code extension is loaded before this one.
+
+'''
+import pygments
+import markdown
+from markdown.extensions.codehilite import CodeHilite, CodeHiliteExtension, \
+                                           HiliteTreeprocessor
+from markdown.extensions.fenced_code import FencedBlockPreprocessor, \
+                                            FENCED_BLOCK_RE, CODE_WRAP, \
+                                            LANG_TAG
+
+import s2cache
+
+
+class CachedCodeHilite(CodeHilite):
+    '''CodeHilite that only calls Pygments on a cache miss.'''
+
+    def __init__(self, cache, *args, **kwargs):
+        CodeHilite.__init__(self, *args, **kwargs)
+        self.cache = cache
+
+    def hilite(self):
+        self.src = self.src.strip('\n')
+        if self.lang is None:
+            self._getLang()
+        key = s2cache.make_key('hilite', pygments.__version__, self.lang,
+                               self.linenums, self.guess_lang,
+                               self.css_class, self.style, self.noclasses,
+                               self.src)
+        html = self.cache.get(key)
+        if html is None:
+            html = CodeHilite.hilite(self)
+            self.cache.set(key, html)
+        return html
+
+
+class CachedHiliteTreeprocessor(HiliteTreeprocessor):
+    '''Highlight indented code blocks through the cache.'''
+
+    def run(self, root):
+        blocks = root.getiterator('pre')
+        for block in blocks:
+            children = block.getchildren()
+            if len(children) == 1 and children[0].tag == 'code':
+                code = CachedCodeHilite(self.cache, children[0].text,
+                            linenums=self.config['linenums'],
+                            guess_lang=self.config['guess_lang'],
+                            css_class=self.config['css_class'],
+                            style=self.config['pygments_style'],
+                            noclasses=self.config['noclasses'],
+                            tab_length=self.markdown.tab_length)
+                placeholder = self.markdown.htmlStash.store(code.hilite(),
+                                                            safe=True)
+                block.clear()
+                block.tag = 'p'
+                block.text = placeholder
+
+
+class CachedFencedBlockPreprocessor(FencedBlockPreprocessor):
+    '''Highlight fenced code blocks through the cache.'''
+
+    def __init__(self, md, cache):
+        FencedBlockPreprocessor.__init__(self, md)
+        self.cache = cache
+
+    def run(self, lines):
+        if not self.checked_for_codehilite:
+            for ext in self.markdown.registeredExtensions:
+                if isinstance(ext, CodeHiliteExtension):
+                    self.codehilite_conf = ext.config
+                    break
+            self.checked_for_codehilite = True
+
+        text = "\n".join(lines)
+        while 1:
+            m = FENCED_BLOCK_RE.search(text)
+            if not m:
+                break
+            if self.codehilite_conf:
+                highliter = CachedCodeHilite(self.cache, m.group('code'),
+                        linenums=self.codehilite_conf['linenums'][0],
+                        guess_lang=self.codehilite_conf['guess_lang'][0],
+                        css_class=self.codehilite_conf['css_class'][0],
+                        style=self.codehilite_conf['pygments_style'][0],
+                        lang=(m.group('lang') or None),
+                        noclasses=self.codehilite_conf['noclasses'][0])
+                code = highliter.hilite()
+            else:
+                lang = ''
+                if m.group('lang'):
+                    lang = LANG_TAG % m.group('lang')
+                code = CODE_WRAP % (lang, self._escape(m.group('code')))
+            placeholder = self.markdown.htmlStash.store(code, safe=True)
+            text = '%s\n%s\n%s' % (text[:m.start()], placeholder,
+                                   text[m.end():])
+        return text.split("\n")
+
+
+class HiliteCacheExtension(CodeHiliteExtension):
+    '''Add cached source code highlighting to markdown code blocks.'''
+
+    def __init__(self, cache, configs={}):
+        CodeHiliteExtension.__init__(self, configs)
+        self.cache = cache
+
+    def extendMarkdown(self, md, md_globals):
+        hiliter = CachedHiliteTreeprocessor(md)
+        hiliter.config = self.getConfigs()
+        hiliter.cache = self.cache
+        md.treeprocessors.add("hilite", hiliter, "<inline")
+        if 'fenced_code_block' in md.preprocessors:
+            md.preprocessors['fenced_code_block'] = \
+                CachedFencedBlockPreprocessor(md, self.cache)
+        md.registerExtension(self)
+
+    def settings(self):
+        '''Return what the highlighted html depends on, besides the code.'''
+        return [pygments.__version__, sorted(self.getConfigs().items())]
+
+
+def hilite_settings(md):
+    '''Return the highlight settings of the converter md, or None.
+
+    These go in the keys of the caches of whole converted pages (see
+    Page.body_html), so they are not reused after a Pygments upgrade or
+    a change of the highlighting options.
+
+    '''
+    for ext in md.registeredExtensions:
+        if isinstance(ext, HiliteCacheExtension):
+            return ext.settings()
+    return None
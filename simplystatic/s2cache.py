@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+'''This module provides a small content-addressed cache on disk.
+
+Functions included:
+
+    - make_key: Build a cache key (a hex digest) from several values.
+    - file_hash: Return the hash of a file's content, read in chunks.
+    - export_cache: Write a cache directory to a tarball.
+    - import_cache: Add the files of a tarball to a cache directory.
+
+Classes included:
+
+    - DiskCache: Store values in files named after their key, and
+                 evict the least recently used ones when the total size
+                 of the cache goes over a limit.
+
+'''
+
+import os
+import codecs
+import hashlib
+import shutil
+import tarfile
+import tempfile
+
+
+def make_key(*parts):
+    '''Return a hex digest that identifies the given sequence of parts.
+
+    Each part is length-prefixed before hashing, so that ('ab', 'c')
+    and ('a', 'bc') do not produce the same key.
+
+    '''
+    h = hashlib.sha1()
+    for p in parts:
+        if isinstance(p, unicode):
+            p = p.encode('utf-8')
+        else:
+            p = str(p)
+        h.update(str(len(p)) + ':' + p)
+    return h.hexdigest()
+
+
+def file_hash(path, chunk_size=1 << 20):
+    '''Return the sha1 hex digest of the content of a file.'''
+    h = hashlib.sha1()
+    f = open(path, 'rb')
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        h.update(chunk)
+    f.close()
+    return h.hexdigest()
+
+
+def _is_temp_file(name):
+    # the files being written, see DiskCache.set (mako does the same)
+    return name.startswith('tmp') and not '.' in name
+
+
+def export_cache(cache_dir, tar_path):
+    '''Write the files under cache_dir to the tarball tar_path (gzipped).
+
+    Paths in the tarball are relative to cache_dir. Return the number
+    of files written.
+
+    '''
+    files = []
+    for dirpath, dirnames, filenames in os.walk(cache_dir):
+        dirnames.sort()
+        for fn in sorted(filenames):
+            if not _is_temp_file(fn):
+                fp = os.path.join(dirpath, fn)
+                files.append((fp, os.path.relpath(fp, cache_dir)))
+    d = os.path.dirname(os.path.abspath(tar_path))
+    fd, tmpname = tempfile.mkstemp(dir=d)
+    os.close(fd)
+    tar = tarfile.open(tmpname, 'w:gz')
+    for (fp, arcname) in files:
+        tar.add(fp, arcname)
+    tar.close()
+    os.chmod(tmpname, 0644)
+    os.rename(tmpname, tar_path)
+    return len(files)
+
+
+def import_cache(tar_path, cache_dir):
+    '''Add the files of a tarball written by export_cache to cache_dir.
+
+    Files that are already in the cache are left alone (entries are
+    named after their content, so they are the same.) Each file is
+    written under a temporary name and renamed, so builds that use the
+    cache meanwhile never see half-written files. Members that are not
+    plain files, or whose path would go out of cache_dir, are skipped.
+    Return the number of files added.
+
+    '''
+    n = 0
+    tar = tarfile.open(tar_path, 'r:*')
+    for member in tar:
+        parts = member.name.split('/')
+        if not member.isfile() or member.name.startswith('/') or \
+                '..' in parts or _is_temp_file(parts[-1]):
+            continue
+        fn = os.path.join(cache_dir, *parts)
+        if os.path.exists(fn):
+            continue
+        d = os.path.dirname(fn)
+        if not os.path.isdir(d):
+            try:
+                os.makedirs(d)
+            except OSError: # pragma: no cover
+                pass  # somebody else just created it
+        fd, tmpname = tempfile.mkstemp(dir=d)
+        fout = os.fdopen(fd, 'wb')
+        shutil.copyfileobj(tar.extractfile(member), fout)
+        fout.close()
+        os.chmod(tmpname, 0644)
+        os.rename(tmpname, fn)
+        n += 1
+    tar.close()
+    return n
+
+
+class DiskCache(object):
+    '''Keep values on disk, addressed by a key.
+
+    Entries are stored as files under <cache_dir>/<xx>/<key>,
+    where xx are the first two characters of the key. Every hit touches
+    the entry's file, so that the modification time reflects the last
+    use. When the total size of the entries goes over max_size (bytes),
+    the least recently used entries are removed.
+
+    The hits and misses attributes count the lookups made through this
+    object.
+
+    '''
+
+    def __init__(self, cache_dir, max_size):
+        self._dir = cache_dir
+        self._max_size = max_size
+        self._size = None   # computed lazily, scanning the cache dir
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        '''Return the full path of the file for the given key.'''
+        return os.path.join(self._dir, key[:2], key)
+
+    def get(self, key):
+        '''Return the value stored for key, or None if there's none.'''
+        fn = self._path(key)
+        try:
+            fin = codecs.open(fn, 'r', encoding='utf-8')
+            value = fin.read()
+            fin.close()
+            os.utime(fn, None)  # mark it as recently used
+        except (IOError, OSError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def copy_to(self, key, dest):
+        '''Copy the entry for key to the file dest.
+
+        This is meant for binary entries (images, etc.) Return True if
+        the entry existed and was copied, False otherwise.
+
+        '''
+        fn = self._path(key)
+        try:
+            shutil.copyfile(fn, dest)
+            os.utime(fn, None)
+        except (IOError, OSError):
+            self.misses += 1
+            return False
+        self.hits += 1
+        return True
+
+    def set(self, key, value):
+        '''Store value (a string) for key, evicting entries if needed.
+
+        The file is written under a temporary name and then renamed, so
+        a reader never sees a half-written entry.
+
+        '''
+        fn = self._path(key)
+        d = os.path.dirname(fn)
+        if not os.path.isdir(d):
+            try:
+                os.makedirs(d)
+            except OSError: # pragma: no cover
+                pass  # somebody else just created it
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        fd, tmpname = tempfile.mkstemp(dir=d)
+        os.write(fd, value)
+        os.close(fd)
+        os.rename(tmpname, fn)
+        if self._size is None:
+            self._size = self._scan_size()
+        else:
+            self._size += len(value)
+        if self._size > self._max_size:
+            self.evict()
+
+    def _entries(self):
+        '''Return a list of (mtime, size, path) for all the entries.'''
+        r = []
+        if not os.path.isdir(self._dir):
+            return r
+        for sd in os.listdir(self._dir):
+            sdp = os.path.join(self._dir, sd)
+            if not os.path.isdir(sdp):
+                continue
+            for fn in os.listdir(sdp):
+                fp = os.path.join(sdp, fn)
+                try:
+                    st = os.stat(fp)
+                except OSError: # pragma: no cover
+                    continue
+                r.append((st.st_mtime, st.st_size, fp))
+        return r
+
+    def _scan_size(self):
+        '''Return the total size of the entries in the cache.'''
+        return sum([e[1] for e in self._entries()])
+
+    def evict(self):
+        '''Remove least recently used entries until the cache is small.
+
+        Entries are removed until the total size goes under 90% of the
+        maximum size, so that eviction does not happen on every write.
+
+        '''
+        entries = sorted(self._entries())
+        total = sum([e[1] for e in entries])
+        low_mark = self._max_size * 0.9
+        for (mtime, size, fp) in entries:
+            if total <= low_mark:
+                break
+            try:
+                os.remove(fp)
+            except OSError: # pragma: no cover
+                pass
+            total -= size
+        self._size = total
+
+    @property
+    def size(self):
+        '''Return the total size (in bytes) of the entries.'''
+        if self._size is None:
+            self._size = self._scan_size()
+        return self._size
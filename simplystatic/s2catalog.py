@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+'''This module keeps a catalog of the pages of a site.
+
+The catalog is a summary of every page (title, date, status, tags) kept
+in s2/catalog.json, so that listing the pages of a big site doesn't
+require parsing every page file. Each entry stores the modification
+time and size of the page file it was read from; refresh() re-reads only the
+pages whose file changed (or that are new) and drops the ones that
+disappeared, so pages edited by hand are always picked up.
+
+Functions included:
+
+    - entry_from_config: Build a catalog entry from a page config.
+
+Classes included:
+
+    - Catalog: Load, refresh, update and save the catalog of a site.
+
+'''
+
+import os
+import json
+import tempfile
+
+import s2page
+
+CATALOG_FILE = 'catalog.json'
+CATALOG_VERSION = 1
+
+
+def entry_from_config(config, sig):
+    '''Return a catalog entry for a page config (as parsed from meta).
+
+    sig is the [mtime, size] of the page file.
+
+    '''
+    status = config['status'][0].lower()
+    return {'title': config['title'][0],
+            'date': config['creation_date'][0],
+            'status': status,
+            'tags': [t for t in config['tags'] if t],
+            'published': 'published' in status,
+            'in_toc': not 'no-toc' in status,
+            'sig': sig}
+
+
+class Catalog(object):
+    '''The catalog of the pages of a site.
+
+    entries is a dictionary that maps the slug of each page to its
+    entry (see entry_from_config). Changes are only written to disk by
+    save(), which replaces the catalog file atomically, so a batch of
+    updates is applied all at once or not at all.
+
+    '''
+
+    def __init__(self, site):
+        self.site = site
+        self.entries = {}
+        self._dirty = False
+        self._load()
+
+    @property
+    def path(self):
+        '''Return the full path of the catalog file.'''
+        return os.path.join(self.site.dirs['s2'], CATALOG_FILE)
+
+    def _load(self):
+        try:
+            fin = open(self.path, 'rb')
+            data = json.load(fin)
+            fin.close()
+        except (IOError, ValueError):
+            return
+        if data.get('version') == CATALOG_VERSION:
+            self.entries = data.get('pages', {})
+
+    def _file_sig(self, slug):
+        '''Return [mtime, size] of the page file of slug (see s2storage.)'''
+        return self.site.storage.sig(slug)
+
+    def refresh(self):
+        '''Bring the catalog up to date with the source directory.
+
+        Return the list of slugs whose entry was added or updated.
+
+        '''
+        changed = []
+        names = self.site.get_page_names()
+        for slug in names:
+            try:
+                sig = self._file_sig(slug)
+            except OSError:
+                continue  # a directory without a page file
+            e = self.entries.get(slug)
+            if e is None or e['sig'] != sig:
+                p = s2page.Page(self.site, slug, isslug=True)
+                self.update(p.slug, p._config, sig)
+                changed.append(slug)
+        for slug in set(self.entries) - set(names):
+            del self.entries[slug]
+            self._dirty = True
+        return changed
+
+    def update(self, slug, config, sig=None):
+        '''Set the entry for slug from the page config.
+
+        The page file must have been written already.
+
+        '''
+        if sig is None:
+            sig = self._file_sig(slug)
+        self.entries[slug] = entry_from_config(config, sig)
+        self._dirty = True
+
+    def remove(self, slug):
+        '''Remove the entry for slug, if there's one.'''
+        if slug in self.entries:
+            del self.entries[slug]
+            self._dirty = True
+
+    def save(self):
+        '''Write the catalog, if it changed, replacing the old file.'''
+        if not self._dirty:
+            return
+        d = os.path.dirname(self.path)
+        fd, tmpname = tempfile.mkstemp(dir=d)
+        os.write(fd, json.dumps({'version': CATALOG_VERSION,
+                                 'pages': self.entries},
+                                sort_keys=True))
+        os.close(fd)
+        os.rename(tmpname, self.path)
+        self._dirty = False
+
+    def published(self):
+        '''Return the slugs of published pages, newest first.'''
+        ptg = [(e['date'], slug) for (slug, e) in self.entries.items()
+               if e['published']]
+        return [slug for (d, slug) in sorted(ptg, reverse=True)]
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+'''This module keeps a site in memory, and runs s2 commands on it.
+
+Every s2 command starts by finding the site, reading its config and
+catalog and compiling its templates. s2 daemon does that once, and
+then listens on a Unix socket (s2/daemon.sock) for commands, which run
+on the same Site object: the catalog, the compiled templates, the
+markdown converters and the caches stay warm between them.
+
+A request is a line of JSON with the arguments of the command (the
+dictionary built by the s2 command line parser), {"stop": true} to
+stop the daemon, or {"ping": true} to check that it's there. The
+answer is a line of JSON with the 'status' the command exited with and
+its 'output'. Requests are run one at a time, in the order they
+arrive.
+
+Functions included:
+
+    - socket_path: Return the path of the daemon socket of a site.
+    - send_request: Send a command to the daemon of a site, if any.
+    - serve: Run the daemon of a site until it's stopped.
+
+Classes included:
+
+    - DaemonServer: Run the commands received on the socket.
+    - DaemonRequestHandler: Read a request and write the answer.
+
+'''
+
+import os
+import sys
+import json
+import time
+import socket
+import traceback
+import SocketServer
+
+SOCKET_FILE = 'daemon.sock'
+
+
+def socket_path(base_dir):
+    '''Return the path of the daemon socket of the site in base_dir.'''
+    return os.path.join(base_dir, 's2', SOCKET_FILE)
+
+
+def send_request(base_dir, request):
+    '''Send request to the daemon of the site in base_dir.
+
+    Return the answer (a dictionary with 'status' and 'output'), or
+    None if there's no daemon running for that site.
+
+    '''
+    path = socket_path(base_dir)
+    if not os.path.exists(path):
+        return None
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(path)
+    except socket.error:
+        # a socket left behind by a daemon that died
+        s.close()
+        return None
+    s.sendall(json.dumps(request) + '\n')
+    f = s.makefile('rb')
+    line = f.readline()
+    f.close()
+    s.close()
+    if not line:
+        return None
+    return json.loads(line)
+
+
+def _native(value):
+    '''Return value with its unicode strings encoded as utf-8.
+
+    The command line gives the commands byte strings, not unicode.
+
+    '''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, list):
+        return [_native(v) for v in value]
+    if isinstance(value, dict):
+        return dict([(_native(k), _native(v)) for (k, v) in value.items()])
+    return value
+
+
+class _Output(object):
+    '''Collect what a command prints (as utf-8).'''
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, s):
+        if isinstance(s, unicode):
+            s = s.encode('utf-8')
+        self.parts.append(s)
+
+    def flush(self):
+        pass
+
+    def getvalue(self):
+        return ''.join(self.parts).decode('utf-8', 'replace')
+
+
+class DaemonRequestHandler(SocketServer.StreamRequestHandler):
+    '''Read a request line, run it, and write the answer line.'''
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+        except ValueError:
+            request = None
+        if not isinstance(request, dict):
+            answer = {'status': 2, 'output': u'Bad request.\n'}
+        elif request.get('ping'):
+            answer = {'status': 0, 'output': u''}
+        elif request.get('stop'):
+            self.server.stopped = True
+            answer = {'status': 0, 'output': u'Daemon stopped.\n'}
+        else:
+            answer = self.server.run(request)
+        self.wfile.write(json.dumps(answer) + '\n')
+
+
+class DaemonServer(SocketServer.UnixStreamServer):
+    '''Listen on the daemon socket of site, and run the commands received.
+
+    run_command is called with the arguments of each command; it runs
+    the command on site (see bin/s2.py). What it prints is sent back.
+
+    '''
+
+    def __init__(self, site, run_command):
+        self.site = site
+        self.run_command = run_command
+        self.stopped = False
+        self.requests_run = 0
+        SocketServer.UnixStreamServer.__init__(self,
+                            socket_path(site.dirs['base']), DaemonRequestHandler)
+
+    def run(self, argdict):
+        '''Run a command, and return the answer for the client.'''
+        site = self.site
+        # the config may have been edited since the last command
+        site.reload_config()
+        for c in site.caches.values():
+            c.hits = c.misses = 0
+        site.template_hits = site.template_misses = 0
+        out = _Output()
+        status = 0
+        st = time.time()
+        old_stdout = sys.stdout
+        sys.stdout = out
+        try:
+            self.run_command(_native(argdict))
+        except SystemExit as e:
+            if isinstance(e.code, int):
+                status = e.code
+            elif e.code is not None:
+                print e.code
+                status = 1
+        except Exception:
+            traceback.print_exc(file=out)
+            status = 1
+        finally:
+            sys.stdout = old_stdout
+        self.requests_run += 1
+        print "%s: status %d in %f seconds." % (argdict.get('command'),
+                                                status, time.time() - st)
+        return {'status': status, 'output': out.getvalue()}
+
+    def serve_until_stopped(self):
+        while not self.stopped:
+            self.handle_request()
+
+
+def serve(site, run_command):
+    '''Run the daemon of site until a stop request arrives.
+
+    Raise ValueError if there's already a daemon running for the site.
+
+    '''
+    path = socket_path(site.dirs['base'])
+    if os.path.exists(path):
+        if send_request(site.dirs['base'], {'ping': True}) is not None:
+            raise ValueError("there's already a daemon for this site.")
+        os.remove(path)  # left behind by a daemon that died
+    server = DaemonServer(site, run_command)
+    print "Daemon listening on " + path
+    try:
+        server.serve_until_stopped()
+    finally:
+        server.server_close()
+        os.remove(path)
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+'''This module deploys a generated site to a target directory.
+
+The target is usually a mounted web root. A manifest of the deployed
+files (relative path -> sha1 of the content) is kept in the target, in
+.s2manifest.json. On each deploy, a new manifest is computed for www
+and compared with it, so only the files that were added or changed are
+copied (in parallel), and the files that are gone are deleted. Since
+generate rewrites all of www, comparing contents (not dates or sizes)
+is what keeps unchanged files from being copied again. The contents are
+hashed with s2cache.file_hash, as in the keys of the caches.
+
+The other files are copied before the html files, so a page never
+refers to an image or stylesheet that isn't there yet, and files are
+only deleted after the pages that used them were replaced.
+
+Functions included:
+
+    - build_manifest: Return the manifest of a directory.
+    - load_manifest: Return the manifest saved in a target directory.
+    - read_manifest_file, write_manifest_file: Load/save a manifest.
+    - relpath_url: Return the url of a file of www.
+    - diff_manifests: Compare two manifests.
+    - deploy: Deploy a www directory to a target directory.
+
+'''
+
+import os
+import json
+import urllib
+import shutil
+import tempfile
+from multiprocessing.pool import ThreadPool
+
+import s2cache
+
+MANIFEST_NAME = '.s2manifest.json'
+HTML_EXTENSIONS = ('.html', '.htm')
+
+
+def _walk_files(root):
+    '''Return the sorted list of files under root, relative, with / .'''
+    r = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        rd = os.path.relpath(dirpath, root).replace(os.sep, '/')
+        for fn in filenames:
+            r.append(fn if rd == '.' else rd + '/' + fn)
+    return sorted(r)
+
+
+def build_manifest(root, threads=8):
+    '''Return a dictionary relpath -> sha1 for the files under root.
+
+    Symbolic links are followed (fixed_frontpage makes index.html one.)
+
+    '''
+    files = [f for f in _walk_files(root) if f != MANIFEST_NAME]
+    def job(relpath):
+        return (relpath, s2cache.file_hash(os.path.join(root,
+                                                        *relpath.split('/'))))
+    pool = ThreadPool(threads)
+    try:
+        return dict(pool.map(job, files))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def read_manifest_file(path):
+    '''Return the data saved by write_manifest_file, or {} if none.'''
+    try:
+        fin = open(path, 'rb')
+        data = json.load(fin)
+        fin.close()
+    except (IOError, ValueError):
+        return {}
+    return data
+
+
+def write_manifest_file(path, manifest, **extra):
+    '''Save manifest (and the extra items) to path, atomically.'''
+    data = dict(extra)
+    data['files'] = manifest
+    fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(path))
+    os.write(fd, json.dumps(data, sort_keys=True, indent=0))
+    os.close(fd)
+    os.rename(tmpname, path)
+
+
+def load_manifest(target):
+    '''Return the manifest saved in target, or {} if there's none.'''
+    return read_manifest_file(os.path.join(target, MANIFEST_NAME)).get('files', {})
+
+
+def relpath_url(base_url, relpath):
+    '''Return the url of the file relpath of www, given the site url.
+
+    index.html files are given the url of their directory, which is
+    the one that's linked and cached.
+
+    '''
+    if not base_url.endswith('/'):
+        base_url += '/'
+    if relpath == 'index.html':
+        relpath = ''
+    elif relpath.endswith('/index.html'):
+        relpath = relpath[:-len('index.html')]
+    if isinstance(relpath, unicode):
+        relpath = relpath.encode('utf-8')
+    return base_url + urllib.quote(relpath)
+
+
+def diff_manifests(old, new):
+    '''Return (added, changed, removed), sorted lists of relpaths.'''
+    added = sorted([f for f in new if not f in old])
+    changed = sorted([f for f in new if f in old and old[f] != new[f]])
+    removed = sorted([f for f in old if not f in new])
+    return (added, changed, removed)
+
+
+def _is_html(relpath):
+    return os.path.splitext(relpath)[1].lower() in HTML_EXTENSIONS
+
+
+def _copy(src_root, dest_root, relpath):
+    parts = relpath.split('/')
+    dest = os.path.join(dest_root, *parts)
+    d = os.path.dirname(dest)
+    if not os.path.isdir(d):
+        try:
+            os.makedirs(d)
+        except OSError: # pragma: no cover
+            if not os.path.isdir(d):  # created by another thread
+                raise
+    if os.path.islink(dest):
+        os.remove(dest)
+    # copy to a temporary name, so the file is replaced in one step
+    tmp = dest + '.s2tmp'
+    shutil.copyfile(os.path.join(src_root, *parts), tmp)
+    os.rename(tmp, dest)
+
+
+def _remove(dest_root, relpath):
+    '''Remove a file, and the directories it leaves empty.'''
+    path = os.path.join(dest_root, *relpath.split('/'))
+    if os.path.lexists(path):
+        os.remove(path)
+    d = os.path.dirname(path)
+    while os.path.abspath(d) != os.path.abspath(dest_root) and \
+            os.path.isdir(d) and not os.listdir(d):
+        os.rmdir(d)
+        d = os.path.dirname(d)
+
+
+def deploy(www_dir, target, dry_run=False, threads=8):
+    '''Deploy www_dir to the target directory (created if needed.)
+
+    Copy the added and changed files (all but html first, then html),
+    delete the removed ones, and save the new manifest in target. With
+    dry_run, nothing is changed.
+
+    Return (added, changed, removed), as diff_manifests.
+
+    '''
+    new = build_manifest(www_dir, threads)
+    old = load_manifest(target)
+    (added, changed, removed) = diff_manifests(old, new)
+    if dry_run:
+        return (added, changed, removed)
+    if not os.path.isdir(target):
+        os.makedirs(target)
+    to_copy = added + changed
+    pool = ThreadPool(threads)
+    try:
+        for group in ([f for f in to_copy if not _is_html(f)],
+                      [f for f in to_copy if _is_html(f)]):
+            pool.map(lambda f: _copy(www_dir, target, f), group)
+    finally:
+        pool.close()
+        pool.join()
+    for f in removed:
+        _remove(target, f)
+    write_manifest_file(os.path.join(target, MANIFEST_NAME), new)
+    return (added, changed, removed)
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+'''This module asks git what changed in a site since a commit.
+
+Modification times are useless after a fresh clone (every file looks
+new), but a site kept in git (as it should be) can tell exactly which
+files changed since the commit of the last generation. The local git
+binary is used; every function returns None when git is not there,
+the site is not in a repository, or the commit is not in the history
+(e.g. in a shallow clone), so the caller can fall back to a whole
+generation.
+
+Functions included:
+
+    - head_commit: Return the commit checked out in a directory.
+    - changed_paths: Return the files changed since a commit.
+
+'''
+
+import os
+import subprocess
+
+
+def _git(base_dir, *args):
+    '''Run git in base_dir, and return its output, or None if it failed.'''
+    try:
+        p = subprocess.Popen(('git',) + args, cwd=base_dir,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        (out, err) = p.communicate()
+    except OSError:
+        return None  # no git here
+    if p.returncode != 0:
+        return None
+    return out
+
+
+def head_commit(base_dir):
+    '''Return the id of the commit checked out in base_dir, or None.'''
+    out = _git(base_dir, 'rev-parse', '--verify', '-q', 'HEAD')
+    if not out:
+        return None
+    return out.strip()
+
+
+def changed_paths(base_dir, since, dirs):
+    '''Return the files under dirs changed since the commit since.
+
+    dirs and the paths returned are relative to base_dir (with / as
+    separator). Both the commits after since and the changes not
+    committed yet (including new files) count. Return None if git
+    can't tell.
+
+    '''
+    if _git(base_dir, 'cat-file', '-e', since + '^{commit}') is None:
+        return None
+    paths = set()
+    # since against the working tree. -z: the paths are not quoted;
+    # --relative: they are relative to base_dir, which may be below
+    # the top of the repository
+    out = _git(base_dir, 'diff', '--name-only', '-z', '--no-renames',
+               '--relative', since, '--', *dirs)
+    if out is None:
+        return None
+    paths.update([p for p in out.split('\0') if p])
+    out = _git(base_dir, 'ls-files', '-z', '--others', '--exclude-standard',
+               '--', *dirs)
+    if out is None:
+        return None
+    paths.update([p for p in out.split('\0') if p])
+    return sorted(paths)
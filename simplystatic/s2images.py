@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+'''This module creates resized variants of the images of the site.
+
+If the site config has a list of widths in 'image_widths', every jpeg
+and png image in the page directories and in the common directory gets,
+besides the original copy, one resized variant per width (only widths
+smaller than the original are produced). If 'image_webp' is true and
+Pillow supports it, a WebP version of each variant is produced too.
+
+Variants are named after the original image and the width, e.g.
+photo.jpg -> photo-480w.jpg and photo-480w.webp, and they are placed
+next to the original in www.
+
+This stage needs Pillow (PIL). If it is not installed, images are just
+copied as they always were, and so are the images that Pillow can't read
+(corrupt or misnamed files.)
+
+Resized images are kept in the site's 'images' cache, keyed by the hash
+of the source image and the target size and format, so they are only
+computed once. Resizing is done in a process pool. A directory whose
+images haven't changed (same names, sizes and modification times) skips
+the stage: its variants are copied straight from the cache.
+
+Functions included:
+
+    - available: True if Pillow is installed.
+    - variant_name: Name of the variant of an image for a width/format.
+    - srcset: Build the srcset attribute value for an image.
+
+Classes included:
+
+    - ImageStage: Produces the variants for the images in a directory.
+
+'''
+
+import os
+import json
+import multiprocessing
+from StringIO import StringIO
+
+try:
+    from PIL import Image
+except ImportError: # pragma: no cover
+    Image = None
+
+import s2cache
+
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png']
+PIL_FORMATS = {'.jpg': 'JPEG', '.jpeg': 'JPEG', '.png': 'PNG',
+               '.webp': 'WEBP'}
+QUALITY = 85
+
+
+def available():
+    '''Return True if the image stage can be used (Pillow is there).'''
+    return Image is not None
+
+
+def webp_supported():
+    '''Return True if Pillow can write WebP images.'''
+    if Image is None:
+        return False
+    Image.init()
+    return 'WEBP' in Image.SAVE
+
+
+def variant_name(relpath, width, ext=None):
+    '''Return the name of the variant of relpath for the given width.
+
+    If ext (e.g. '.webp') is given, it replaces the original extension.
+
+    '''
+    base, oext = os.path.splitext(relpath)
+    return '%s-%dw%s' % (base, width, ext or oext)
+
+
+def _image_width(path):
+    '''Return the width of the image in path, or None if it can't be read.'''
+    try:
+        im = Image.open(path)  # only reads the header
+    except (IOError, SyntaxError):
+        return None
+    try:
+        return im.size[0]
+    finally:
+        im.close()
+
+
+def _resize(job):
+    '''Resize an image to the given width. Run in the worker processes.
+
+    job is (source path, width, extension of the result). Return the
+    data of the resized image, or None if the image can't be read.
+
+    '''
+    (src, width, ext) = job
+    try:
+        im = Image.open(src)
+        try:
+            owidth, oheight = im.size
+            height = max(1, int(round(oheight * float(width) / owidth)))
+            resized = im.resize((width, height), Image.ANTIALIAS)
+        finally:
+            im.close()
+    except (IOError, SyntaxError):
+        return None
+    im = resized
+    fmt = PIL_FORMATS[ext]
+    if fmt == 'JPEG' and im.mode not in ('RGB', 'L'):
+        im = im.convert('RGB')
+    buf = StringIO()
+    im.save(buf, fmt, quality=QUALITY)
+    return buf.getvalue()
+
+
+class ImageStage(object):
+    '''Produce the resized variants of the images of a site.
+
+    One object is used for a whole generation (see Site.get_image_stage)
+    so that the process pool is only started once, and only if there's
+    something to resize. Call close() when done.
+
+    '''
+
+    def __init__(self, site):
+        self.site = site
+        self.widths = sorted(site.site_config.get('image_widths') or [])
+        self.formats = [None]
+        if site.site_config.get('image_webp', True) and webp_supported():
+            self.formats.append('.webp')
+        self._pool = None
+
+    @property
+    def enabled(self):
+        '''True if there are widths configured and Pillow is available.'''
+        return available() and len(self.widths) > 0
+
+    def _find_images(self, src_dir, skip):
+        '''Return the sorted relative paths of the images in src_dir.'''
+        r = []
+        for dirpath, dirnames, filenames in os.walk(src_dir):
+            dirnames[:] = [d for d in dirnames if not d in skip]
+            for fn in filenames:
+                if os.path.splitext(fn)[1].lower() in IMAGE_EXTENSIONS:
+                    fp = os.path.join(dirpath, fn)
+                    r.append(os.path.relpath(fp, src_dir))
+        return sorted(r)
+
+    def process_dir(self, src_dir, dest_dir, skip=()):
+        '''Create the variants of the images of src_dir in dest_dir.
+
+        dest_dir must already contain the copy of src_dir (the variants
+        are written next to the copied originals.) Directories named in
+        skip are ignored. Return a dictionary that maps the relative
+        path of each image to a list of (variant path, width, ext).
+
+        '''
+        images = self._find_images(src_dir, skip)
+        if not images:
+            return {}
+        cache = self.site.get_cache('images')
+        stats = []
+        for rp in images:
+            st = os.stat(os.path.join(src_dir, rp))
+            stats.append((rp, st.st_size, st.st_mtime))
+        set_key = s2cache.make_key('imageset', self.widths, self.formats,
+                                   QUALITY, stats)
+        cached = cache.get(set_key)
+        if cached is not None:
+            variants = json.loads(cached)
+            if self._copy_variants(variants, dest_dir):
+                return self._as_result(variants)
+        variants = self._make_variants(src_dir, dest_dir, images)
+        cache.set(set_key, json.dumps(variants))
+        return self._as_result(variants)
+
+    def _make_variants(self, src_dir, dest_dir, images):
+        '''Write the variants of images to dest_dir.
+
+        Return a list of [relpath, variant path, width, ext, cache key],
+        which includes an entry (with no key) for each original image.
+        Images that can't be read are left out (they're just copied.)
+
+        '''
+        cache = self.site.get_cache('images')
+        variants = []
+        jobs = []
+        for rp in images:
+            src = os.path.join(src_dir, rp)
+            owidth = _image_width(src)
+            if owidth is None:
+                print "Can't read the image %s; it's just copied." % src
+                continue
+            oext = os.path.splitext(rp)[1].lower()
+            variants.append([rp, rp, owidth, oext, None])
+            h = s2cache.file_hash(src)
+            for w in self.widths:
+                if w >= owidth:
+                    continue  # never enlarge
+                for ext in self.formats:
+                    vext = ext or oext
+                    k = s2cache.make_key('image', h, w, vext, QUALITY)
+                    v = [rp, variant_name(rp, w, ext), w, vext, k]
+                    variants.append(v)
+                    if not cache.copy_to(k, os.path.join(dest_dir, v[1])):
+                        jobs.append((v, (src, w, vext)))
+        if jobs:
+            if self._pool is None:
+                self._pool = multiprocessing.Pool()
+            results = self._pool.map(_resize, [j[1] for j in jobs])
+            for ((v, job), data) in zip(jobs, results):
+                if data is None:
+                    print "Can't resize the image %s; it's just copied." % job[0]
+                    variants = [e for e in variants if e[0] != v[0]]
+                    continue
+                cache.set(v[4], data)
+                fout = open(os.path.join(dest_dir, v[1]), 'wb')
+                fout.write(data)
+                fout.close()
+        return sorted(variants)
+
+    def _copy_variants(self, variants, dest_dir):
+        '''Copy the variants from the cache. False if any is missing.'''
+        cache = self.site.get_cache('images')
+        for (rp, vname, w, ext, k) in variants:
+            if k is not None and \
+                    not cache.copy_to(k, os.path.join(dest_dir, vname)):
+                return False
+        return True
+
+    def _as_result(self, variants):
+        r = {}
+        for (rp, vname, w, ext, k) in variants:
+            r.setdefault(rp, []).append((vname, w, ext))
+        return r
+
+    def close(self):
+        '''Stop the process pool, if it was started.'''
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+
+def srcset(variants, relpath, ext=None):
+    '''Return a srcset attribute value for the image relpath.
+
+    variants is the dictionary returned by ImageStage.process_dir.
+    If ext is given (e.g. '.webp') only variants in that format are
+    listed; otherwise, those in the original format (including the
+    original image itself.) If there are none, relpath is returned.
+
+    '''
+    want = ext or os.path.splitext(relpath)[1].lower()
+    parts = ['%s %dw' % (v, w) for (v, w, e) in variants.get(relpath, [])
+             if e == want]
+    if not parts:
+        return relpath
+    return ', '.join(parts)
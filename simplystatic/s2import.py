@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+'''This module reads pages to be imported in bulk into a site.
+
+Pages can come from a directory of Markdown files or from a JSON-lines
+stream (one JSON object per line). Either way, each page is turned into
+a record, a dictionary with these keys:
+
+    - title: The title of the page (required).
+    - date: The creation date, as YYYY-MM-DD (default: today).
+    - tags: A list of tags (a comma-separated string is also accepted).
+    - status: The status of the page (default: draft).
+    - author: The author (default: the default author of the site).
+    - body: The markdown content.
+
+A line of a JSON-lines stream that is not a JSON object gives a record
+with just an ERROR_KEY item (its line number and what's wrong), which
+normalize_record rejects, so it's skipped like any other bad record.
+
+A Markdown file can start with a YAML front matter block (between two
+'---' lines) with any of those keys. Otherwise, the title is taken from
+a first line like '# Title', or else from the file name. A file name
+starting with a date (2013-05-02-my-post.md) gives the date of the page.
+
+Site.bulk_import does the actual import.
+
+Functions included:
+
+    - read_markdown_dir: Yield the records for the .md files of a dir.
+    - parse_markdown_file: Return the record for a Markdown file.
+    - read_jsonl: Yield the records in a JSON-lines file object.
+    - normalize_record: Check a record and fill in the default values.
+
+'''
+
+import os
+import re
+import json
+import codecs
+import datetime
+
+import yaml
+
+DATE_PREFIX_RE = re.compile(r'^(\d{4}-\d{2}-\d{2})[-_ ]+(.*)$')
+# key of the records for lines that could not be read (see read_jsonl)
+ERROR_KEY = '_error'
+
+
+def _unicode(v):
+    if isinstance(v, str):
+        return unicode(v, 'utf-8')
+    return unicode(v)
+
+
+def normalize_record(rec):
+    '''Return a copy of the record rec with all the fields set.
+
+    Raise ValueError if the record has no title or a bad date, or if
+    it's not a dictionary or it's an error record (see read_jsonl.)
+
+    '''
+    if not isinstance(rec, dict):
+        raise ValueError('record is not a dictionary')
+    if ERROR_KEY in rec:
+        raise ValueError(rec[ERROR_KEY])
+    title = u' '.join(_unicode(rec.get('title') or u'').split())
+    if not title:
+        raise ValueError('record without a title')
+    date = rec.get('date') or datetime.date.today()
+    if isinstance(date, datetime.date):
+        date = date.isoformat()
+    date = _unicode(date)[:10]
+    datetime.datetime.strptime(date, '%Y-%m-%d')  # raises ValueError
+    tags = rec.get('tags') or []
+    if isinstance(tags, basestring):
+        tags = tags.split(',')
+    tags = [_unicode(t).strip() for t in tags if _unicode(t).strip()]
+    r = {'title': title,
+         'date': date,
+         'tags': tags,
+         'status': _unicode(rec.get('status') or u'draft'),
+         'body': _unicode(rec.get('body') or u'')}
+    if rec.get('author'):
+        r['author'] = _unicode(rec['author'])
+    return r
+
+
+def parse_markdown_file(path):
+    '''Return the record for the Markdown file in path.'''
+    fin = codecs.open(path, 'r', encoding='utf-8')
+    text = fin.read()
+    fin.close()
+    rec = {}
+    lines = text.split(u'\n')
+    if lines and lines[0].strip() == u'---':
+        for i in range(1, len(lines)):
+            if lines[i].strip() == u'---':
+                rec = yaml.safe_load(u'\n'.join(lines[1:i])) or {}
+                lines = lines[i + 1:]
+                break
+    if not rec.get('title'):
+        while lines and lines[0].strip() == u'':
+            lines = lines[1:]
+        if lines and lines[0].startswith(u'# '):
+            rec['title'] = lines[0][2:].strip()
+            lines = lines[1:]
+    name = os.path.splitext(os.path.basename(path))[0]
+    m = DATE_PREFIX_RE.match(name)
+    if m:
+        rec.setdefault('date', m.group(1))
+        name = m.group(2)
+    if not rec.get('title'):
+        rec['title'] = name.replace('-', ' ').replace('_', ' ')
+    rec['body'] = u'\n'.join(lines).strip()
+    return rec
+
+
+def read_markdown_dir(path):
+    '''Yield the records for the .md files in path (and its subdirs).'''
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames.sort()
+        for fn in sorted(filenames):
+            if os.path.splitext(fn)[1].lower() in ('.md', '.markdown'):
+                yield parse_markdown_file(os.path.join(dirpath, fn))
+
+
+def read_jsonl(fin):
+    '''Yield the records in fin, a file object with one JSON per line.
+
+    A line that is not a JSON object gives an error record (see
+    normalize_record.)
+
+    '''
+    for (n, line) in enumerate(fin, 1):
+        if not line.strip():
+            continue
+        try:
+            rec = json.loads(line)
+        except ValueError as e:
+            yield {ERROR_KEY: 'line %d is not valid JSON (%s)' % (n, e)}
+            continue
+        if not isinstance(rec, dict):
+            yield {ERROR_KEY: 'line %d is not a JSON object' % n}
+            continue
+        yield rec
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+'''This module checks the internal links of a generated site.
+
+Every html file of the www directory (or only some of them) is parsed,
+in a pool of processes, with a streaming parser that collects the urls
+of links, images, scripts and stylesheets, and the ids of the elements.
+Urls that point to other sites are ignored. The rest are resolved
+against the www tree, the way a browser would if www were the root of
+the site, and checked against the set of files in www, which is built
+once, in memory. If a link has a fragment (page.html#section), the
+target page must also have an element with that id (or an <a> with
+that name.)
+
+Functions included:
+
+    - scan_file: Return the links and the anchors of an html file.
+    - resolve: Resolve a url found in a page to a path in www.
+    - check_links: Check the links of the pages of a www directory.
+
+Classes included:
+
+    - LinkParser: HTMLParser that collects links and anchors.
+
+'''
+
+import os
+import codecs
+import posixpath
+import urllib
+import urlparse
+import multiprocessing
+from HTMLParser import HTMLParser, HTMLParseError
+
+HTML_EXTENSIONS = ('.html', '.htm')
+# attributes that hold urls, per tag
+LINK_ATTRS = {'a': ['href'], 'link': ['href'], 'area': ['href'],
+              'img': ['src', 'srcset'], 'script': ['src'],
+              'iframe': ['src'], 'source': ['src', 'srcset'],
+              'audio': ['src'], 'video': ['src', 'poster'],
+              'embed': ['src']}
+IGNORED_SCHEMES = ('mailto', 'javascript', 'data', 'tel')
+CHUNK_SIZE = 64 * 1024
+
+
+class LinkParser(HTMLParser):
+    '''Collect the links (url, line) and the anchors of a document.'''
+
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.links = []
+        self.anchors = set()
+
+    def handle_starttag(self, tag, attrs):
+        for (name, value) in attrs:
+            if value is None:
+                continue
+            if name == 'id' or (tag == 'a' and name == 'name'):
+                self.anchors.add(value)
+            elif name in LINK_ATTRS.get(tag, ()):
+                line = self.getpos()[0]
+                if name == 'srcset':
+                    for candidate in value.split(','):
+                        if candidate.strip():
+                            url = candidate.split()[0]
+                            self.links.append((url, line))
+                else:
+                    self.links.append((value.strip(), line))
+
+    handle_startendtag = handle_starttag
+
+
+def scan_file(path):
+    '''Return (links, anchors, error) for the html file path.
+
+    The file is fed to the parser in chunks, so it's never held whole
+    in memory. error is None, or a message if the file couldn't be
+    parsed (the links found up to that point are still returned.)
+
+    '''
+    parser = LinkParser()
+    decoder = codecs.getincrementaldecoder('utf-8')('replace')
+    error = None
+    fin = open(path, 'rb')
+    try:
+        while True:
+            chunk = fin.read(CHUNK_SIZE)
+            parser.feed(decoder.decode(chunk, final=not chunk))
+            if not chunk:
+                break
+        parser.close()
+    except HTMLParseError as e:
+        error = str(e)
+    fin.close()
+    return (parser.links, list(parser.anchors), error)
+
+
+def _scan_job(job):
+    '''Run scan_file in a worker process. job is (www_dir, relpath).'''
+    (www_dir, relpath) = job
+    return (relpath,) + scan_file(os.path.join(www_dir, *relpath.split('/')))
+
+
+def resolve(page, url, files):
+    '''Resolve url, found in page, to (relpath, fragment).
+
+    page is the path of the page relative to www, with / as separator;
+    files is the set of all such paths. Return None for urls that are
+    not internal. relpath is the file the url points to (a directory
+    means its index.html) whether it exists or not. Like a browser,
+    '..' never goes above the root.
+
+    '''
+    u = urlparse.urlsplit(url)
+    if u.scheme or u.netloc:
+        return None
+    path = urllib.unquote(u.path)
+    if path == '':
+        return (page, u.fragment)  # '#anchor' or '?query' in the same page
+    if path.startswith('/'):
+        full = path
+    else:
+        full = posixpath.join('/' + posixpath.dirname(page), path)
+    rel = posixpath.normpath(full).lstrip('/')
+    if rel == '.' or rel == '':
+        rel = 'index.html'
+    elif path.endswith('/') or (not rel in files and
+                                rel + '/index.html' in files):
+        rel = rel + '/index.html'
+    return (rel, u.fragment)
+
+
+def _is_ignored(url):
+    if url in ('', '#', '#top'):  # these always work in a browser
+        return True
+    scheme = urlparse.urlsplit(url).scheme.lower()
+    return scheme in IGNORED_SCHEMES
+
+
+def _scan_all(www_dir, relpaths, processes):
+    '''Return an iterator of _scan_job results for relpaths.'''
+    jobs = [(www_dir, rp) for rp in relpaths]
+    if processes == 1 or len(jobs) < 2:
+        return (map(_scan_job, jobs), None)
+    pool = multiprocessing.Pool(processes)
+    return (pool.imap_unordered(_scan_job, jobs, chunksize=16), pool)
+
+
+def check_links(www_dir, pages=None, processes=None):
+    '''Check the internal links of the html files in www_dir.
+
+    pages, if given, is the list of files (relative to www_dir) whose
+    links are checked; otherwise all the html files are checked. The
+    target of a link with a fragment is parsed too, when needed, to get
+    its anchors. processes is the size of the process pool (the number
+    of CPUs by default; 1 means no pool.)
+
+    Return a dictionary that maps each page with problems to a sorted
+    list of (line, url, problem) tuples.
+
+    '''
+    files = set()
+    for dirpath, dirnames, filenames in os.walk(www_dir):
+        rd = os.path.relpath(dirpath, www_dir).replace(os.sep, '/')
+        for fn in filenames:
+            files.add(fn if rd == '.' else rd + '/' + fn)
+    html = sorted([f for f in files
+                   if os.path.splitext(f)[1].lower() in HTML_EXTENSIONS])
+    if pages is None:
+        pages = html
+    else:
+        pages = sorted(set([p.replace(os.sep, '/') for p in pages]) & files)
+
+    scanned = {}   # relpath -> (links, anchors, error)
+    (results, pool) = _scan_all(www_dir, pages, processes)
+    for (rp, links, anchors, error) in results:
+        scanned[rp] = (links, set(anchors), error)
+    # anchors of other pages are only needed for links with fragments
+    targets = set()
+    for rp in pages:
+        for (url, line) in scanned[rp][0]:
+            if _is_ignored(url):
+                continue
+            r = resolve(rp, url, files)
+            if r and r[1] and r[0] in files and not r[0] in scanned and \
+                    os.path.splitext(r[0])[1].lower() in HTML_EXTENSIONS:
+                targets.add(r[0])
+    if targets:
+        if pool is None:
+            (results, pool) = _scan_all(www_dir, sorted(targets), processes)
+        else:
+            results = pool.imap_unordered(_scan_job,
+                                          [(www_dir, t) for t in targets])
+        for (rp, links, anchors, error) in results:
+            scanned[rp] = (None, set(anchors), error)
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    report = {}
+    for rp in pages:
+        (links, anchors, error) = scanned[rp]
+        problems = []
+        if error:
+            problems.append((0, '', 'parse error: ' + error))
+        for (url, line) in links:
+            if _is_ignored(url):
+                continue
+            r = resolve(rp, url, files)
+            if r is None:
+                continue
+            (target, fragment) = r
+            if not target in files:
+                problems.append((line, url, 'missing file'))
+            elif fragment and target in scanned and \
+                    not fragment in scanned[target][1]:
+                problems.append((line, url, 'missing anchor'))
+        if problems:
+            report[rp] = sorted(problems)
+    return report
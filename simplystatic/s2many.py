@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+'''This module generates many sites in one go.
+
+The sites are generated in a pool of worker processes, so the
+interpreter starts and the modules are imported only once. All the
+sites use the same directory for the compiled mako templates, whose
+modules are named after the contents of the template files (see
+Site.get_template), so a theme used by many sites (e.g. the bundled
+blog1) is compiled only once. Optionally, the caches that only depend
+on the content (markdown html, highlighted code, resized images) are
+also shared, in a common cache directory.
+
+Functions included:
+
+    - find_sites: Return the base dirs of the sites given by a path.
+    - build_site: Generate one site and return its result.
+    - generate_many: Generate several sites in a pool of processes.
+
+'''
+
+import os
+import time
+import shutil
+import tempfile
+import multiprocessing
+
+import s2site
+
+
+def find_sites(spec):
+    '''Return the list of base dirs of the sites given by spec.
+
+    spec is a site (or a directory inside one), a directory whose
+    subdirectories are sites, or a file that lists one directory per
+    line (blank lines and lines that start with # are skipped.) Only
+    directories with a valid s2 structure are returned, once each.
+
+    '''
+    if os.path.isfile(spec):
+        fin = open(spec, 'r')
+        dirs = [l.strip() for l in fin
+                if l.strip() and not l.strip().startswith('#')]
+        fin.close()
+    else:
+        base = s2site.discover_base_dir(os.path.abspath(spec))
+        if base and s2site.verify_dir_structure(base):
+            return [base]
+        dirs = sorted([os.path.join(spec, d) for d in os.listdir(spec)])
+    r = []
+    for d in dirs:
+        if not os.path.isdir(d):
+            continue
+        base = s2site.discover_base_dir(os.path.abspath(d))
+        if base and s2site.verify_dir_structure(base) and not base in r:
+            r.append(base)
+    return r
+
+
+def build_site(job):
+    '''Generate a site. job is (base_dir, makodir, cache_dir).
+
+    Return a dictionary with the 'dir' of the site, 'ok', the 'error'
+    message if it failed, the number of 'pages', the 'seconds' it took,
+    and the hits and misses of each of its 'caches'.
+
+    '''
+    (base_dir, makodir, cache_dir) = job
+    st = time.time()
+    r = {'dir': base_dir, 'ok': False, 'error': None, 'pages': 0,
+         'caches': {}}
+    try:
+        site = s2site.Site(base_dir)
+        site.use_shared_dirs(makodir, cache_dir)
+        site.generate()
+        r['ok'] = True
+        r['pages'] = len(site.get_catalog().published())
+        r['caches'] = dict([(name, (c.hits, c.misses))
+                            for (name, c) in site.caches.items()])
+    except SystemExit:
+        # generate stops this way on pages with wrong dates
+        r['error'] = 'generation stopped'
+    except Exception as e:
+        r['error'] = '%s: %s' % (e.__class__.__name__, e)
+    r['seconds'] = time.time() - st
+    return r
+
+
+def generate_many(dirs, processes=None, cache_dir=None):
+    '''Generate the sites in dirs. Yield their results as they finish.
+
+    processes is the size of the pool (the number of CPUs by default;
+    1 means no pool.) If cache_dir is given, the shareable caches and
+    the compiled templates are kept there, so they are also reused by
+    the next runs; otherwise, the templates go to a temporary
+    directory, and each site uses its own caches.
+
+    '''
+    if cache_dir is not None:
+        makodir = os.path.join(cache_dir, 'mako')
+        tmpdir = None
+    else:
+        makodir = tmpdir = tempfile.mkdtemp()
+    jobs = [(d, makodir, cache_dir) for d in dirs]
+    pool = None
+    try:
+        if processes == 1 or len(jobs) < 2:
+            results = (build_site(j) for j in jobs)
+        else:
+            pool = multiprocessing.Pool(processes)
+            results = pool.imap_unordered(build_site, jobs)
+        for r in results:
+            yield r
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir, ignore_errors=True)
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+'''This module converts IPython/Jupyter notebooks to html.
+
+A page can include a notebook (an .ipynb file in its source directory,
+named in the 'notebook' item of its configuration). When the page is
+rendered, the notebook is converted to html with the structure expected
+by the ipynb.css file of the themes, and appended to the page content.
+
+Images found in the outputs of the notebook (which are embedded as
+base64 strings) are not inlined in the html. Each one is decoded and
+stored in the site's 'nbimages' cache, named after the hash of its
+content, and the html just links to that name. Page.generate copies
+the images to the www directory of the page (if some were evicted from
+the cache, the notebook is converted again, writing its images straight
+to that directory.)
+
+The conversion result is cached (in the 'notebook' cache) by the hash of
+the notebook file, so a notebook is only parsed when it changes (or when
+Pygments or the highlighting options do.)
+
+Functions included:
+
+    - convert: Return the html and the list of images for a notebook.
+
+Classes included:
+
+    - NotebookConverter: Does the actual conversion of a parsed
+                         notebook.
+
+'''
+
+import os
+import re
+import json
+import base64
+import hashlib
+import cgi
+
+import pygments
+
+import s2cache
+import mdx_hilitecache
+
+# name of the template that themes can provide to render notebook pages
+NOTEBOOK_TEMPLATE = 'ipynb.html.tpl'
+
+# output mime types that are shown, in order of preference
+IMAGE_TYPES = [('image/png', 'png', 'png'),
+               ('image/jpeg', 'jpeg', 'jpg'),
+               ('image/gif', 'gif', 'gif')]
+
+# bump this when the produced html changes, to invalidate cached results
+CONVERTER_VERSION = '1'
+
+ANSI_RE = re.compile(r'\x1b\[[0-9;]*m')
+
+
+def _text(v):
+    '''Join the multiline fields of a notebook (strings or lists).'''
+    if isinstance(v, list):
+        return u''.join(v)
+    return v or u''
+
+
+def convert(path, site, md_ext_names, force=False, image_dir=None):
+    '''Convert the notebook in path. Return (html, image_names).
+
+    md_ext_names are the markdown extensions used for markdown cells.
+    If force is True, the cached result (if any) is ignored.
+    image_names is the list of file names (relative to the page) that
+    the html refers to. The images themselves are in the site's
+    'nbimages' cache, with the name as key. If image_dir is given (it
+    implies force), they are written there too.
+
+    '''
+    cache = site.get_cache('notebook')
+    # code cells are highlighted by Pygments, markdown cells by md
+    md = site.get_md_converter(md_ext_names)
+    key = s2cache.make_key('notebook', CONVERTER_VERSION,
+                           ','.join(md_ext_names), pygments.__version__,
+                           mdx_hilitecache.hilite_settings(md),
+                           s2cache.file_hash(path))
+    cached = None
+    if not force and image_dir is None:
+        cached = cache.get(key)
+    if cached is not None:
+        r = json.loads(cached)
+        return (r['html'], r['images'])
+    f = open(path, 'rb')
+    nb = json.load(f)
+    f.close()
+    converter = NotebookConverter(site, md_ext_names, image_dir)
+    html = converter.convert(nb)
+    del nb
+    cache.set(key, json.dumps({'html': html, 'images': converter.images}))
+    return (html, converter.images)
+
+
+class NotebookConverter(object):
+    '''Convert a parsed notebook (nbformat 3 or 4) to html.
+
+    Code is highlighted with the same cached highlighter used for
+    markdown pages, and markdown cells are converted with the given
+    markdown extensions.
+
+    The outputs are processed one at a time, and the base64 data of each
+    image is dropped from the notebook structure as soon as the image is
+    stored, so that a big notebook is not kept in memory twice. The
+    images are stored in the 'nbimages' cache, and also written to
+    image_dir if it's given.
+
+    '''
+
+    def __init__(self, site, md_ext_names, image_dir=None):
+        self.site = site
+        self._md_ext_names = md_ext_names
+        self._image_dir = image_dir
+        self.images = []
+        self._image_cache = site.get_cache('nbimages')
+        self._language = 'python'
+
+    def convert(self, nb):
+        '''Return the html for the notebook nb (a dictionary).'''
+        if 'worksheets' in nb:  # nbformat 3
+            cells = []
+            for ws in nb['worksheets']:
+                cells.extend(ws.get('cells', []))
+            self._language = nb.get('metadata', {}).get('language',
+                                                         self._language)
+        else:
+            cells = nb.get('cells', [])
+            md = nb.get('metadata', {})
+            self._language = md.get('language_info', {}).get('name') or \
+                             md.get('kernelspec', {}).get('language') or \
+                             self._language
+        parts = [u'<div class="notebook">']
+        for cell in cells:
+            ctype = cell.get('cell_type')
+            if ctype == 'code':
+                parts.append(self._code_cell(cell))
+            elif ctype == 'markdown':
+                parts.append(self._markdown_cell(_text(cell.get('source'))))
+            elif ctype == 'heading':  # nbformat 3
+                level = cell.get('level', 1)
+                parts.append(u'<div class="text_cell_render border-box-sizing '
+                             u'rendered_html"><h%d>%s</h%d></div>' %
+                             (level, cgi.escape(_text(cell.get('source'))),
+                              level))
+            elif ctype == 'raw':
+                fmt = cell.get('metadata', {}).get('format', '')
+                if 'html' in fmt:
+                    parts.append(_text(cell.get('source')))
+        parts.append(u'</div>')
+        return u'\n'.join(parts)
+
+    def _markdown_cell(self, source):
+        md = self.site.get_md_converter(self._md_ext_names)
+        return u'<div class="text_cell_render border-box-sizing ' \
+               u'rendered_html">%s</div>' % md.convert(source)
+
+    def _highlight(self, code):
+        h = mdx_hilitecache.CachedCodeHilite(self.site.get_cache('highlight'),
+                                             code, lang=self._language,
+                                             css_class='highlight',
+                                             guess_lang=False)
+        return h.hilite()
+
+    def _code_cell(self, cell):
+        source = _text(cell.get('source', cell.get('input')))
+        count = cell.get('execution_count', cell.get('prompt_number'))
+        prompt = count if count is not None else u'&nbsp;'
+        parts = [u'<div class="cell border-box-sizing code_cell vbox">',
+                 u'<div class="input hbox">',
+                 u'<div class="prompt input_prompt">In&nbsp;[%s]:</div>'
+                 % prompt,
+                 u'<div class="input_area box-flex1">%s</div>'
+                 % self._highlight(source),
+                 u'</div>']
+        outputs = cell.get('outputs', [])
+        if outputs:
+            parts.append(u'<div class="vbox output_wrapper">'
+                         u'<div class="output vbox">')
+            for i in range(0, len(outputs)):
+                parts.append(self._output(outputs[i]))
+                outputs[i] = None  # release the output data right away
+            parts.append(u'</div></div>')
+        parts.append(u'</div>')
+        return u'\n'.join(parts)
+
+    def _output(self, out):
+        otype = out.get('output_type')
+        if otype == 'stream':
+            body = u'<pre>%s</pre>' % cgi.escape(_text(out.get('text')))
+        elif otype in ('error', 'pyerr'):
+            tb = u'\n'.join(out.get('traceback', []))
+            body = u'<pre>%s</pre>' % cgi.escape(ANSI_RE.sub(u'', tb))
+        else:
+            # execute_result/display_data (v4) or pyout/display_data (v3)
+            data = out.get('data', out)
+            body = self._rich_output(data)
+        return u'<div class="hbox output_area"><div class="prompt"></div>' \
+               u'<div class="box-flex1 output_subarea">%s</div></div>' % body
+
+    def _rich_output(self, data):
+        for (mime, v3key, ext) in IMAGE_TYPES:
+            k = mime if mime in data else v3key
+            if k in data:
+                name = self._store_image(_text(data[k]), ext)
+                del data[k]
+                return u'<img src="%s"/>' % name
+        for k in ('text/html', 'html', 'image/svg+xml', 'svg'):
+            if k in data:
+                return _text(data[k])
+        for k in ('text/latex', 'latex'):
+            if k in data:
+                return u'<div>%s</div>' % cgi.escape(_text(data[k]))
+        for k in ('text/plain', 'text'):
+            if k in data:
+                return u'<pre>%s</pre>' % cgi.escape(_text(data[k]))
+        return u''
+
+    def _store_image(self, b64data, ext):
+        '''Decode and store an image. Return its (content-hashed) name.'''
+        raw = base64.b64decode(b64data)
+        name = hashlib.sha1(raw).hexdigest() + '.' + ext
+        self._image_cache.set(name, raw)
+        if self._image_dir is not None:
+            fout = open(os.path.join(self._image_dir, name), 'wb')
+            fout.write(raw)
+            fout.close()
+        if not name in self.images:
+            self.images.append(name)
+        return name
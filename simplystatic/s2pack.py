@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+'''This module keeps a generated site in a single pack file.
+
+A pack holds all the files of a www directory, so a site takes one
+inode instead of thousands, and copying or deleting it is a single
+operation. The layout is:
+
+    - the magic string 'S2PACK1\n';
+    - the contents of the files, one after the other. Text files (html,
+      css, js, etc.) are stored gzipped if that makes them smaller;
+    - the index: a JSON list, sorted by path, of
+      [path, offset, length, encoding, size] (encoding is 'gzip' or '',
+      size is the size of the original file);
+    - a trailer with the offset and length of the index (two unsigned
+      64-bit big-endian integers) and the magic string again.
+
+PackReader maps the file in memory (mmap), so the contents are served
+straight from the page cache, and looks paths up in the index with a
+binary search.
+
+Functions included:
+
+    - write_pack: Write the files of a directory to a pack file.
+
+Classes included:
+
+    - PackReader: Read (or extract) the files in a pack.
+
+'''
+
+import os
+import gzip
+import json
+import mmap
+import bisect
+import struct
+import tempfile
+from StringIO import StringIO
+
+MAGIC = 'S2PACK1\n'
+TRAILER = struct.Struct('>QQ')
+# extensions of the files that are stored gzipped (if it helps)
+COMPRESSIBLE = ('.html', '.htm', '.css', '.js', '.json', '.xml', '.txt',
+                '.svg', '.md', '.csv')
+
+
+def _gzip(data):
+    buf = StringIO()
+    # mtime=0, so the same files always give the same pack
+    gz = gzip.GzipFile(fileobj=buf, mode='wb', mtime=0)
+    gz.write(data)
+    gz.close()
+    return buf.getvalue()
+
+
+def write_pack(src_dir, pack_path, compress=True):
+    '''Write all the files under src_dir to the pack file pack_path.
+
+    The pack is written to a temporary file and then renamed, so a
+    server that has the old pack open keeps serving it undisturbed.
+    Return the number of files in the pack.
+
+    '''
+    files = []
+    for dirpath, dirnames, filenames in os.walk(src_dir):
+        rd = os.path.relpath(dirpath, src_dir).replace(os.sep, '/')
+        for fn in filenames:
+            files.append(fn if rd == '.' else rd + '/' + fn)
+    files.sort()
+    d = os.path.dirname(os.path.abspath(pack_path))
+    fd, tmpname = tempfile.mkstemp(dir=d)
+    fout = os.fdopen(fd, 'wb')
+    fout.write(MAGIC)
+    offset = len(MAGIC)
+    index = []
+    for relpath in files:
+        fin = open(os.path.join(src_dir, *relpath.split('/')), 'rb')
+        data = fin.read()
+        fin.close()
+        size = len(data)
+        encoding = ''
+        if compress and os.path.splitext(relpath)[1].lower() in COMPRESSIBLE:
+            gz = _gzip(data)
+            if len(gz) < size:
+                (data, encoding) = (gz, 'gzip')
+        fout.write(data)
+        if isinstance(relpath, str):
+            relpath = relpath.decode('utf-8')
+        index.append([relpath, offset, len(data), encoding, size])
+        offset += len(data)
+    index.sort()
+    idx = json.dumps(index, separators=(',', ':'))
+    fout.write(idx)
+    fout.write(TRAILER.pack(offset, len(idx)))
+    fout.write(MAGIC)
+    fout.close()
+    os.chmod(tmpname, 0644)
+    os.rename(tmpname, pack_path)
+    return len(index)
+
+
+class PackReader(object):
+    '''Give access to the files in a pack, through a memory map.
+
+    Paths are relative to the root of the site, with / as separator.
+
+    '''
+
+    def __init__(self, pack_path):
+        self.path = pack_path
+        self._file = open(pack_path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        tlen = TRAILER.size + len(MAGIC)
+        if self._map[:len(MAGIC)] != MAGIC or \
+                self._map[-len(MAGIC):] != MAGIC:
+            self.close()
+            raise ValueError(pack_path + " is not a s2 pack file.")
+        (ioffset, ilen) = TRAILER.unpack(self._map[-tlen:-len(MAGIC)])
+        index = json.loads(self._map[ioffset:ioffset + ilen])
+        self._paths = [e[0] for e in index]
+        self._entries = index
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def paths(self):
+        '''Return the sorted list of paths in the pack.'''
+        return list(self._paths)
+
+    def lookup(self, path):
+        '''Return (offset, length, encoding, size) for path, or None.'''
+        if isinstance(path, str):
+            path = path.decode('utf-8')
+        i = bisect.bisect_left(self._paths, path)
+        if i < len(self._paths) and self._paths[i] == path:
+            return tuple(self._entries[i][1:])
+        return None
+
+    def raw(self, entry):
+        '''Return a buffer with the stored bytes of an entry of lookup.'''
+        return buffer(self._map, entry[0], entry[1])
+
+    def read(self, path):
+        '''Return the (uncompressed) contents of path, or None.'''
+        entry = self.lookup(path)
+        if entry is None:
+            return None
+        data = self._map[entry[0]:entry[0] + entry[1]]
+        if entry[2] == 'gzip':
+            data = gzip.GzipFile(fileobj=StringIO(data)).read()
+        return data
+
+    def extract(self, dest_dir):
+        '''Write all the files in the pack under dest_dir.
+
+        Return the number of files written. Paths that would go out of
+        dest_dir are skipped.
+
+        '''
+        n = 0
+        for path in self._paths:
+            if '..' in path.split('/') or path.startswith('/'):
+                continue
+            fn = os.path.join(dest_dir, *path.split('/'))
+            d = os.path.dirname(fn)
+            if not os.path.isdir(d):
+                os.makedirs(d)
+            fout = open(fn, 'wb')
+            fout.write(self.read(path))
+            fout.close()
+            n += 1
+        return n
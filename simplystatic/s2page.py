@@ -7,6 +7,14 @@ Classes included:
             a "page" in a site. This structure refers to the "source"
             page.
 
+Functions included:
+
+    - make_md_converter: Create a markdown converter for a profile.
+    - new_config, config_to_text, page_text: Build the text of a page
+      without a Page object (used for bulk imports).
+    - open_output: Open a buffered utf-8 writer for a generated file.
+    - render_to_file: Render a mako template straight into a file.
+
 """
 
 import os
@@ -16,16 +24,110 @@ import shutil
 import codecs
 import uuid
 
-from mako.template import Template
-from mako.lookup import TemplateLookup
 from mako.runtime import Context
 from StringIO import StringIO
 
 import markdown
 import mdx_mathjax
+import mdx_hilitecache
 
+import s2cache
+import s2images
+import s2notebook
 import util
 
+# Named sets of markdown extensions. A page chooses one with the
+# 'md_profile' item of its configuration; if it's empty, the site's
+# 'default_md_profile' is used. Pages without code or math can use
+# 'plain' to skip the costly extensions. 'codehilite' is served through
+# the highlight cache (see mdx_hilitecache.)
+MD_PROFILES = {'plain': [],
+               'code': ['fenced_code', 'codehilite'],
+               'math': ['fenced_code', 'codehilite', 'mathjax']
+              }
+DEFAULT_MD_PROFILE = 'code'
+# buffer size of the files written by open_output
+OUTPUT_BUFFER_SIZE = 64 * 1024
+
+def make_md_converter(ext_names, site):
+    '''Return a markdown converter that uses the named extensions.'''
+    extensions = []
+    for e in ext_names:
+        if e == 'codehilite':
+            extensions.append(mdx_hilitecache.HiliteCacheExtension(
+                                site.get_cache('highlight')))
+        elif e == 'mathjax':
+            extensions.append(mdx_mathjax.MathJaxExtension())
+        else:
+            extensions.append(e)
+    return markdown.Markdown(extensions=extensions, output_format="html5")
+
+
+
+def open_output(filename):
+    '''Return a buffered writer that encodes unicode to utf-8 in filename.
+
+    Characters that can't be encoded are written as xml char refs, like
+    in the rest of the generated files.
+
+    '''
+    fout = open(filename, 'wb', OUTPUT_BUFFER_SIZE)
+    return codecs.getwriter('utf-8')(fout, errors='xmlcharrefreplace')
+
+
+def render_to_file(template, filename, **data):
+    '''Render the mako template, with data, into filename.
+
+    The output goes through a mako Context straight to the file, so the
+    whole rendition is never built in memory.
+
+    '''
+    fout = open_output(filename)
+    try:
+        template.render_context(Context(fout, **data))
+    finally:
+        fout.close()
+
+
+def _render_task(template, filename, data):
+    '''render_to_file with the data in a dict (for Site.write_behind.)'''
+    render_to_file(template, filename, **data)
+
+
+def new_config(site, title, slug):
+    """Return the default configuration dictionary for a new page."""
+    configinfo = {'creation_date': [ datetime.datetime.now().date().isoformat()],
+                  'author': [site.site_config['default_author']],
+                  'status': [u'draft'],
+                  'lang': [u''],
+                  'tags': [u''],
+                  'title': [title],
+                  'slug': [slug],
+                  'theme': [u''],
+                  'template': [u''],
+                  'page_id': [uuid.uuid4().hex],
+                  'md_profile': [u'']
+                  }  # when theme and template are empty, the generator uses the defaults. Thus, initially
+                                      # they should be empty, to allow for global changes just by changing the site config files.
+    return configinfo
+
+
+def config_to_text(config):
+    """Render a page configuration as text."""
+    r = u'' # unicode('',"UTF-8")
+    for k in config:
+        cosa = '\n        '.join(config[k]) + '\n'
+        r += k + ": " + cosa
+    r += '\n'
+    return r
+
+
+def page_text(config, content):
+    """Return the text of a page: the serialized config, and then the content."""
+    r = config_to_text(config)
+    if content:
+        r += u'\n' + content + u'\n'
+    return r
 
 
 class Page(object):
@@ -73,6 +175,11 @@ class Page(object):
         self._slug = None
         self._title = None
         self._content = None
+        # resized variants of the page images (see s2images), set by generate
+        self._image_variants = {}
+        # list of {'slug', 'title', 'url'} of the related pages, given
+        # to the template as relatedPages (see s2related); set by the site
+        self.related_pages = []
 
         self._dirs = {'www_dir': None,
                       'www_filename': None,
@@ -118,9 +225,8 @@ class Page(object):
         self._title = unicode(rawtitle,"UTF-8")
         self._slug = slug
 
-        self._dirs['source_dir'] = os.path.join(self.site.dirs['source'], slug)
-        self._dirs['source_filename'] = os.path.join(self._dirs['source_dir'],
-                                                     slug + '.md')
+        self._dirs['source_dir'] = self.site.storage.page_dir(slug)
+        self._dirs['source_filename'] = self.site.storage.text_path(slug)
 
         self._dirs['www_dir'] = os.path.join(self.site.dirs['www'], slug)
         self._dirs['www_filename'] = os.path.join(self._dirs['www_dir'], \
@@ -132,20 +238,13 @@ class Page(object):
         """Write the s2 page to the corresponding source file.
 
         It always writes the (serialized) config first, and then the
-        content (normally markdown). The destination file is in the
-        source_dir of the site.
+        content (normally markdown). Where it's written depends on the
+        storage of the site (see s2storage): normally, a file in the
+        source_dir of the page.
 
         """
-        if not os.path.isdir(self._dirs['source_dir']):
-            os.mkdir(self._dirs['source_dir'])
-
-        fout = codecs.open(self._dirs['source_filename'], 'w', encoding="utf-8", errors="xmlcharrefreplace")
-        fout.write(self._config_to_text())
-        if self._content:
-            fout.write('\n')
-            fout.write(self._content)
-            fout.write('\n')
-        fout.close()
+        self.site.storage.write(self._slug,
+                                page_text(self._config, self._content))
 
     def rename(self, new_title):
         """Rename an existing s2 page.
@@ -154,6 +253,13 @@ class Page(object):
         as well as the internal configuration information (since it
         contains the title and the slug)
 
+        The source directory is moved (with os.rename, see s2storage),
+        so any other files in it (images, attachments...) are kept. The old slug is
+        recorded as a redirect to the new one (see Site.add_redirect),
+        and if the page had been generated, it's generated again under
+        its new slug, so www is usable without a full generation: pages
+        that still link to the old slug get the redirect.
+
         """
         if not isinstance(new_title, str) and \
                 not isinstance(new_title, unicode):
@@ -161,13 +267,16 @@ class Page(object):
             # print "Cannot rename page. New title must be string or unicode."
 
         new_slug = util.make_slug(new_title)
-        if self.site.page_exists_on_disk(new_slug):
+        new_source_dir = self.site.storage.page_dir(new_slug)
+        if self.site.page_exists_on_disk(new_slug) or \
+                os.path.exists(new_source_dir):
             raise ValueError
             # print "Cannot rename page. A page with the same \
             # title/slug already exists."
 
-        #wipe the source directory for this page
-        shutil.rmtree(self._dirs['source_dir'])
+        old_slug = self._slug
+        old_www_dir = self._dirs['www_dir']
+        self.site.storage.rename(old_slug, new_slug)
 
         #just change dirinfo, config, and write
         self._title = new_title
@@ -175,52 +284,56 @@ class Page(object):
         self._config['title'] = [self._title]
         self._config['slug'] = [self._slug]
 
-        self._dirs['source_dir'] = os.path.join(self.site.dirs['source'],
-                                                new_slug)
-        self._dirs['source_filename'] = os.path.join(self._dirs['source_dir'],
-                                                     new_slug + '.md')
+        self._dirs['source_dir'] = new_source_dir
+        self._dirs['source_filename'] = self.site.storage.text_path(new_slug)
 
         self._dirs['www_dir'] = os.path.join(self.site.dirs['www'], new_slug)
-        #self._dirs['www_filename'] = os.path.join(self._dirs['www_dir'], \
-        #                                       new_slug + '.html')
+        self._dirs['www_filename'] = os.path.join(self._dirs['www_dir'], \
+                                                  'index.html')
         self.write()
 
+        was_generated = os.path.isdir(old_www_dir)
+        self.site.add_redirect(old_slug, new_slug)
+        if was_generated and self.published:
+            self.generate()
 
-    def render(self):
+    def render(self, filename=None):
         """Render this page and return the rendition.
 
         Converts the markdown content to html, and then renders the
         (mako) template specified in the config, using that html.
 
-        The task of writing of the rendition to a real file is
-        responsibility of the generate method.
+        If filename is given, the rendition is written to that file as
+        it's produced (see render_to_file) and None is returned; that's
+        what the generate method does.
 
         """
-        (pthemedir, ptemplatefname) = self._theme_and_template_fp()
+        (makotemplate, data) = self._template_and_data()
+        if filename is not None:
+            render_to_file(makotemplate, filename, **data)
+            return None
+        return makotemplate.render(**data)
 
-        mylookup = TemplateLookup(directories=[self.site.dirs['s2'], pthemedir], input_encoding='utf-8', output_encoding='utf-8')
+    def _template_and_data(self, page_html=None):
+        """Return the mako template of this page and the data for it.
 
+        The content is converted to html here (unless page_html, the
+        result of body_html, is given), so the template can be rendered
+        afterwards in another thread (see generate.)
 
-        makotemplate = Template(filename=ptemplatefname, lookup=mylookup,
-                                module_directory=self.site._makodir)
+        """
+        (pthemedir, ptemplatefname) = self._theme_and_template_fp()
 
-        # I don't really need to use the meta extension here, because I render self._content (has no metadata)
-        #page_html = markdown.markdown(self._content)
+        makotemplate = self.site.get_template(ptemplatefname,
+                                              [self.site.dirs['s2'], pthemedir])
 
-        md = markdown.Markdown(extensions=['meta','fenced_code', 'codehilite'],output_format="html5")
-        page_html = md.convert(self._content)   # need to trigger the conversion to obtain md.Meta
+        if page_html is None:
+            page_html = self.body_html()
 
         # We assume that the page is always in a dir one level below www
         themepath = "../themes/" + os.path.split(pthemedir)[1] + '/'
         commonpath = "../common/"
 
-        # HERE I'll pass the config variable to the mako template, so I can use the title etc.
-        #buf = StringIO()
-        #ctx = Context(buf, dict(pageContent=page_html, isFrontPage=False, themePath=themepath, pageTitle='pedo',
-        #                        commonPath=commonpath))
-        #makotemplate.render_context(ctx)
-        #rendition = buf.getvalue()
-
         # IS THERE `PIWIK CODE?
         # IS THERE DISQUS CODE?
         # READ from s2 if there's disqus_code.html.tpl and piwik_code.html.tpl
@@ -244,56 +357,126 @@ class Page(object):
             disqus_title = self.title
             disqus_url = os.path.join(self.site.site_config['site_url'],self._slug)
 
-        rendition = makotemplate.render(pageContent=page_html,isFrontPage=False,
-                                        themePath=themepath,
-                                        commonPath=commonpath,
-                                        pageTitle=self.title,
-                                        piwik_code=piwik_code,
-                                        disqus_code=disqus_code,
-                                        disqus_shortname = disqus_shortname,
-                                        disqus_identifier = disqus_identifier,
-                                        disqus_url = disqus_url,
-                                        disqus_title= disqus_title)
-        return rendition
+        data = dict(pageContent=page_html,isFrontPage=False,
+                    themePath=themepath,
+                    commonPath=commonpath,
+                    pageTitle=self.title,
+                    mdProfile=self.md_profile,
+                    srcset=self.srcset,
+                    relatedPages=self.related_pages,
+                    piwik_code=piwik_code,
+                    disqus_code=disqus_code,
+                    disqus_shortname = disqus_shortname,
+                    disqus_identifier = disqus_identifier,
+                    disqus_url = disqus_url,
+                    disqus_title= disqus_title)
+        return (makotemplate, data)
+
+    def srcset(self, relpath, ext=None):
+        """Return the srcset value for the image relpath of this page.
+
+        Templates get this method as 'srcset'. See s2images.srcset.
+
+        """
+        return s2images.srcset(self._image_variants, relpath, ext)
+
+    def body_html(self):
+        """Return the html obtained by converting the markdown content.
+
+        The result is kept in the site's 'html' cache, keyed by the
+        content and the markdown configuration (including the Pygments
+        version and highlight options), so the content of a page that
+        hasn't changed is not converted again (e.g. when only the
+        templates change.) The same html is used for the atom feed.
+
+        """
+        content = self._content or u''
+        ext_names = MD_PROFILES[self.md_profile]
+        cache = self.site.get_cache('html')
+        md = self.site.get_md_converter(ext_names)
+        key = s2cache.make_key('html', markdown.version, 'html5',
+                               ','.join(ext_names),
+                               mdx_hilitecache.hilite_settings(md), content)
+        page_html = cache.get(key)
+        if page_html is None:
+            page_html = md.convert(content)
+            cache.set(key, page_html)
+        if self.notebook_path:
+            page_html += u'\n' + self._convert_notebook()[0]
+        return page_html
+
+    def _convert_notebook(self, force=False, image_dir=None):
+        """Return (html, image_names) for the notebook of this page.
+
+        Notebook cells are always converted with the 'math' profile,
+        since notebooks usually contain formulas. See s2notebook.convert
+        for force and image_dir.
+
+        """
+        return s2notebook.convert(self.notebook_path, self.site,
+                                  MD_PROFILES['math'], force, image_dir)
+
+    def _copy_notebook_images(self):
+        """Copy the images extracted from the notebook to www_dir."""
+        images = self._convert_notebook()[1]
+        cache = self.site.get_cache('nbimages')
+        missing = [n for n in images if not cache.copy_to(n, \
+                                    os.path.join(self.dirs['www_dir'], n))]
+        if missing:
+            # the images were evicted from the cache (which may be too
+            # small for them all.) Convert again, writing them to www_dir.
+            self._convert_notebook(image_dir=self.dirs['www_dir'])
 
     # test generate should copy all other pages and dirs in the page
     # directory, except those in a especially named folder!
-    def generate(self):
+    def generate(self, page_html=None):
         """Generate the page html file.
 
-        Just open the destination file for writing and write the result
-        of rendering this page.
+        Just render this page into the destination file. Nothing is
+        returned: use body_html to get the html of the content (and
+        pass it as page_html if it's already there.)
+
+        During a generation of the site, the files of the page are
+        copied, and the template rendered into its file, in the
+        background (see Site.write_behind); the markdown is converted
+        before, since the converters are not thread-safe.
 
         """
-        generated_content = ''
         if 'published' in (self._config['status'][0]).lower():
             if os.path.isdir(self.dirs['www_dir']):
                 shutil.rmtree(self.dirs['www_dir'])
             os.mkdir(self.dirs['www_dir'])
             # copy the whole source directory of the page,
             # excluding 'nowww' and *s2md
-            sfl = glob.glob(os.path.join(self.dirs['source_dir'], "*"))
+            sfl = sorted(glob.glob(os.path.join(self.dirs['source_dir'], "*")))
             dirlist = [f for f in sfl if os.path.isdir(f)]
             filelist = [f for f in sfl if os.path.isfile(f)]
+            site = self.site
+            tasks = []
             for f in filelist:
-                if not '.md' in os.path.split(f)[1]:
-                    shutil.copy(f, self.dirs['www_dir'])
+                if not '.md' in os.path.split(f)[1] and \
+                        f != self.notebook_path:
+                    tasks.append(site.write_behind(shutil.copy, f,
+                                                   self.dirs['www_dir']))
             for d in dirlist:
                 rfn = os.path.split(d)[1]
                 if rfn != 'nowww':
-                    shutil.copytree(d, os.path.join(self.dirs['www_dir'], rfn))
-                #write the rendered "page" to file
-
-            #fout = open(self.dirs['www_filename'], 'w')
-            #fout.write(self.render())
-            #fout.close()
-
-            generated_content = self.render()
-            fout = codecs.open(self.dirs['www_filename'], "w", encoding="utf-8", errors="xmlcharrefreplace")
-            fout.write(generated_content)
-            fout.close()
-
-        return generated_content
+                    tasks.append(site.write_behind(shutil.copytree, d,
+                                        os.path.join(self.dirs['www_dir'], rfn)))
+            if self.notebook_path:
+                self._copy_notebook_images()
+            stage = site.get_image_stage()
+            if stage.enabled:
+                # the variants go next to the copies
+                site.wait_writes(tasks)
+                self._image_variants = stage.process_dir(
+                                self.dirs['source_dir'], self.dirs['www_dir'],
+                                skip=['nowww'])
+
+            #write the rendered "page" to file
+            (makotemplate, data) = self._template_and_data(page_html)
+            site.write_behind(_render_task, makotemplate,
+                              self.dirs['www_filename'], data)
 
     def set_published(self):
         """Change the page configuration to make the page 'published' """
@@ -301,19 +484,7 @@ class Page(object):
 
     def _create_config(self):
         """Create the default configuration dictionary for this page."""
-        configinfo = {'creation_date': [ datetime.datetime.now().date().isoformat()],
-                      'author': [self.site.site_config['default_author']],
-                      'status': [u'draft'],
-                      'lang': [u''],
-                      'tags': [u''],
-                      'title': [self._title],
-                      'slug': [self._slug],
-                      'theme': [u''],
-                      'template': [u''],
-                      'page_id': [uuid.uuid4().hex]
-                      }  # when theme and template are empty, the generator uses the defaults. Thus, initially
-                                          # they should be empty, to allow for global changes just by changing the site config files.
-        return configinfo
+        return new_config(self.site, self._title, self._slug)
 
     def _load(self, slug):
         """Load the page. The _file_name param is known, because this
@@ -322,22 +493,14 @@ class Page(object):
         """
         #here we know that the slug exists
         self._slug = slug
-        page_dir = os.path.join(self.site.dirs['source'], self._slug)
-        page_file_name = os.path.join(page_dir, self._slug + '.md')
-        self._dirs['source_dir'] = page_dir
-        self._dirs['source_filename'] = page_file_name
+        storage = self.site.storage
+        self._dirs['source_dir'] = storage.page_dir(slug)
+        self._dirs['source_filename'] = storage.text_path(slug)
         self._dirs['www_dir'] = os.path.join(self.site.dirs['www'], slug)
         self._dirs['www_filename'] = os.path.join(self._dirs['www_dir'],  'index.html')
 
-        #pf = open(self._dirs['source_filename'], 'r')
-        #page_text = pf.read()
-        #pf.close()
-        # need to decode!
-        pf = codecs.open(self._dirs['source_filename'], mode="r", encoding="utf-8")
-        page_text = pf.read()
-        pf.close()
-
-        self._parse_text(page_text)
+        # decoded by the storage
+        self._parse_text(storage.read(slug))
         if not self._check_config():
             raise ValueError
             #sys.exit()
@@ -355,12 +518,13 @@ class Page(object):
                          'theme',
                          'template',
                          'page_id']
+        optional_data = ['md_profile', 'notebook']
         isok = True
         # exclude some statements from coverage analysis. I would need to
         # refactor how the config is loaded/handled etc. It's not worth
         # to do that now. Maybe when I change yaml for the markdwn extension.
         for e in self._config.keys():
-            if not e in required_data: # pragma: no cover
+            if not e in required_data and not e in optional_data: # pragma: no cover
                 print "The configuration in page '" + \
                       self._slug + "' is corrupt."
                 isok = False
@@ -376,6 +540,17 @@ class Page(object):
                   " specified in page '" + self._slug + \
                   "' does not exist."
             isok = False
+        nb = self.notebook_path
+        if nb and not os.path.isfile(nb): # pragma: no cover
+            print "Notebook " + self._config['notebook'][0] + \
+                  " specified in page '" + self._slug + \
+                  "' does not exist."
+            isok = False
+        if not self.md_profile in MD_PROFILES: # pragma: no cover
+            print "Markdown profile " + self.md_profile + \
+                  " specified in page '" + self._slug + \
+                  "' does not exist."
+            isok = False
         return isok
 
     def _theme_and_template_fp(self):
@@ -387,6 +562,10 @@ class Page(object):
         ptemplate = self._config['template'][0]
         if ptemplate == "":
             ptemplate = self.site.site_config['default_template']
+            # notebook pages use the theme's notebook template, if any
+            if self.notebook_path and os.path.isfile(os.path.join(pthemedir,
+                                            s2notebook.NOTEBOOK_TEMPLATE)):
+                ptemplate = s2notebook.NOTEBOOK_TEMPLATE
         ptemplatefname = os.path.join(pthemedir, ptemplate)
         return (pthemedir, ptemplatefname)
 
@@ -410,7 +589,7 @@ class Page(object):
             # i points to the first blank line
         cfg_lines = '\n'.join(lines[0:i + 1])  #config lines, plus the empty line
 
-        md = markdown.Markdown(extensions=['meta','fenced_code', 'codehilite'],output_format="html5")
+        md = self.site.get_md_converter(['meta'])
         md.convert(cfg_lines)   # need to trigger the conversion to obtain md.Meta
 
         self._config = md.Meta
@@ -419,17 +598,7 @@ class Page(object):
 
     def _config_to_text(self):
         """Render the configuration as text."""
-        r = u'' # unicode('',"UTF-8")
-        for k in self._config:
-            # if k == 'creation_date':
-            #     r +=  k + ": " + self._config[k][0] + '\n'
-            # else:
-            #uk = unicode(k,"UTF-8")
-            cosa = '\n        '.join(self._config[k]) + '\n'
-            r += k + ": " + cosa
-            #r += k + ": " + '\n        '.join(self._config[k]) + '\n'
-        r += '\n'
-        return r
+        return config_to_text(self._config)
 
     @property
     def content(self):
@@ -490,10 +659,36 @@ class Page(object):
             raise TypeError
         self._config['tags'] = value
 
+    @property
+    def md_profile(self):
+        """Return the name of the markdown profile used by this page."""
+        r = u''
+        if 'md_profile' in self._config:
+            r = self._config['md_profile'][0]
+        if r == '':
+            r = self.site.site_config.get('default_md_profile',
+                                          DEFAULT_MD_PROFILE)
+        return r
+
+    @property
+    def notebook_path(self):
+        """Return the full path of the page's notebook, or None."""
+        if not 'notebook' in self._config:
+            return None
+        nb = self._config['notebook'][0]
+        if nb == '':
+            return None
+        return os.path.join(self._dirs['source_dir'], nb)
+
     @property
     def theme_path(self):
         """Return the full path of the theme used by this page."""
         return self._theme_and_template_fp()[0]
+
+    @property
+    def template_path(self):
+        """Return the full path of the template used by this page."""
+        return self._theme_and_template_fp()[1]
     
     @property
     def author(self):
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+'''This module finds the related pages of every page of a site.
+
+Each published page is described by a sparse vector made of its tags,
+the terms of its title and the terms of its content (split like the
+search index does, see s2search.tokenize). The vectors are saved with
+the catalog signature of each page, so only the pages that changed
+are read again. The related pages of a page are the k pages whose
+vectors are most similar to its own (cosine similarity.)
+
+If NumPy and SciPy are installed, the similarities are computed as a
+product of sparse matrices; otherwise, with an inverted index in pure
+Python. Both give the same result.
+
+The vectors and the results are saved in s2/related_state.json. On the
+next generation, only the pages whose vector changed (and the pages
+whose related pages included one of those) are compared with all the
+others; the rest just merge their saved results with the similarities
+to the changed pages.
+
+Functions included:
+
+    - page_vector: Return the vector of a page, from its catalog entry
+      and its content.
+
+Classes included:
+
+    - RelatedPages: Compute (incrementally) the related pages.
+
+'''
+
+import os
+import json
+import math
+import tempfile
+
+try:
+    import numpy
+    import scipy.sparse
+except ImportError: # pragma: no cover
+    numpy = None
+
+import s2page
+import s2search
+
+STATE_FILE = 'related_state.json'
+STATE_VERSION = 2
+TAG_WEIGHT = 2.0
+TITLE_WEIGHT = 1.0
+# weight of a term that appears once in the content; it grows with the
+# log of the count, so long pages don't drown the title and tags
+BODY_WEIGHT = 0.25
+
+
+def page_vector(entry, content=u''):
+    '''Return the vector (a dictionary term -> weight) of a page.
+
+    entry is the catalog entry of the page, and content its (markdown)
+    content.
+
+    '''
+    v = {}
+    counts = {}
+    for t in s2search.tokenize(content):
+        counts[t] = counts.get(t, 0) + 1
+    for (t, c) in counts.iteritems():
+        v[t] = BODY_WEIGHT * (1 + math.log(c))
+    for t in set(s2search.tokenize(entry['title'])):
+        v[t] = v.get(t, 0.0) + TITLE_WEIGHT
+    for tag in entry['tags']:
+        v[u'tag:' + tag.strip().lower()] = TAG_WEIGHT
+    return v
+
+
+def _norm(v):
+    return math.sqrt(sum([w * w for w in v.itervalues()])) or 1.0
+
+
+def _scores_python(rows, cols, vectors):
+    '''Return {row: {col: similarity}} using an inverted index of cols.'''
+    index = {}
+    for c in cols:
+        n = _norm(vectors[c])
+        for (t, w) in vectors[c].iteritems():
+            index.setdefault(t, []).append((c, w / n))
+    r = {}
+    for s in rows:
+        acc = {}
+        n = _norm(vectors[s])
+        for (t, w) in vectors[s].iteritems():
+            for (c, cw) in index.get(t, ()):
+                acc[c] = acc.get(c, 0.0) + w / n * cw
+        acc.pop(s, None)
+        r[s] = acc
+    return r
+
+
+def _scores_numpy(rows, cols, vectors):
+    '''Return {row: {col: similarity}} with sparse matrix products.'''
+    terms = {}
+    def matrix(slugs):
+        data, indices, indptr = [], [], [0]
+        for s in slugs:
+            n = _norm(vectors[s])
+            for (t, w) in vectors[s].iteritems():
+                indices.append(terms.setdefault(t, len(terms)))
+                data.append(w / n)
+            indptr.append(len(indices))
+        return (data, indices, indptr)
+    rm = matrix(rows)
+    cm = matrix(cols)
+    shape = len(terms)
+    a = scipy.sparse.csr_matrix(rm, shape=(len(rows), shape))
+    b = scipy.sparse.csr_matrix(cm, shape=(len(cols), shape))
+    prod = (a * b.T).tocsr()
+    r = {}
+    for (i, s) in enumerate(rows):
+        acc = {}
+        for j in range(prod.indptr[i], prod.indptr[i + 1]):
+            c = cols[prod.indices[j]]
+            if c != s:
+                acc[c] = float(prod.data[j])
+        r[s] = acc
+    return r
+
+
+def _top(candidates, k):
+    '''Return the k best (slug, score) of a dictionary slug -> score.'''
+    best = sorted([(-round(score, 6), slug)
+                   for (slug, score) in candidates.iteritems() if score > 0])
+    return [[slug, -score] for (score, slug) in best[:k]]
+
+
+class RelatedPages(object):
+    '''Compute the k related pages of every page.
+
+    If use_numpy is None, NumPy/SciPy are used when they are installed.
+
+    '''
+
+    def __init__(self, site, k, use_numpy=None):
+        self.site = site
+        self.k = k
+        if use_numpy is None:
+            use_numpy = numpy is not None
+        self._scores = _scores_numpy if use_numpy else _scores_python
+        self.computed = 0   # pages compared with all the others
+        self.read = 0       # pages read by page_vectors
+        self._sigs = {}     # slug -> catalog signature of its vector
+
+    @property
+    def _state_path(self):
+        return os.path.join(self.site.dirs['s2'], STATE_FILE)
+
+    def _load_state(self):
+        try:
+            fin = open(self._state_path, 'rb')
+            data = json.load(fin)
+            fin.close()
+        except (IOError, ValueError):
+            return ({}, {}, {})
+        if data.get('version') != STATE_VERSION or data.get('k') != self.k:
+            return ({}, {}, {})
+        return (data['vectors'], data['related'], data['sigs'])
+
+    def page_vectors(self, entries, slugs):
+        '''Return {slug: vector} for the pages in slugs (see page_vector.)
+
+        entries are the catalog entries of the pages. Only the pages
+        whose signature changed since the vectors were saved are read.
+
+        '''
+        (old_vectors, old_related, old_sigs) = self._load_state()
+        vectors = {}
+        for s in slugs:
+            sig = entries[s]['sig']
+            if old_sigs.get(s) == sig and s in old_vectors:
+                vectors[s] = old_vectors[s]
+            else:
+                p = s2page.Page(self.site, s, isslug=True)
+                vectors[s] = page_vector(entries[s], p.content or u'')
+                self.read += 1
+            self._sigs[s] = sig
+        return vectors
+
+    def compute(self, vectors):
+        '''Return {slug: [related slug, ...]} for the pages in vectors.
+
+        vectors maps the slug of every page to its vector (see
+        page_vector.)
+
+        '''
+        (old_vectors, old_related, old_sigs) = self._load_state()
+        changed = set([s for s in vectors if old_vectors.get(s) != vectors[s]])
+        gone = changed | (set(old_vectors) - set(vectors))
+        # pages that lost one of their related pages need a full search
+        dirty = set(changed)
+        for s in vectors:
+            if not s in changed:
+                if not s in old_related or \
+                        [r for (r, score) in old_related[s] if r in gone]:
+                    dirty.add(s)
+        all_slugs = sorted(vectors)
+        full = self._scores(sorted(dirty), all_slugs, vectors) if dirty \
+               else {}
+        self.computed = len(dirty)
+        related = {}
+        for s in all_slugs:
+            if s in dirty:
+                related[s] = _top(full[s], self.k)
+            else:
+                # similarity is symmetric: the scores against the
+                # changed pages are in their rows
+                candidates = dict(old_related[s])
+                for c in changed:
+                    if s in full[c]:
+                        candidates[c] = full[c][s]
+                related[s] = _top(candidates, self.k)
+        self._save_state(vectors, related)
+        return dict([(s, [r for (r, score) in related[s]])
+                     for s in related])
+
+    def _save_state(self, vectors, related):
+        fd, tmpname = tempfile.mkstemp(dir=self.site.dirs['s2'])
+        sigs = dict([(s, self._sigs[s]) for s in vectors if s in self._sigs])
+        os.write(fd, json.dumps({'version': STATE_VERSION, 'k': self.k,
+                                 'vectors': vectors, 'related': related,
+                                 'sigs': sigs}))
+        os.close(fd)
+        os.rename(tmpname, self._state_path)
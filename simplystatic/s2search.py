@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+'''This module builds the client-side search index of a site.
+
+While the site is generated, the title, tags and text of every published
+page are split into terms, and an inverted index (term -> pages, with a
+score) is written to www/search/ as JSON files that the browser can
+fetch (see s2search.js in the common directory):
+
+    - docs.json: the list of pages (url, title, date), the length of
+      the prefixes used for sharding, and the list of shards.
+    - <shard>.json: one file per term prefix (the first characters of
+      the terms), mapping each term to a list of [doc number, score].
+      The shard name is the hex of the utf-8 bytes of the prefix, so it
+      is always a safe file name.
+
+A search only needs docs.json and the shards of the prefixes of the
+words searched for.
+
+The terms of each page are kept in s2/search_state.json, with the
+signature of the page file taken from the page catalog (and of its
+notebook, if it has one), so a page is only split into terms again
+when it changes.
+
+Functions included:
+
+    - tokenize: Split a text into terms.
+    - shard_name: Return the name of the shard for a term prefix.
+
+Classes included:
+
+    - SearchIndexer: Collect the terms of the pages and write the index.
+
+'''
+
+import os
+import re
+import json
+import shutil
+import tempfile
+
+STATE_FILE = 'search_state.json'
+# bump this when the way terms are scored changes
+INDEX_VERSION = 1
+DEFAULT_PREFIX_LEN = 2
+MIN_TERM_LEN = 2
+MAX_TERM_LEN = 32
+TITLE_WEIGHT = 5
+TAG_WEIGHT = 3
+MAX_BODY_COUNT = 10
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+TAG_RE = re.compile(r'<[^>]*>')
+STOPWORDS = set(u'''a an and are as at be but by for from has have in is it
+its of on or that the this to was were will with you your'''.split())
+
+
+def tokenize(text):
+    '''Return the list of terms in text (lower case, no stopwords).'''
+    r = []
+    for w in WORD_RE.findall(text.lower()):
+        if MIN_TERM_LEN <= len(w) <= MAX_TERM_LEN and not w in STOPWORDS \
+                and not w.isdigit():
+            r.append(w)
+    return r
+
+
+def shard_name(prefix):
+    '''Return the shard (file name without .json) for a term prefix.'''
+    return prefix.encode('utf-8').encode('hex')
+
+
+class SearchIndexer(object):
+    '''Build the search index of a site during a generation.
+
+    Call add() for every generated page and then write(). The entries
+    of the pages added can also be taken out (entries) and put into
+    another indexer (add_entries), e.g. to merge a sharded generation.
+
+    '''
+
+    def __init__(self, site):
+        self.site = site
+        self.prefix_len = site.site_config.get('search_prefix_len',
+                                               DEFAULT_PREFIX_LEN)
+        self._old = None   # saved state, read on the first add
+        self._pages = {}   # slug -> state entry of the pages added
+
+    @property
+    def _state_path(self):
+        return os.path.join(self.site.dirs['s2'], STATE_FILE)
+
+    def _load_state(self):
+        try:
+            fin = open(self._state_path, 'rb')
+            data = json.load(fin)
+            fin.close()
+        except (IOError, ValueError):
+            return {}
+        if data.get('version') != INDEX_VERSION:
+            return {}
+        return data.get('pages', {})
+
+    def add(self, page, sig, body_html=None):
+        '''Add a page to the index.
+
+        sig is the signature of the page file in the catalog; if it's
+        the same as the one saved (and the notebook of the page, if
+        any, didn't change either), the saved terms are used.
+        body_html is the result of page.body_html, if it's already
+        there.
+
+        '''
+        nb = page.notebook_path
+        if nb is not None and os.path.isfile(nb):
+            st = os.stat(nb)
+            sig = list(sig) + [st.st_mtime, st.st_size]
+        if self._old is None:
+            self._old = self._load_state()
+        old = self._old.get(page.slug)
+        if old is not None and old['sig'] == sig:
+            entry = old
+        else:
+            entry = {'sig': sig, 'terms': self._page_terms(page, body_html)}
+        entry['title'] = page.title
+        entry['date'] = page.creation_date
+        self._pages[page.slug] = entry
+
+    def entries(self):
+        '''Return the entries of the pages added, {slug: entry}.'''
+        return dict(self._pages)
+
+    def add_entries(self, entries):
+        '''Add the entries returned by the entries method of an indexer.'''
+        self._pages.update(entries)
+
+    def _page_terms(self, page, body_html=None):
+        '''Return a dictionary term -> score for page.'''
+        scores = {}
+        if body_html is None:
+            body_html = page.body_html()
+        body = TAG_RE.sub(u' ', body_html)
+        for t in tokenize(body):
+            scores[t] = min(scores.get(t, 0) + 1, MAX_BODY_COUNT)
+        for tag in page.tags:
+            for t in tokenize(tag):
+                scores[t] = scores.get(t, 0) + TAG_WEIGHT
+        for t in set(tokenize(page.title)):
+            scores[t] = scores.get(t, 0) + TITLE_WEIGHT
+        return scores
+
+    def write(self, dest_dir):
+        '''Write the index to dest_dir, and save the state.
+
+        Whatever was in dest_dir is removed first, so no shard of an
+        older index is left behind.
+
+        '''
+        if os.path.isdir(dest_dir):
+            shutil.rmtree(dest_dir)
+        os.mkdir(dest_dir)
+        slugs = sorted(self._pages)
+        docs = []
+        shards = {}
+        for (i, slug) in enumerate(slugs):
+            e = self._pages[slug]
+            docs.append({'url': slug + '/', 'title': e['title'],
+                         'date': e['date']})
+            for (t, score) in e['terms'].iteritems():
+                shard = shards.setdefault(t[:self.prefix_len], {})
+                shard.setdefault(t, []).append([i, score])
+        names = []
+        for prefix in sorted(shards):
+            terms = shards[prefix]
+            for postings in terms.itervalues():
+                postings.sort(key=lambda p: (-p[1], p[0]))
+            name = shard_name(prefix)
+            names.append(name)
+            self._write_json(os.path.join(dest_dir, name + '.json'), terms)
+        self._write_json(os.path.join(dest_dir, 'docs.json'),
+                         {'prefixLength': self.prefix_len,
+                          'shards': names, 'docs': docs})
+        self.save()
+
+    def _write_json(self, path, data):
+        fout = open(path, 'wb')
+        json.dump(data, fout, separators=(',', ':'), sort_keys=True)
+        fout.close()
+
+    def save(self):
+        '''Save the terms of the pages added (only those.)'''
+        fd, tmpname = tempfile.mkstemp(dir=self.site.dirs['s2'])
+        os.write(fd, json.dumps({'version': INDEX_VERSION,
+                                 'pages': self._pages}))
+        os.close(fd)
+        os.rename(tmpname, self._state_path)
@@ -0,0 +1,608 @@
+# -*- coding: utf-8 -*-
+'''This module provides the development web server used by s2 serve.
+
+It serves the www directory of a site like SimpleHTTPServer does, but
+requests for the old slug of a renamed page (see Site.add_redirect) get
+a permanent redirect to the new one.
+
+With s2 serve --pack, the files are served from a pack file (see
+s2pack) instead: the pack is mapped in memory once, and each response
+is sent from that map, gzipped if it was stored so and the client
+accepts it.
+
+In live mode (s2 serve --live) nothing is read from www, and nothing
+is written there: /<slug>/ is rendered from the page source when it's
+requested, and the other files are served from where generate would
+copy them from (the page source directory, the themes, and common.)
+The rendered pages are kept in an LRU cache, and rendered again when
+their source file or template changes. Drafts are only shown if the
+url has a 'draft' query parameter (/<slug>/?draft=1).
+
+In dev mode (s2 serve --reload) the html pages served get a small
+script that listens to /__s2/events, a stream of Server-Sent Events.
+Whenever a generation (a full one, or an incremental one, in the
+daemon or not) finishes, the server sends the urls it changed (see
+Site.get_build_changes); an open page reloads itself if its url is one
+of them, or if a stylesheet, script or image it may use (in its
+directory, the themes or the common files) changed.
+
+Functions included:
+
+    - redirect_target: Return where a request path is redirected to.
+    - make_handler_class: Return a request handler class for a site.
+    - make_live_handler_class: Return a live request handler class.
+    - make_pack_handler_class: Return a request handler class for a pack.
+    - changed_urls: Return the url paths changed by the last generation.
+    - inject_reload_script: Add the live reload script to a html page.
+    - serve: Serve a site until interrupted.
+
+Classes included:
+
+    - S2RequestHandler: Serve files from www, honouring redirects.
+    - LivePreview: Render the pages of a site on demand.
+    - LiveRequestHandler: Serve a site through a LivePreview.
+    - PackRequestHandler: Serve the files in a pack.
+    - ChangeNotifier: Watch for generations, and tell the waiting
+                      requests what they changed.
+    - ThreadingHTTPServer: An HTTPServer with a thread per request.
+
+'''
+
+import os
+import json
+import time
+import socket
+import urllib
+import urlparse
+import threading
+import BaseHTTPServer
+import SocketServer
+from SimpleHTTPServer import SimpleHTTPRequestHandler
+from StringIO import StringIO
+from collections import OrderedDict
+
+import s2page
+import s2pack
+import s2site
+import s2deploy
+
+# number of rendered pages kept by LivePreview
+LIVE_CACHE_SIZE = 256
+# pages listed in the live front page
+FRONT_EPP = 10
+# dev mode (live reload) urls
+EVENTS_PATH = '/__s2/events'
+RELOAD_SCRIPT_PATH = '/__s2/reload.js'
+# seconds between checks for a new generation, and between keepalive
+# comments in the event stream
+WATCH_INTERVAL = 0.2
+KEEPALIVE_INTERVAL = 15
+
+RELOAD_SCRIPT = '''(function () {
+    if (!window.EventSource) { return; }
+    var here = location.pathname.replace(/index\\.html$/, '');
+    var dir = here.replace(/[^\\/]*$/, '');
+    var es = new EventSource('%s');
+    es.addEventListener('changed', function (e) {
+        var urls = JSON.parse(e.data);
+        for (var i = 0; i < urls.length; i++) {
+            var u = urls[i];
+            var isAsset = /\\.(css|js|png|jpe?g|gif|svg|webp|ico|woff2?)$/i.test(u);
+            if (u == here || (isAsset && (u.indexOf(dir) == 0 ||
+                    u.indexOf('/themes/') == 0 ||
+                    u.lastIndexOf('/') == 0))) {
+                es.close();
+                location.reload();
+                return;
+            }
+        }
+    });
+})();
+''' % EVENTS_PATH
+RELOAD_TAG = '<script src="%s"></script>' % RELOAD_SCRIPT_PATH
+
+
+def redirect_target(path, redirects):
+    '''Return the url that path redirects to, or None.
+
+    redirects maps old slugs to new slugs (see Site.get_redirects).
+
+    '''
+    u = urlparse.urlsplit(path)
+    parts = u.path.split('/')
+    # parts[0] is empty because the path starts with /
+    if len(parts) > 1 and parts[1] in redirects:
+        parts[1] = redirects[parts[1]]
+        return urlparse.urlunsplit(('', '', '/'.join(parts), u.query,
+                                    u.fragment))
+    return None
+
+
+class S2RequestHandler(SimpleHTTPRequestHandler):
+    '''Serve files from the current directory, honouring redirects.
+
+    redirects maps old slugs to new slugs. Subclasses set it (see
+    make_handler_class). If they set notifier (a ChangeNotifier), it's
+    dev mode: html pages get the live reload script, and EVENTS_PATH
+    streams the changes.
+
+    '''
+    redirects = {}
+    notifier = None
+
+    def do_GET(self):
+        if self.notifier is not None:
+            path = urlparse.urlsplit(self.path).path
+            if path == EVENTS_PATH:
+                return self._send_events()
+            if path == RELOAD_SCRIPT_PATH:
+                return self._send_body(RELOAD_SCRIPT, "application/javascript")
+        return SimpleHTTPRequestHandler.do_GET(self)
+
+    def send_head(self):
+        target = redirect_target(self.path, self.redirects)
+        if target is not None:
+            self.send_response(301)
+            self.send_header("Location", target)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return None
+        if self.notifier is not None:
+            path = self.translate_path(self.path)
+            if os.path.isdir(path) and \
+                    urlparse.urlsplit(self.path).path.endswith('/'):
+                path = os.path.join(path, 'index.html')
+            if path.endswith('.html') and os.path.isfile(path):
+                fin = open(path, 'rb')
+                html = fin.read()
+                fin.close()
+                return self._send_html(html)
+        return SimpleHTTPRequestHandler.send_head(self)
+
+    def _send_html(self, html):
+        '''Send the headers for html, and return the body to copy.'''
+        if self.notifier is not None:
+            html = inject_reload_script(html)
+        self.send_response(200)
+        self.send_header("Content-type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(html)))
+        if self.notifier is not None:
+            self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        return StringIO(html)
+
+    def _send_body(self, body, ctype):
+        self.send_response(200)
+        self.send_header("Content-type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_events(self):
+        '''Stream the changes of each generation, until the client leaves.'''
+        self.send_response(200)
+        self.send_header("Content-type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        version = self.notifier.version
+        try:
+            self.wfile.write('retry: 1000\n\n')
+            self.wfile.flush()
+            while not self.notifier.stopped:
+                r = self.notifier.wait(version, KEEPALIVE_INTERVAL)
+                if self.notifier.stopped:
+                    break
+                if r is None:
+                    self.wfile.write(': keepalive\n\n')
+                else:
+                    (version, urls) = r
+                    self.wfile.write('event: changed\ndata: %s\n\n' %
+                                     json.dumps(urls))
+                self.wfile.flush()
+        except socket.error:
+            pass  # the page was closed or reloaded
+
+
+def make_handler_class(site, notifier=None):
+    '''Return a S2RequestHandler subclass with the redirects of site.
+
+    notifier, if given, is the ChangeNotifier of dev mode.
+
+    '''
+    class SiteRequestHandler(S2RequestHandler):
+        redirects = site.get_redirects()
+    SiteRequestHandler.notifier = notifier
+    return SiteRequestHandler
+
+
+def changed_urls(site):
+    '''Return the url paths of the files changed by the last generation.
+
+    They are absolute paths (/slug/, /themes/blog1/style.css, etc.);
+    index.html files are given the path of their directory.
+
+    '''
+    (added, changed, removed) = site.get_build_changes()
+    return [s2deploy.relpath_url('/', f)
+            for f in sorted(added + changed + removed)]
+
+
+def inject_reload_script(html):
+    '''Return html (utf-8) with the live reload script tag added.'''
+    i = html.lower().rfind('</body>')
+    if i < 0:
+        return html + RELOAD_TAG
+    return html[:i] + RELOAD_TAG + html[i:]
+
+
+class ChangeNotifier(object):
+    '''Watch a site for new generations, and wake up who's waiting.
+
+    A generation is noticed by the change of its build manifest (see
+    Site._record_build_changes), which is checked every interval
+    seconds by a thread (see start). version counts the generations
+    noticed, and urls are the ones changed by the last one. stop()
+    ends the watch, and the event streams.
+
+    '''
+
+    def __init__(self, site, interval=WATCH_INTERVAL):
+        self.site = site
+        self.interval = interval
+        self.version = 0
+        self.urls = []
+        self.stopped = False
+        self._cond = threading.Condition()
+        self._sig = self._manifest_sig()
+
+    def _manifest_sig(self):
+        path = os.path.join(self.site.dirs['s2'], s2site.BUILD_MANIFEST_FILE)
+        try:
+            return _file_sig(path)
+        except OSError:
+            return None
+
+    def check(self):
+        '''Notify the waiting requests if there was a new generation.
+
+        Return True if there was one that changed something.
+
+        '''
+        sig = self._manifest_sig()
+        if sig == self._sig:
+            return False
+        self._sig = sig
+        urls = changed_urls(self.site)
+        if not urls:
+            return False
+        self._cond.acquire()
+        try:
+            self.version += 1
+            self.urls = urls
+            self._cond.notify_all()
+        finally:
+            self._cond.release()
+        return True
+
+    def wait(self, version, timeout):
+        '''Wait for a generation after version.
+
+        Return (version, urls) of the last one, or None if there was
+        none in timeout seconds (or the notifier was stopped.)
+
+        '''
+        end = time.time() + timeout
+        self._cond.acquire()
+        try:
+            while self.version == version and not self.stopped:
+                left = end - time.time()
+                if left <= 0:
+                    return None
+                self._cond.wait(left)
+            if self.stopped:
+                return None
+            return (self.version, self.urls)
+        finally:
+            self._cond.release()
+
+    def stop(self):
+        self._cond.acquire()
+        try:
+            self.stopped = True
+            self._cond.notify_all()
+        finally:
+            self._cond.release()
+
+    def _watch(self):
+        while not self.stopped:
+            time.sleep(self.interval)
+            self.check()
+
+    def start(self):
+        '''Start checking for generations, in a daemon thread.'''
+        t = threading.Thread(target=self._watch)
+        t.daemon = True
+        t.start()
+
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn,
+                          BaseHTTPServer.HTTPServer):
+    '''An HTTPServer that handles each request in its own thread.
+
+    Needed in dev mode, where the event streams stay open.
+
+    '''
+    daemon_threads = True
+
+
+def _file_sig(path):
+    st = os.stat(path)
+    return (st.st_mtime, st.st_size)
+
+
+class LivePreview(object):
+    '''Render the pages of a site when they are requested.
+
+    Rendered pages are kept in an LRU cache of max_pages entries, each
+    one valid while the modification time and size of the page file
+    and of its template don't change.
+
+    The server may handle requests in several threads (see serve), but
+    the cache and the site (its markdown converters, catalog and
+    templates) are not thread-safe, so pages are rendered one at a
+    time.
+
+    '''
+
+    def __init__(self, site, max_pages=LIVE_CACHE_SIZE):
+        self.site = site
+        self.max_pages = max_pages
+        self._pages = OrderedDict()  # slug -> (template, sigs, published, html)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _sigs(self, slug, template_path):
+        '''Return the sigs of the page text of slug and of its template.'''
+        return [tuple(self.site.storage.sig(slug)), _file_sig(template_path)]
+
+    def render_page(self, slug, drafts=False):
+        '''Return the rendition of the page slug (utf-8), or None.
+
+        None is returned if there's no such page, or if it's not
+        published and drafts is False.
+
+        '''
+        with self._lock:
+            return self._render_page(slug, drafts)
+
+    def _render_page(self, slug, drafts):
+        if not self.site.page_exists_on_disk(slug):
+            self._pages.pop(slug, None)
+            return None
+        entry = self._pages.pop(slug, None)
+        if entry is not None:
+            (template_path, sigs, published, html) = entry
+            try:
+                valid = self._sigs(slug, template_path) == sigs
+            except OSError:
+                valid = False
+            if not valid:
+                entry = None
+        if entry is None:
+            self.misses += 1
+            p = s2page.Page(self.site, slug, isslug=True)
+            sigs = self._sigs(slug, p.template_path)
+            html = p.render().encode('utf-8', 'xmlcharrefreplace')
+            entry = (p.template_path, sigs, p.published, html)
+        else:
+            self.hits += 1
+        self._pages[slug] = entry
+        while len(self._pages) > self.max_pages:
+            self._pages.popitem(last=False)
+        if not entry[2] and not drafts:
+            return None
+        return entry[3]
+
+    def render_front(self):
+        '''Return the first TOC page of the site (utf-8).'''
+        with self._lock:
+            return self._render_front()
+
+    def _render_front(self):
+        catalog = self.site.get_catalog()
+        gpi = []
+        for slug in catalog.published():
+            e = catalog.entries[slug]
+            if e['in_toc']:
+                gpi.append({'slug': slug, 'title': e['title'],
+                            'date': e['date'], 'in_toc': True})
+        theme = self.site.site_config['default_theme']
+        content = u''
+        for fpo in self.site.renderfront_chronological_plain(gpi, FRONT_EPP):
+            content = fpo['content']
+            break
+        template = self.site.get_template(os.path.join(
+                                self.site.dirs['themes'], theme,
+                                self.site.site_config['default_template']))
+        html = template.render(pageContent=content, isFrontPage=True,
+                               themePath='themes/' + theme + '/',
+                               commonPath='', pageTitle="TOC - 1")
+        return html.encode('utf-8', 'xmlcharrefreplace')
+
+    def file_path(self, parts):
+        '''Return the source file for the url path parts, or None.
+
+        parts is the list of (unquoted) components of the url path,
+        which doesn't point to a page itself.
+
+        '''
+        if not parts or [p for p in parts if p in ('.', '..')]:
+            return None
+        if parts[0] == 'themes' and len(parts) > 2:
+            if parts[-1].endswith('tpl'):
+                return None
+            path = os.path.join(self.site.dirs['themes'], *parts[1:])
+        elif len(parts) > 1 and self.site.page_exists_on_disk(parts[0]):
+            if parts[1] == 'nowww' or '.md' in parts[-1]:
+                return None
+            path = os.path.join(self.site.dirs['source'], *parts)
+        else:
+            path = os.path.join(self.site.dirs['common'], *parts)
+        if os.path.isfile(path):
+            return path
+        return None
+
+
+class LiveRequestHandler(S2RequestHandler):
+    '''Serve a site through a LivePreview (see make_live_handler_class).'''
+    preview = None
+
+    def send_head(self):
+        target = redirect_target(self.path, self.redirects)
+        if target is not None:
+            return S2RequestHandler.send_head(self)
+        u = urlparse.urlsplit(self.path)
+        drafts = 'draft' in urlparse.parse_qs(u.query, keep_blank_values=True)
+        parts = [p for p in urllib.unquote(u.path).split('/') if p]
+        if parts and parts[-1] == 'index.html':
+            parts = parts[:-1]
+            is_dir = True
+        else:
+            is_dir = u.path.endswith('/')
+        html = None
+        if not parts:
+            html = self.preview.render_front()
+        elif len(parts) == 1 and \
+                self.preview.site.page_exists_on_disk(parts[0]):
+            if not is_dir:
+                # like SimpleHTTPServer, so relative urls work
+                self.send_response(301)
+                self.send_header("Location", u.path + '/' +
+                                 ('?' + u.query if u.query else ''))
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return None
+            html = self.preview.render_page(parts[0], drafts)
+        else:
+            path = self.preview.file_path(parts)
+            if path is not None:
+                return self._send_file(path)
+        if html is None:
+            self.send_error(404, "File not found")
+            return None
+        return self._send_html(html)
+
+    def _send_file(self, path):
+        f = open(path, 'rb')
+        fs = os.fstat(f.fileno())
+        self.send_response(200)
+        self.send_header("Content-type", self.guess_type(path))
+        self.send_header("Content-Length", str(fs.st_size))
+        self.send_header("Last-Modified", self.date_time_string(fs.st_mtime))
+        self.end_headers()
+        return f
+
+
+def make_live_handler_class(site, max_pages=LIVE_CACHE_SIZE, notifier=None):
+    '''Return a LiveRequestHandler subclass that previews site.'''
+    class SiteLiveRequestHandler(LiveRequestHandler):
+        redirects = site.get_redirects()
+        preview = LivePreview(site, max_pages)
+    SiteLiveRequestHandler.notifier = notifier
+    return SiteLiveRequestHandler
+
+
+class PackRequestHandler(S2RequestHandler):
+    '''Serve the files of a PackReader (see make_pack_handler_class).'''
+    pack = None
+
+    def send_head(self):
+        '''Send the headers, and return the body (a buffer) or None.'''
+        target = redirect_target(self.path, self.redirects)
+        if target is not None:
+            return S2RequestHandler.send_head(self)
+        u = urlparse.urlsplit(self.path)
+        path = urllib.unquote(u.path).lstrip('/')
+        if path == '' or path.endswith('/'):
+            path += 'index.html'
+        entry = self.pack.lookup(path)
+        if entry is None and self.pack.lookup(path + '/index.html'):
+            self.send_response(301)
+            self.send_header("Location", u.path + '/')
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return None
+        if entry is None:
+            self.send_error(404, "File not found")
+            return None
+        gzipped = entry[2] == 'gzip'
+        if gzipped and not 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = self.pack.read(path)
+            gzipped = False
+        else:
+            body = self.pack.raw(entry)
+        self.send_response(200)
+        self.send_header("Content-type", self.guess_type(path))
+        self.send_header("Content-Length", str(len(body)))
+        if gzipped:
+            self.send_header("Content-Encoding", "gzip")
+        if entry[2]:
+            self.send_header("Vary", "Accept-Encoding")
+        self.end_headers()
+        return body
+
+    def do_GET(self):
+        body = self.send_head()
+        if body is not None:
+            # send the buffer on the socket without copying it
+            self.wfile.flush()
+            self.connection.sendall(body)
+
+    def do_HEAD(self):
+        self.send_head()
+
+
+def make_pack_handler_class(site, pack_path):
+    '''Return a PackRequestHandler subclass serving the pack pack_path.
+
+    site, if not None, gives the redirects of renamed pages.
+
+    '''
+    class SitePackRequestHandler(PackRequestHandler):
+        redirects = site.get_redirects() if site is not None else {}
+        pack = s2pack.PackReader(pack_path)
+    return SitePackRequestHandler
+
+
+def serve(site, ip, port, live=False, pack_path=None, reload=False):
+    '''Serve the site on ip:port, forever.
+
+    The www directory is served, unless live is True; then the pages
+    are rendered on demand (see LivePreview.) If pack_path is given,
+    the files in that pack are served instead. If reload is True (dev
+    mode), open pages reload when a generation changes them (this
+    doesn't apply to packs.)
+
+    '''
+    notifier = None
+    ServerClass  = BaseHTTPServer.HTTPServer
+    if reload and pack_path is None:
+        notifier = ChangeNotifier(site)
+        notifier.start()
+        ServerClass = ThreadingHTTPServer
+    if pack_path is not None:
+        HandlerClass = make_pack_handler_class(site, pack_path)
+    elif live:
+        HandlerClass = make_live_handler_class(site, notifier=notifier)
+    else:
+        os.chdir(site.dirs['www'])
+        HandlerClass = make_handler_class(site, notifier)
+    Protocol     = "HTTP/1.0"
+    server_address = (ip, port)
+    HandlerClass.protocol_version = Protocol
+    httpd = ServerClass(server_address, HandlerClass)
+
+    sa = httpd.socket.getsockname()
+    print "Serving HTTP on", sa[0], "port", sa[1], "..."
+    httpd.serve_forever()
@@ -1,6 +1,11 @@
 # -*- coding: utf-8 -*-
 '''This module provides funtionality for managing the site.
 
+Functions included:
+
+    - package_data_location: Return the location of the package data.
+    - shard_of: Return the shard of a page in a sharded generation.
+
 Classes included:
 
     - Site: Manages creation of the site structure, generation, etc.
@@ -14,21 +19,88 @@ import shutil
 import glob
 import math
 import tempfile
+import hashlib
+import json
 import codecs
+import time
+import contextlib
 from datetime import datetime
+from multiprocessing.pool import ThreadPool
 
 import yaml
 from mako.template import Template
+from mako.lookup import TemplateLookup
 from pyatom import AtomFeed
 
 
 #from .simplystatic import s2page
 #from .simplystatic import util
 import s2page
+import s2cache
+import s2catalog
+import s2deploy
+import s2git
+import s2images
+import s2import
+import s2pack
+import s2related
+import s2search
+import s2storage
+import s2writer
 import util
 
 PREDEFINED_DIR_NAMES = ['s2', 'www', 'source', 'common', 'themes']
 
+# maximum size (in MB) of each of the caches under s2/cache, unless the
+# site config has a '<name>_cache_mb' entry for it.
+DEFAULT_CACHE_MB = 64
+
+# environment variable with the build cache directory (see
+# Site.cache_dir); it takes precedence over the 'cache_dir' config item
+CACHE_DIR_ENV = 'S2_CACHE_DIR'
+
+# caches whose keys depend only on the content (not on the site), so
+# they can be shared by several sites (see Site.use_shared_dirs)
+SHAREABLE_CACHES = ('html', 'highlight', 'images')
+
+# file in s2 that maps the old slugs of renamed pages to the new ones
+REDIRECTS_FILE = 'redirects.yml'
+
+# files in s2 with the manifest of www and the urls changed by the last
+# generation (see Site._record_build_changes)
+BUILD_MANIFEST_FILE = 'build_manifest.json'
+BUILD_CHANGES_FILE = 'last_build_changes.txt'
+
+# file in s2 with the summary of the last generation (page info, feed
+# entries, etc.), used by Site.generate_pages
+BUILD_SUMMARY_FILE = 'build_summary.json'
+
+# file in s2 with the git commit of the last generation (see
+# Site.generate_from_git)
+BUILD_COMMIT_FILE = 'build_commit.txt'
+
+# directory in s2 for the summaries of a sharded generation (see
+# Site.generate_shard and Site.merge_shards)
+SHARDS_DIR = 'shards'
+
+# files and directories in s2 that only hold the state of the builds;
+# a change to any other file of s2 (config, redirects, the templates
+# included by the pages...) regenerates the whole site with
+# Site.generate_from_git
+BUILD_STATE_NAMES = [BUILD_MANIFEST_FILE, BUILD_CHANGES_FILE,
+                     BUILD_SUMMARY_FILE, BUILD_COMMIT_FILE, SHARDS_DIR,
+                     'cache', s2catalog.CATALOG_FILE, s2search.STATE_FILE,
+                     s2related.STATE_FILE]
+
+REDIRECT_TEMPLATE = u'''<!DOCTYPE html>
+<html><head><meta charset="utf-8"/>
+<title>Redirecting...</title>
+<link rel="canonical" href="%(url)s"/>
+<meta http-equiv="refresh" content="0; url=%(url)s"/>
+</head><body><p>This page has moved to <a href="%(url)s">%(url)s</a>.</p>
+</body></html>
+'''
+
 def verify_dir_structure(full_path):
     '''Check if given directory to see if it is usable by s2.
 
@@ -104,6 +176,18 @@ def discover_base_dir(start_dir):
 #     Just a convenience method to allow the Site to write a page.'''
 #     p.write()
 
+def _write_page_batch(storage, pages):
+    '''Write a batch of pages for Site.bulk_import. Return how many.'''
+    storage.write_many((cfg['slug'][0], s2page.page_text(cfg, body), None)
+                       for (cfg, body) in pages)
+    return len(pages)
+
+def _copy_theme(src, dest):
+    '''Copy the theme in src to dest, without its templates.'''
+    shutil.copytree(src, dest)
+    for f in glob.glob(os.path.join(dest, "*tpl")):
+        os.remove(f)
+
 def package_data_location():
     '''Get the locations of themes distributed with this package.
 
@@ -115,6 +199,16 @@ def package_data_location():
     pkg_data_dir = os.path.join(pkg_dir,'data')
     return pkg_data_dir
 
+def shard_of(slug, count):
+    '''Return the shard (0 to count-1) of the page slug.
+
+    It only depends on the slug, so it's the same on every machine.
+
+    '''
+    if isinstance(slug, unicode):
+        slug = slug.encode('utf-8')
+    return int(hashlib.sha1(slug).hexdigest(), 16) % count
+
 class Site(object):
     '''Represent the structure of the site and provide basic management.
 
@@ -150,8 +244,11 @@ class Site(object):
                   When the site is generated, the structure in *www*
                   will reflect the structure in *source*. The *s2md* 
                   file will be manipulated by the system to generate an
-                  html page, but the rest of the files will be just 
+                  html page, but the rest of the files will be just
                   copied over.
+                  With the 'sqlite' storage (see s2storage), the main
+                  source files are kept in s2/pages.sqlite instead,
+                  and only the pages with other files have a directory.
 
         - common: Contains files that must be copied directly to the 
                   generated site, such as images, javascript files and
@@ -203,6 +300,23 @@ class Site(object):
             self.site_config = self._read_site_config()
         #makodir is the directory where mako will cache the rendered templates
         self._makodir = tempfile.mkdtemp()
+        self._caches = {}
+        self._shared_cache_dir = None
+        self._templates = {}
+        self._md_converters = {}
+        self._image_stage = None
+        self._catalog = None
+        self._storage = None
+        # the write-behind queue of the generation running (see
+        # write_behind)
+        self._writer = None
+        # compiled templates found in (hits) or added to (misses) the
+        # mako directory
+        self.template_hits = 0
+        self.template_misses = 0
+        cache_dir = self.cache_dir
+        if cache_dir is not None:
+            self.use_shared_dirs(os.path.join(cache_dir, 'mako'), cache_dir)
 
     def _set_directories(self):
         '''Initialize variables based on evidence about the directories.'''
@@ -275,16 +389,16 @@ class Site(object):
             self.site_config = self._create_default_config()
 
     def get_page_names(self):
-        '''Return a list of page names (directories) under source_dir.'''
-        fis = [p  for p in glob.glob(os.path.join(self._dirs['source'], \
-                                     "*")) if os.path.isdir(p)]
-        fis = [os.path.split(p)[1] for p in fis ]
-        return fis
+        '''Return the sorted list of page names (see s2storage.)'''
+        return self.storage.names()
     #  generate should copy the common dir to www
 
-    def _wipe_www_dir(self):
+    def _wipe_www_dir(self, keep=()):
+        '''Remove everything in www, except the files named in keep.'''
         wlist = glob.glob(os.path.join(self.dirs['www'], "*"))
         for fo in wlist:
+            if os.path.split(fo)[1] in keep:
+                continue
             if os.path.isdir(fo):
                 shutil.rmtree(fo)
             else:
@@ -303,69 +417,314 @@ class Site(object):
             #there's NO base here or up the chain
             raise ValueError   #cannot generate!
 
-        # wipe www dir & recreate
-        self._wipe_www_dir()#copy common files
+        # wipe www dir & recreate. With stable pagination, the archive
+        # front pages are kept, and only rewritten if they change.
+        self._wipe_www_dir(self._stable_front_files())
+        with self._writing():
+            self._copy_common()
+            slugs = self._pages_to_generate()  # this refreshes the catalog
+            summary = self._generate_pages(slugs, slugs)
+            self._finish_generation(summary)
+
+    @contextlib.contextmanager
+    def _writing(self):
+        '''Run the writes of a generation in the background (see s2writer.)
+
+        The 'io_threads' item of the config is the number of threads
+        (0 writes synchronously), and 'io_queue_size' the number of
+        writes that can be waiting. On leaving, the pending writes are
+        finished (or dropped, if the generation failed) and the errors
+        raised. A generation within another one uses its queue.
+
+        '''
+        if self._writer is not None:
+            yield
+            return
+        queue_size = self.site_config.get('io_queue_size') or None
+        self._writer = s2writer.WriteBehind(
+                            self.site_config.get('io_threads',
+                                                 s2writer.DEFAULT_THREADS),
+                            queue_size)
+        try:
+            yield
+        except BaseException:
+            self._writer.close(abort=True)
+            raise
+        else:
+            self._writer.close()
+        finally:
+            self._writer = None
+
+    @property
+    def writing_behind(self):
+        '''True while a generation writes its files in the background.'''
+        return self._writer is not None and self._writer.threads > 0
+
+    def write_behind(self, func, *args):
+        '''Run func(*args) now, or in the background during a generation.
+
+        Return the task (see s2writer.WriteBehind.submit), or None.
+
+        '''
+        if self._writer is None:
+            func(*args)
+            return None
+        return self._writer.submit(func, *args)
+
+    def wait_writes(self, tasks=None):
+        '''Wait for the writes in tasks (for all if None) to be done.'''
+        if self._writer is None:
+            return
+        if tasks is None:
+            self._writer.flush()
+        else:
+            self._writer.wait([t for t in tasks if t is not None])
+
+    def generate_shard(self, index, count):
+        '''Generate only the pages of shard index (of count shards.)
+
+        The published pages are split in count shards by the hash of
+        their slug (see shard_of), so every machine building a shard of
+        the same sources gets the same split. Only the directories of
+        the pages of the shard are written to www; the summary needed
+        to finish the site (see merge_shards) is saved in
+        s2/shards/shard-<index>-of-<count>.json. Return the number of
+        pages generated.
+
+        '''
+        if self._dirs['base'] == None or not self._tree_ready:
+            raise ValueError
+        if not 0 <= index < count:
+            raise ValueError("shard %d/%d does not exist." % (index, count))
+        slugs = self._pages_to_generate()
+        mine = [s for s in slugs if shard_of(s, count) == index]
+        with self._writing():
+            summary = self._generate_pages(mine, slugs)
+        summary.update({'shard': index, 'count': count, 'slugs': slugs})
+        if summary['search'] is not None:
+            # keep the terms of the pages of this shard for next time
+            indexer = s2search.SearchIndexer(self)
+            indexer.add_entries(summary['search'])
+            indexer.save()
+        sdir = os.path.join(self.dirs['s2'], SHARDS_DIR)
+        if not os.path.isdir(sdir):
+            os.mkdir(sdir)
+        fd, tmpname = tempfile.mkstemp(dir=sdir)
+        os.write(fd, json.dumps(summary, sort_keys=True))
+        os.close(fd)
+        os.rename(tmpname, os.path.join(sdir, 'shard-%d-of-%d.json' %
+                                        (index, count)))
+        self.get_image_stage().close()
+        return len(mine)
+
+    def merge_shards(self):
+        '''Finish a site generated in shards (see generate_shard.)
+
+        The page directories of all the shards must be in www, and
+        their summaries in s2/shards. The rest of www (common files,
+        themes, front pages, atom.xml, sitemap, search index, redirect
+        pages) is written from the summaries, as generate would.
+        The summaries must cover all the published pages, and all come
+        from the same sources; a ValueError is raised otherwise.
+        Return the number of shards merged.
+
+        '''
+        if self._dirs['base'] == None or not self._tree_ready:
+            raise ValueError
+        slugs = self._pages_to_generate()
+        shards = {}
+        for fn in sorted(glob.glob(os.path.join(self.dirs['s2'], SHARDS_DIR,
+                                                'shard-*-of-*.json'))):
+            fin = open(fn, 'rb')
+            s = json.load(fin)
+            fin.close()
+            shards[(s['shard'], s['count'])] = s
+        counts = set([c for (i, c) in shards])
+        if len(counts) != 1:
+            raise ValueError("need the summaries of one sharded generation, "
+                             "found %d." % len(counts))
+        count = counts.pop()
+        missing = [i for i in range(count) if (i, count) not in shards]
+        if missing:
+            raise ValueError("missing shards: %s (of %d)." %
+                             (', '.join([str(i) for i in missing]), count))
+        shards = [shards[(i, count)] for i in range(count)]
+        for s in shards:
+            if s['slugs'] != slugs:
+                raise ValueError("shard %d/%d was generated from other pages."
+                                 % (s['shard'], count))
+        # put the parts of the shards together, in the order of a
+        # single generation
+        info = {}
+        feed = {}
+        search = {}
+        themes = []
+        for s in shards:
+            info.update([(e['slug'], e) for e in s['pages']])
+            feed.update([(e['slug'], e) for e in s['feed']])
+            if s['search'] is not None:
+                search.update(s['search'])
+            themes.extend([t for t in s['themes'] if t not in themes])
+        summary = {'pages': [info[slug] for slug in slugs],
+                   'feed': [feed[slug] for slug in slugs],
+                   'search': search if self._search_enabled() else None,
+                   'themes': themes}
+        self._wipe_www_dir(slugs + self._stable_front_files())
+        with self._writing():
+            self._copy_common()
+            self._finish_generation(summary)
+        return count
+
+    def _stable_front_files(self):
+        '''Return the names of the front pages kept in www by generate.'''
+        if self._stable_pagination() and not self.site_config['fixed_frontpage']:
+            return [os.path.split(f)[1] for f in
+                    glob.glob(os.path.join(self.dirs['www'], '[0-9]*.html'))]
+        return []
+
+    def _search_enabled(self):
+        return self.site_config.get('search_index', True)
+
+    def _copy_common(self):
+        '''Copy the common files to www.'''
         #shutil.copytree(self.dirs['common'],
         #                os.path.join(self.dirs['www'],"common"))
-        slist = glob.glob(os.path.join(self.dirs['common'],"*"))
+        slist = sorted(glob.glob(os.path.join(self.dirs['common'],"*")))
+        tasks = []
         for fo in slist:
             rfn = os.path.split(fo)[1]
             if os.path.isdir(fo):
-                shutil.copytree(fo, os.path.join(self.dirs['www'], rfn))
+                tasks.append(self.write_behind(shutil.copytree, fo,
+                                               os.path.join(self.dirs['www'], rfn)))
             else:
-                shutil.copy(fo, self.dirs['www'])
+                tasks.append(self.write_behind(shutil.copy, fo, self.dirs['www']))
+        stage = self.get_image_stage()
+        if stage.enabled:
+            # the variants go next to the copies
+            self.wait_writes(tasks)
+            stage.process_dir(self.dirs['common'], self.dirs['www'])
 
-        # init atom file
-        title = self.site_config['site_title']
-        if title == '':
-            title = "<No title>"
-        feed = AtomFeed(title=title,
-                subtitle=self.site_config['site_subtitle'],
-                feed_url= os.path.join( self.site_config['site_url'],"atom.xml"),
-                url=self.site_config['site_url'],
-                author=self.site_config['default_author'])
+    def _generate_pages(self, slugs, all_slugs):
+        '''Generate the pages in slugs, and return the generation summary.
 
+        all_slugs are all the published pages (related pages are looked
+        for among them.) The summary is a dictionary with:
 
-        themes_to_copy = []  # full paths!
+            - pages: the page info of the pages, for the front pages
+              and the sitemap;
+            - feed: the atom feed entries of the pages;
+            - search: the search index entries of the pages (or None,
+              if the site has no search index);
+            - themes: the names of the themes used.
+
+        It only contains strings, numbers, lists and dictionaries, so
+        it can be saved as JSON (see generate_shard.)
+
+        '''
+        indexer = None
+        if self._search_enabled():
+            indexer = s2search.SearchIndexer(self)
+        themes = []
         generated_page_info = []
-        for slug in self._pages_to_generate():  #this list of pages is in reverse chrono order
+        feed_entries = []
+        related = self._related_pages(all_slugs)
+        for slug in slugs:  #this list of pages is in reverse chrono order
             p = s2page.Page(self, slug, isslug=True)
+            p.related_pages = related.get(slug, [])
             generated_page_info.append( {'slug': p.slug,
                                          'title':p.title,
                                          'date': p.creation_date,
                                          'in_toc': p.in_toc })
-            t = p.theme_path
-            if not t in themes_to_copy:
-                themes_to_copy.append(t)
+            t = os.path.split(p.theme_path)[1]
+            if not t in themes:
+                themes.append(t)
             # wipe destination.
             self._wipe_www_page(slug)
-            pg_content = p.generate() #generate page
-            # add atom entry
+            # the html of the content, for the page, the feed and the index
+            page_html = p.body_html()
+            p.generate(page_html) #generate page (its files are written by the writer)
+            # atom entry
             try:
-                cdd = datetime.strptime(p.creation_date, '%Y-%m-%d') # feed.add needs the dat in datetime format
+                datetime.strptime(p.creation_date, '%Y-%m-%d') # the feed needs the date in datetime format
             except:
                 print "Wrong date format in page '%s'. It should be YYYY-MM-DD."%p.slug
                 print "Site Generation stopped!!  correct the date and generate again."
+                if self._writer is not None:
+                    self._writer.close(abort=True)
                 self._wipe_www_dir()
                 sys.exit()
-            feed.add(title= p.title,
-                     content=pg_content,
+            feed_entries.append({'slug': p.slug,
+                                 'title': p.title,
+                                 'content': page_html,
+                                 'author': p.author,
+                                 'date': p.creation_date})
+            if indexer is not None:
+                indexer.add(p, self._catalog.entries[slug]['sig'], page_html)
+        search = None
+        if indexer is not None:
+            search = indexer.entries()
+        return {'pages': generated_page_info, 'feed': feed_entries,
+                'search': search, 'themes': themes}
+
+    def _finish_generation(self, summary, touched=None):
+        '''Write the rest of www from a summary (see _generate_pages.)
+
+        touched, for a targeted generation (see generate_pages), lists
+        the files and directories of www that it wrote; www is not
+        empty then, so the redirects and themes already there are
+        kept, and only the touched files are looked at to record the
+        changes. The summary is saved for the next targeted generation.
+
+        '''
+        # init atom file
+        title = self.site_config['site_title']
+        if title == '':
+            title = "<No title>"
+        feed = AtomFeed(title=title,
+                subtitle=self.site_config['site_subtitle'],
+                feed_url= os.path.join( self.site_config['site_url'],"atom.xml"),
+                url=self.site_config['site_url'],
+                author=self.site_config['default_author'])
+        # the feed is as new as its newest page, so it doesn't change
+        # unless the pages do
+        feed.updated = datetime(1970, 1, 1)
+        for e in summary['feed']:
+            cdd = datetime.strptime(e['date'], '%Y-%m-%d')
+            feed.add(title=e['title'],
+                     content=e['content'],
                      content_type="html",
-                     author=p.author,
+                     author=e['author'],
                      url=os.path.join( self.site_config['site_url'],"atom.xml") ,
                      updated=cdd)
+            feed.updated = max(feed.updated, cdd)
+
+        if summary['search'] is not None:
+            indexer = s2search.SearchIndexer(self)
+            indexer.add_entries(summary['search'])
+            indexer.write(os.path.join(self.dirs['www'], 'search'))
+
+        # redirects for renamed pages (unless the old slug is used again)
+        if touched is None:
+            for (old_slug, new_slug) in sorted(self.get_redirects().items()):
+                if not self.page_exists_on_disk(old_slug):
+                    self._write_redirect_page(old_slug, new_slug)
 
         # copy themes
         wthemesdir = os.path.join(self.dirs['www'],"themes")
-        os.mkdir(wthemesdir)
-        for d in themes_to_copy:
-            dname = os.path.split(d)[1]
+        if not os.path.isdir(wthemesdir):
+            os.mkdir(wthemesdir)
+        for dname in summary['themes']:
             destpath = os.path.join(wthemesdir, dname)
-            shutil.copytree(d, destpath)
-            # delete tpl files
-            ttr = glob.glob(os.path.join(destpath,"*tpl"))
-            for f in ttr:
-                os.remove(f)
+            if os.path.isdir(destpath):
+                continue  # targeted generation, already there
+            if touched is not None:
+                touched.append('themes/' + dname)
+            self.write_behind(_copy_theme, os.path.join(self.dirs['themes'], dname),
+                              destpath)
+
+        # the pages, common files and themes must be in www before the
+        # listings are written and the changes recorded
+        self.wait_writes()
 
         # write atom file
         atomfile= codecs.open(os.path.join(self.dirs['www'],"atom.xml"), "w", encoding="utf-8", errors="xmlcharrefreplace")
@@ -373,45 +732,334 @@ class Site(object):
         atomfile.close()
 
         # create front page/s
-        #print "generated_page_info for gf ",generated_page_info
+        generated_page_info = summary['pages']
         ff = self.site_config['fixed_frontpage']
         if ff != None and ff != '':
-            self._set_fixed_frontpage(ff)
+            if not os.path.lexists(os.path.join(self.dirs['www'], 'index.html')):
+                self._set_fixed_frontpage(ff)
         else:
             self.generate_front(generated_page_info)
         self._generate_site_map(generated_page_info)
+        self.get_image_stage().close()
+        self._save_summary(summary)
+        self._record_build_changes(touched)
+
+    def generate_from_git(self):
+        '''Generate the pages changed in git since the last generation.
+
+        The commit checked out when the site is generated this way is
+        saved in s2/build_commit.txt. The next time, git is asked for
+        the files changed under source, themes, common and s2 since
+        then (see s2git), committed or not, and only the pages in those
+        directories of source are generated (see generate_pages.) The
+        whole site is generated instead if a theme, a common file, a
+        file directly in source, or a file of s2 other than the build
+        state (see BUILD_STATE_NAMES) changed, e.g. the config, the
+        redirects, the page database (see s2storage) or the templates
+        that the pages include; or if git can't tell (there's no git,
+        or no saved commit, or it's not in the history.)
+
+        Return None if the whole site was generated, or the list of
+        pages generated otherwise.
+
+        '''
+        if self._dirs['base'] == None or not self._tree_ready:
+            raise ValueError
+        base = self._dirs['base']
+        head = s2git.head_commit(base)
+        changed = None
+        since = self._read_build_commit()
+        if head is not None and since is not None:
+            changed = s2git.changed_paths(base, since,
+                                          ['source', 'themes', 'common', 's2'])
+        slugs = set()
+        if changed is not None:
+            for path in changed:
+                parts = path.split('/')
+                if parts[0] in ('themes', 'common') or \
+                        (parts[0] == 's2' and
+                         not parts[1] in BUILD_STATE_NAMES and
+                         # temporary files of a build
+                         not parts[1].startswith('tmp')) or \
+                        (parts[0] == 'source' and len(parts) == 2):
+                    changed = None
+                    break
+                if parts[0] == 'source':
+                    slugs.add(parts[1])
+        if changed is None or self._load_summary() is None:
+            self.generate()
+            r = None
+        else:
+            # deleted pages are dropped by generate_pages by themselves
+            r = self.generate_pages(sorted([s for s in slugs
+                                            if self.page_exists_on_disk(s)]))
+        if head is not None:
+            fout = open(os.path.join(self.dirs['s2'], BUILD_COMMIT_FILE), 'w')
+            fout.write(head + '\n')
+            fout.close()
+        return r
+
+    def _read_build_commit(self):
+        try:
+            fin = open(os.path.join(self.dirs['s2'], BUILD_COMMIT_FILE))
+            commit = fin.read().strip()
+            fin.close()
+        except IOError:
+            return None
+        return commit or None
+
+    def _save_summary(self, summary):
+        '''Save the summary of the generation in s2 (see generate_pages.)'''
+        fd, tmpname = tempfile.mkstemp(dir=self.dirs['s2'])
+        os.write(fd, json.dumps(summary, sort_keys=True))
+        os.close(fd)
+        os.rename(tmpname, os.path.join(self.dirs['s2'], BUILD_SUMMARY_FILE))
+
+    def _load_summary(self):
+        '''Return the summary saved by the last generation, or None.'''
+        try:
+            fin = open(os.path.join(self.dirs['s2'], BUILD_SUMMARY_FILE), 'rb')
+            summary = json.load(fin)
+            fin.close()
+        except (IOError, ValueError):
+            return None
+        return summary
+
+    def generate_pages(self, slugs):
+        '''Generate only the pages in slugs, and what lists them.
+
+        The pages are rendered as generate would, and then the front
+        pages, atom.xml, the sitemap and the search index are written
+        again from the summary of the last generation (kept in
+        s2/build_summary.json), with the entries of these pages
+        updated, so the other pages are not even read. A page in slugs
+        that is no longer published is removed from www and from the
+        listings, as are the pages of the summary that were deleted or
+        renamed since (a renamed one gets its redirect page.)
+
+        If there's no summary (the site was never generated, www was
+        moved into a pack, or the summary is from an older s2), the
+        whole site is generated.
+        Return the list of pages generated.
+
+        '''
+        if self._dirs['base'] == None or not self._tree_ready:
+            raise ValueError
+        for slug in slugs:
+            if not self.page_exists_on_disk(slug):
+                raise ValueError("there is no page '%s'." % slug)
+        summary = self._load_summary()
+        if summary is None:
+            self.generate()
+            return self._pages_to_generate()
+        published = self._pages_to_generate()
+        mine = [s for s in published if s in slugs]
+        gone = set([e['slug'] for e in summary['pages']]) - set(published)
+        gone = sorted(gone | (set(slugs) - set(mine)))
+        touched = ['search']  # and the files at the top of www
+        if not self._stable_pagination():
+            # they are all written again (except those not needed now)
+            for f in glob.glob(os.path.join(self.dirs['www'], '[0-9]*.html')):
+                os.remove(f)
+        redirects = self.get_redirects()
+        for slug in gone:
+            self._wipe_www_page(slug)
+            touched.append(slug)
+            if slug in redirects and not self.page_exists_on_disk(slug):
+                self._write_redirect_page(slug, redirects[slug])
+        with self._writing():
+            new = self._generate_pages(mine, published)
+            touched += mine
+            # replace the entries of the pages generated, and keep the
+            # order of a whole generation
+            info = dict([(e['slug'], e) for e in summary['pages']])
+            info.update([(e['slug'], e) for e in new['pages']])
+            feed = dict([(e['slug'], e) for e in summary['feed']])
+            feed.update([(e['slug'], e) for e in new['feed']])
+            order = [s for s in published if s in info and not s in gone]
+            summary['pages'] = [info[s] for s in order]
+            summary['feed'] = [feed[s] for s in order]
+            if summary['search'] is not None and new['search'] is not None:
+                for slug in gone:
+                    summary['search'].pop(slug, None)
+                summary['search'].update(new['search'])
+            else:
+                summary['search'] = new['search']
+            summary['themes'].extend([t for t in new['themes']
+                                      if not t in summary['themes']])
+            self._finish_generation(summary, touched)
+        return mine
+
+    def pack_www(self, pack_path):
+        '''Move the generated site into the pack file pack_path.
+
+        See s2pack. The pack is read from the files that the generation
+        wrote to www, so they are still all written (and then removed.)
+        www is left empty; the next generation starts from
+        scratch (the changes are still recorded, see
+        _record_build_changes.) That includes generate_pages and
+        generate_from_git: the summary of the generation is removed, so
+        they don't write a few pages into an empty www. Return the
+        number of files packed.
+
+        '''
+        n = s2pack.write_pack(self.dirs['www'], pack_path)
+        self._wipe_www_dir()
+        summary = os.path.join(self.dirs['s2'], BUILD_SUMMARY_FILE)
+        if os.path.isfile(summary):
+            os.remove(summary)
+        return n
+
+    def _record_build_changes(self, touched=None):
+        '''Compare www with the previous build, and record the changes.
+
+        The manifest of www (see s2deploy) and the lists of added,
+        changed and removed files are kept in s2/build_manifest.json.
+        s2/last_build_changes.txt lists the urls of those files (against
+        site_url), one per line, after 'added', 'changed' or 'removed'
+        and a tab, e.g. to purge them from a CDN. If touched is given
+        (files and directories relative to www), only those are read;
+        the rest of the manifest is taken from the previous one, except
+        for the files at the top of www (front pages, feed, etc.)
+
+        '''
+        path = os.path.join(self.dirs['s2'], BUILD_MANIFEST_FILE)
+        old = s2deploy.read_manifest_file(path).get('files', {})
+        if touched is None:
+            new = s2deploy.build_manifest(self.dirs['www'])
+        else:
+            touched = set(touched)
+            touched.update([f for f in old if not '/' in f])
+            touched.update([f for f in os.listdir(self.dirs['www']) if
+                            os.path.isfile(os.path.join(self.dirs['www'], f))])
+            # touched are top level files or directories, or theme
+            # directories (themes/<name>)
+            new = dict([(f, h) for (f, h) in old.iteritems()
+                        if not f in touched and
+                        not f.split('/', 1)[0] in touched and
+                        not '/'.join(f.split('/', 2)[:2]) in touched])
+            for t in touched:
+                fp = os.path.join(self.dirs['www'], t)
+                if os.path.isdir(fp):
+                    new.update([(t + '/' + f, h) for (f, h) in
+                                s2deploy.build_manifest(fp).iteritems()])
+                elif os.path.isfile(fp):
+                    new[t] = s2cache.file_hash(fp)
+        (added, changed, removed) = s2deploy.diff_manifests(old, new)
+        s2deploy.write_manifest_file(path, new, added=added, changed=changed,
+                                     removed=removed)
+        fout = open(os.path.join(self.dirs['s2'], BUILD_CHANGES_FILE), 'w')
+        for (kind, files) in (('added', added), ('changed', changed),
+                              ('removed', removed)):
+            for f in files:
+                fout.write(kind + '\t' + s2deploy.relpath_url(
+                            self.site_config['site_url'], f) + '\n')
+        fout.close()
 
+    def get_build_changes(self):
+        '''Return (added, changed, removed) files of www in the last build.
+
+        The files are relative to www, with / as separator.
+
+        '''
+        data = s2deploy.read_manifest_file(os.path.join(self.dirs['s2'],
+                                                        BUILD_MANIFEST_FILE))
+        return (data.get('added', []), data.get('changed', []),
+                data.get('removed', []))
+
+
+    def _related_pages(self, slugs):
+        '''Return {slug: [related page info]} for the given pages.
+
+        This is empty unless the 'related_pages' config item (the
+        number of related pages per page) is greater than 0.
+
+        '''
+        k = self.site_config.get('related_pages', 0)
+        if not k:
+            return {}
+        entries = self._catalog.entries
+        rp = s2related.RelatedPages(self, k)
+        r = rp.compute(rp.page_vectors(entries, slugs))
+        return dict([(s, [{'slug': rs, 'title': entries[rs]['title'],
+                           'url': '../' + rs + '/'} for rs in r[s]])
+                     for s in r])
+
+    def _stable_pagination(self):
+        return self.site_config.get('front_pagination', 'newest') == 'stable'
 
     def generate_front(self,generated_page_info, epp=10):
+        '''Write the TOC pages (index.html, 2.html, 3.html etc.)
+
+        If the 'front_pagination' config item is 'stable', see
+        renderfront_chronological_stable. Otherwise, the pages are
+        numbered from the newest one, as usual.
+
+        '''
         themepath = "../themes/" + self.site_config['default_theme'] +'/'
 
         commonpath = self._dirs['common']
         template_path = os.path.join(self._dirs['themes'],
                                      self.site_config['default_theme'],
                                      self.site_config['default_template'])
-        makotemplate = Template(filename=template_path,
-                                module_directory=self._makodir)
+        makotemplate = self.get_template(template_path)
 
         # remove pages which should not be in TOC
         generated_page_info = [gpi for gpi in generated_page_info if gpi['in_toc']]
         generated_page_info = sorted(generated_page_info, key=lambda x : x['date'],reverse=True)
+        if self._stable_pagination():
+            self._generate_front_stable(makotemplate, themepath, commonpath,
+                                        generated_page_info, epp)
+            return
         frontpage_iterator = self.renderfront_chronological_plain(generated_page_info,epp)
         i = 0
         for fpo in frontpage_iterator:
             i += 1
-            rendition = makotemplate.render(pageContent=fpo['content'],isFrontPage=True,
-                                            themePath=themepath,
-                                            commonPath=commonpath,
-                                            pageTitle="TOC - " + str(i))
             if i == 1:
                 fname = "index.html"
             else:
                 fname = str(i) + '.html'
             fullpath = os.path.join(self._dirs['www'],fname)
+            s2page.render_to_file(makotemplate, fullpath,
+                                  pageContent=fpo['content'],isFrontPage=True,
+                                  themePath=themepath,
+                                  commonPath=commonpath,
+                                  pageTitle="TOC - " + str(i))
+
+    def _generate_front_stable(self, makotemplate, themepath, commonpath,
+                               generated_page_info, epp):
+        '''Write the stable TOC pages, only where their content changed.
+
+        Numbered pages left from a previous generation that are no
+        longer used are removed.
 
-            fout = codecs.open(fullpath, "w", encoding="utf-8", errors="xmlcharrefreplace")
-            fout.write(rendition)
+        '''
+        names = set()
+        for fpo in self.renderfront_chronological_stable(generated_page_info, epp):
+            names.add(fpo['fname'])
+            if fpo['number'] is None:
+                title = "TOC"
+            else:
+                title = "TOC - " + str(fpo['number'])
+            rendition = makotemplate.render(pageContent=fpo['content'],
+                                            isFrontPage=True,
+                                            themePath=themepath,
+                                            commonPath=commonpath,
+                                            pageTitle=title)
+            data = rendition.encode('utf-8', 'xmlcharrefreplace')
+            fullpath = os.path.join(self._dirs['www'], fpo['fname'])
+            if os.path.isfile(fullpath):
+                fin = open(fullpath, 'rb')
+                old = fin.read()
+                fin.close()
+                if old == data:
+                    continue
+            fout = open(fullpath, 'wb')
+            fout.write(data)
             fout.close()
+        for f in glob.glob(os.path.join(self._dirs['www'], '[0-9]*.html')):
+            if not os.path.split(f)[1] in names:
+                os.remove(f)
 
     def renderfront_chronological_plain(self,generated_page_info, epp=10):
         # renderfront methods should return an iterator
@@ -419,8 +1067,7 @@ class Site(object):
         innertemplate_path = os.path.join(self._dirs['themes'],
                                      self.site_config['default_theme'],
                                      "chronological_plain_front.tpl")
-        innertemplate = Template(filename=innertemplate_path,
-                                module_directory=self._makodir)
+        innertemplate = self.get_template(innertemplate_path)
 
         # divide the generated page info in slices of size epp
         numpages = math.ceil(float(len(generated_page_info))/epp)
@@ -448,6 +1095,48 @@ class Site(object):
             yield frontpage_obj
 
 
+    def renderfront_chronological_stable(self, generated_page_info, epp=10):
+        '''Yield the TOC pages numbered from the oldest page.
+
+        1.html has the oldest epp pages, 2.html the next epp, and so on;
+        index.html has the newest ones (between 1 and epp of them.) When
+        a page is published, only index.html changes, or (when it's full)
+        its pages move to a new numbered page, which also changes the
+        back link of the previous one. Older numbered pages stay the
+        same, byte for byte.
+
+        Each item is like those of renderfront_chronological_plain, plus
+        'fname' and 'number' (None for index.html.)
+
+        '''
+        innertemplate_path = os.path.join(self._dirs['themes'],
+                                     self.site_config['default_theme'],
+                                     "chronological_plain_front.tpl")
+        innertemplate = self.get_template(innertemplate_path)
+        oldest_first = list(reversed(generated_page_info))
+        narchive = max(len(oldest_first) - 1, 0) // epp
+        # index.html first, then the archive from the newest
+        for n in [None] + range(narchive, 0, -1):
+            if n is None:
+                chunk = oldest_first[narchive * epp:]
+                fname = 'index.html'
+                back = None
+                nxt = str(narchive) + '.html' if narchive else None
+            else:
+                chunk = oldest_first[(n - 1) * epp:n * epp]
+                fname = str(n) + '.html'
+                if n == narchive:
+                    back = 'index.html'
+                else:
+                    back = str(n + 1) + '.html'
+                nxt = str(n - 1) + '.html' if n > 1 else None
+            chunk.reverse()
+            content = innertemplate.render(generatedPageInfo=chunk,
+                                           backPageUrl=back,
+                                           nextPageUrl=nxt)
+            yield {'content': content, 'next_page_url': nxt,
+                   'back_page_url': back, 'fname': fname, 'number': n}
+
     def _set_fixed_frontpage(self,ff):
         target = os.path.join(self._dirs['www'],ff, "index.html")
         if not os.path.isfile(target):
@@ -495,22 +1184,293 @@ object.'''
         return p
 
     def page_exists_on_disk(self, slug):
-        '''Return true if post directory and post file both exist.'''
+        '''Return true if the page is in the storage of the site.
 
-        r = False
-        page_dir = os.path.join(self.dirs['source'], slug)
-        page_file_name = os.path.join(page_dir, slug + '.md')
-        if os.path.isdir(page_dir):
-            if os.path.isfile(page_file_name):
-                r = True
+        With the default storage, that means that the page directory
+        and page file both exist (see s2storage.)
+
+        '''
+        return self.storage.exists(slug)
+
+    def get_redirects(self):
+        '''Return the dictionary that maps old slugs to current slugs.'''
+        fn = os.path.join(self._dirs['s2'], REDIRECTS_FILE)
+        if not os.path.isfile(fn):
+            return {}
+        f = open(fn, 'r')
+        r = yaml.safe_load(f) or {}
+        f.close()
         return r
 
+    def add_redirect(self, old_slug, new_slug):
+        '''Record that the page old_slug is now new_slug.
+
+        Earlier redirects to old_slug are pointed to new_slug, and a
+        redirect from new_slug (if that slug had been used before) is
+        dropped. If old_slug had been generated, its www directory is
+        replaced by a redirect page.
+
+        '''
+        r = self.get_redirects()
+        for k in r:
+            if r[k] == old_slug:
+                r[k] = new_slug
+        r.pop(new_slug, None)
+        r[old_slug] = new_slug
+        fn = os.path.join(self._dirs['s2'], REDIRECTS_FILE)
+        f = open(fn, 'w')
+        # slugs are always ascii
+        f.write(yaml.safe_dump(dict([(str(k), str(v))
+                                     for (k, v) in r.items()]),
+                               default_flow_style=False))
+        f.close()
+        if os.path.isdir(os.path.join(self._dirs['www'], old_slug)):
+            self._write_redirect_page(old_slug, new_slug)
+
+    def _write_redirect_page(self, old_slug, new_slug):
+        '''Write www/old_slug/index.html, redirecting to new_slug.'''
+        self._wipe_www_page(old_slug)
+        wd = os.path.join(self._dirs['www'], old_slug)
+        os.mkdir(wd)
+        fout = codecs.open(os.path.join(wd, 'index.html'), "w",
+                           encoding="utf-8")
+        fout.write(REDIRECT_TEMPLATE % {'url': '../' + new_slug + '/'})
+        fout.close()
+
     def rename_page(self, old_slug, new_title):
         '''Load the page corresponding to the slug, and rename it.'''
         #load page
         p = s2page.Page(self, old_slug, isslug=True)
         p.rename(new_title)
 
+    def get_cache(self, name):
+        '''Return the disk cache called name (under s2/cache).
+
+        The cache objects are kept for the life of the site object, so
+        their hit/miss counters cover a whole generation.
+
+        '''
+        if not name in self._caches:
+            size_mb = self.site_config.get(name + '_cache_mb',
+                                           DEFAULT_CACHE_MB)
+            if self._shared_cache_dir and name in SHAREABLE_CACHES:
+                cache_dir = os.path.join(self._shared_cache_dir, name)
+            else:
+                cache_dir = os.path.join(self._dirs['s2'], 'cache', name)
+            self._caches[name] = s2cache.DiskCache(cache_dir,
+                                                   size_mb * 1024 * 1024)
+        return self._caches[name]
+
+    @property
+    def cache_dir(self):
+        '''Return the build cache directory of the site, or None.
+
+        It's the S2_CACHE_DIR environment variable or, if that's not
+        set, the 'cache_dir' config item (relative to the site base.)
+        The compiled templates and the caches in SHAREABLE_CACHES are
+        kept there instead of in s2/cache. Every entry is named after
+        its content and written under a temporary name and then
+        renamed, so the directory can be copied between machines (see
+        s2cache.export_cache) and used by several builds at once.
+
+        '''
+        d = os.environ.get(CACHE_DIR_ENV)
+        if not d and self._tree_ready:
+            d = self.site_config.get('cache_dir')
+        if not d:
+            return None
+        return os.path.join(self._dirs['base'] or self._dirs['run'],
+                            os.path.expanduser(d))
+
+    def use_shared_dirs(self, makodir=None, cache_dir=None):
+        '''Use directories shared with other sites (see s2many.)
+
+        makodir is where mako keeps the compiled templates; since they
+        are named after the template contents (see get_template), sites
+        with the same theme files compile them only once. If cache_dir
+        is given, the caches in SHAREABLE_CACHES are kept under it
+        instead of under s2/cache. Call this before generating.
+
+        '''
+        if makodir is not None:
+            self._makodir = makodir
+            self._templates = {}
+        if cache_dir is not None:
+            self._shared_cache_dir = cache_dir
+            for name in SHAREABLE_CACHES:
+                self._caches.pop(name, None)
+            self._md_converters = {}  # they hold the highlight cache
+
+    def get_template(self, filename, lookup_dirs=None):
+        '''Return the mako Template for the file filename.
+
+        The compiled module (in the mako directory) is named after a
+        hash of the file's content, so identical files are compiled
+        only once. The Template objects are kept, and reused while the
+        file doesn't change. lookup_dirs, if given, are the directories
+        where mako looks for the files that the template includes.
+
+        '''
+        st = os.stat(filename)
+        k = (filename, tuple(lookup_dirs or ()))
+        sig = (st.st_mtime, st.st_size)
+        if k in self._templates and self._templates[k][0] == sig:
+            return self._templates[k][1]
+        lookup = None
+        if lookup_dirs:
+            lookup = TemplateLookup(directories=list(lookup_dirs),
+                                    input_encoding='utf-8',
+                                    output_encoding='utf-8')
+        h = s2cache.file_hash(filename)
+        name = os.path.split(filename)[1]
+        uri = '/%s/%s' % (h, name)
+        if os.path.isfile(os.path.join(self._makodir, h, name + '.py')):
+            self.template_hits += 1
+        else:
+            self.template_misses += 1
+        t = Template(filename=filename, lookup=lookup, uri=uri,
+                     module_directory=self._makodir)
+        self._templates[k] = (sig, t)
+        return t
+
+    def get_md_converter(self, ext_names):
+        '''Return a markdown converter for the given extension names.
+
+        Converters are created once per set of extensions (that is, per
+        markdown profile) and reset before being handed out, so pages
+        that use the same profile share the same converter.
+
+        '''
+        k = tuple(ext_names)
+        if not k in self._md_converters:
+            self._md_converters[k] = s2page.make_md_converter(ext_names, self)
+        md = self._md_converters[k]
+        md.reset()
+        return md
+
+    def bulk_import(self, records, threads=8, batch_size=100,
+                    progress=None):
+        '''Add many pages to the site at once.
+
+        records is an iterable of dictionaries (see s2import for their
+        keys.) All the slugs are computed and checked for collisions
+        (with existing pages and among the records) in memory before
+        anything is written; records that collide, or that are not
+        valid, are skipped. The pages are then written in batches of
+        batch_size by a pool of threads, and the catalog is updated
+        and saved once at the end.
+
+        progress, if given, is called as progress(done, total, elapsed)
+        after every batch.
+
+        Return (imported_slugs, skipped), where skipped is a list of
+        (title, reason) tuples.
+
+        '''
+        st = time.time()
+        catalog = self.get_catalog()
+        taken = set(catalog.entries)
+        skipped = []
+        pages = []
+        for rec in records:
+            try:
+                rec = s2import.normalize_record(rec)
+            except ValueError as e:
+                title = rec.get('title') if isinstance(rec, dict) else None
+                skipped.append((title, str(e)))
+                continue
+            slug = util.make_slug(rec['title'].encode('utf-8'))
+            if slug == '':
+                skipped.append((rec['title'], 'empty slug'))
+                continue
+            if slug in taken:
+                skipped.append((rec['title'], "slug '%s' exists" % slug))
+                continue
+            taken.add(slug)
+            cfg = s2page.new_config(self, rec['title'], slug)
+            cfg['creation_date'] = [rec['date']]
+            cfg['status'] = [rec['status']]
+            cfg['tags'] = rec['tags'] or [u'']
+            if 'author' in rec:
+                cfg['author'] = [rec['author']]
+            pages.append((cfg, rec['body']))
+
+        batches = [pages[i:i + batch_size]
+                   for i in range(0, len(pages), batch_size)]
+        done = 0
+        storage = self.storage
+        # a storage that can't be written from several threads (a
+        # database) writes each batch in a single transaction instead
+        pool = ThreadPool(threads if storage.threaded else 1)
+        try:
+            for n in pool.imap_unordered(
+                            lambda b: _write_page_batch(storage, b), batches):
+                done += n
+                if progress is not None:
+                    progress(done, len(pages), time.time() - st)
+        finally:
+            pool.close()
+            pool.join()
+
+        imported = []
+        for (cfg, body) in pages:
+            catalog.update(cfg['slug'][0], cfg)
+            imported.append(cfg['slug'][0])
+        catalog.save()
+        return (imported, skipped)
+
+    def reload_config(self):
+        '''Read the site config again (e.g. in a long-running process.)'''
+        if self._tree_ready:
+            self.site_config = self._read_site_config()
+            self._reset_storage()
+
+    def set_config(self, key, value):
+        '''Set an item of the site config, and write the config file.'''
+        self.site_config[key] = value
+        fout = open(os.path.join(self._dirs['s2'], 'config.yml'), 'w')
+        fout.write(yaml.dump(self.site_config, default_flow_style=False))
+        fout.close()
+        self._reset_storage()
+
+    @property
+    def storage(self):
+        '''The storage of the page texts (see s2storage.)'''
+        if self._storage is None:
+            self._storage = s2storage.get_storage(self)
+        return self._storage
+
+    def _reset_storage(self):
+        '''Drop the storage if the config now asks for another one.'''
+        name = self.site_config.get('storage') or s2storage.DEFAULT_STORAGE
+        if self._storage is not None and self._storage.name != name:
+            self._storage.close()
+            self._storage = None
+
+    def get_catalog(self):
+        '''Return the catalog of pages (see s2catalog), up to date.
+
+        The catalog is refreshed (only pages whose file changed are
+        read) and saved, if that changed it.
+
+        '''
+        if self._catalog is None:
+            self._catalog = s2catalog.Catalog(self)
+        self._catalog.refresh()
+        self._catalog.save()
+        return self._catalog
+
+    def get_image_stage(self):
+        '''Return the image stage (see s2images) used by this site.'''
+        if self._image_stage is None:
+            self._image_stage = s2images.ImageStage(self)
+        return self._image_stage
+
+    @property
+    def caches(self):
+        '''Return a dictionary with the caches used so far.'''
+        return self._caches
+
     @property
     def dirs(self):
         '''Return the information about site directories.'''
@@ -524,26 +1484,14 @@ object.'''
     def _wipe_www_page(self, slug):
         '''Remove all data in www about the page identified by slug.'''
         wd = os.path.join(self._dirs['www'], slug)
-        if os.path.isdir(wd): # pragma: no cover
+        if os.path.isdir(wd):
             shutil.rmtree(wd)
 
     def _pages_to_generate(self):
         '''Return list of slugs that correspond to pages to generate.'''
-        # right now it gets all the files. In theory, It should only
-        # get what's changed... but the program is not doing that yet.
-
-        all_pages = self.get_page_names()
-        # keep only those whose status is published
-        ptg = []
-        for slug in all_pages:
-            p = s2page.Page(self, slug, isslug=True)
-            if p.published:
-                ptg.append({'slug': p.slug, 'title':p.title, 'date': p.creation_date })
-
-        # sort the ptg array in reverse chronological order of its entries.
-        sptg = sorted(ptg, key=lambda x : x['date'],reverse=True)
-        res = [ pinfo['slug'] for pinfo in sptg]
-        return res
+        # the catalog only re-reads the pages whose file changed, and
+        # returns the published ones in reverse chronological order.
+        return self.get_catalog().published()
 
     def _create_default_config(self):
         '''Create and write to disk a default site config file.'''
@@ -554,7 +1502,20 @@ object.'''
                 'site_url': '',
                 'default_theme': 'blog1',
                 'default_template': 'main.html.tpl',
-                'fixed_frontpage': ''
+                'fixed_frontpage': '',
+                'default_md_profile': s2page.DEFAULT_MD_PROFILE,
+                'highlight_cache_mb': DEFAULT_CACHE_MB,
+                'html_cache_mb': DEFAULT_CACHE_MB,
+                'image_widths': [],
+                'image_webp': True,
+                'search_index': True,
+                'related_pages': 0,
+                'front_pagination': 'newest',
+                'images_cache_mb': 256,
+                'cache_dir': '',
+                'storage': s2storage.DEFAULT_STORAGE,
+                'io_threads': s2writer.DEFAULT_THREADS,
+                'io_queue_size': 0
               }
 
 
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+'''This module stores the page files of a site (config and content).
+
+The text of a page (its serialized config, and then its content) can
+be kept in two ways, chosen by the 'storage' item of the site config:
+
+    - 'files' (the default): in source/<slug>/<slug>.md, next to the
+      other files of the page (images, attachments...)
+    - 'sqlite': in a single SQLite database, s2/pages.sqlite. Sites
+      with many thousands of pages are listed, checked and imported
+      much faster this way. source/<slug> only exists for the pages
+      that have other files.
+
+Both storages have the same interface, used by Page and Site: the text
+of a page is unicode, and its sig (what tells whether it changed) is
+[mtime, size]. migrate moves the pages of a site from one to the other.
+
+Functions included:
+
+    - get_storage: Return the storage of a site.
+    - migrate: Move the pages of a site to another storage.
+
+Classes included:
+
+    - FileStorage: A page file in the directory of each page.
+    - SQLiteStorage: All the page texts in a SQLite database.
+
+'''
+
+import os
+import glob
+import time
+import codecs
+import sqlite3
+import threading
+
+STORAGE_NAMES = ('files', 'sqlite')
+DEFAULT_STORAGE = 'files'
+
+# database of SQLiteStorage, in s2
+DB_FILE = 'pages.sqlite'
+
+
+def get_storage(site, name=None):
+    '''Return the storage called name for site.
+
+    If name is not given, the one in the site config is used. Raise
+    ValueError if there's no storage with that name.
+
+    '''
+    if name is None:
+        name = site.site_config.get('storage') or DEFAULT_STORAGE
+    if name == 'files':
+        return FileStorage(site.dirs['source'])
+    if name == 'sqlite':
+        return SQLiteStorage(site.dirs['source'],
+                             os.path.join(site.dirs['s2'], DB_FILE))
+    raise ValueError("unknown page storage '%s' (use one of: %s)." %
+                     (name, ', '.join(STORAGE_NAMES)))
+
+
+def migrate(site, name):
+    '''Move the pages of site to the storage called name.
+
+    Every page is written to the new storage (keeping its modification
+    time, so the catalog stays valid), the site config is changed to
+    use it, and then the pages are removed from the old one. The other
+    files of the pages stay in source. Return the number of pages
+    moved. Raise ValueError if the site already uses that storage.
+
+    '''
+    old = site.storage
+    if old.name == name:
+        raise ValueError("the pages are already stored as '%s'." % name)
+    new = get_storage(site, name)
+    slugs = [s for s in old.names() if old.exists(s)]
+    new.write_many((s, old.read(s), old.sig(s)[0]) for s in slugs)
+    new.close()
+    site.set_config('storage', name)
+    for s in slugs:
+        old.remove(s)
+    old.close()
+    if isinstance(old, SQLiteStorage) and os.path.isfile(old.path):
+        os.remove(old.path)
+    return len(slugs)
+
+
+class FileStorage(object):
+    '''Keep the text of each page in source/<slug>/<slug>.md.'''
+
+    name = 'files'
+    # pages can be written from several threads (see Site.bulk_import)
+    threaded = True
+
+    def __init__(self, source_dir):
+        self.source_dir = source_dir
+
+    def page_dir(self, slug):
+        '''Return the directory of the other files of the page slug.'''
+        return os.path.join(self.source_dir, slug)
+
+    def text_path(self, slug):
+        '''Return the path of the page file of slug.'''
+        return os.path.join(self.source_dir, slug, slug + '.md')
+
+    def names(self):
+        '''Return the sorted list of page names (directories in source).'''
+        fis = [p for p in glob.glob(os.path.join(self.source_dir, "*"))
+               if os.path.isdir(p)]
+        return sorted([os.path.split(p)[1] for p in fis])
+
+    def exists(self, slug):
+        '''Return true if the page directory and page file both exist.'''
+        return os.path.isdir(self.page_dir(slug)) and \
+               os.path.isfile(self.text_path(slug))
+
+    def read(self, slug):
+        '''Return the text of the page slug.'''
+        pf = codecs.open(self.text_path(slug), mode="r", encoding="utf-8")
+        text = pf.read()
+        pf.close()
+        return text
+
+    def write(self, slug, text, mtime=None):
+        '''Write the text of the page slug, creating its directory.
+
+        If mtime is given, it's set as the modification time.
+
+        '''
+        if not os.path.isdir(self.page_dir(slug)):
+            os.mkdir(self.page_dir(slug))
+        fn = self.text_path(slug)
+        fout = codecs.open(fn, 'w', encoding="utf-8", errors="xmlcharrefreplace")
+        fout.write(text)
+        fout.close()
+        if mtime is not None:
+            os.utime(fn, (mtime, mtime))
+
+    def write_many(self, pages):
+        '''Write many (slug, text, mtime) pages.'''
+        for (slug, text, mtime) in pages:
+            self.write(slug, text, mtime)
+
+    def sig(self, slug):
+        '''Return [mtime, size] of the page slug (OSError if there's none).'''
+        st = os.stat(self.text_path(slug))
+        return [st.st_mtime, st.st_size]
+
+    def rename(self, old_slug, new_slug):
+        '''Move the page old_slug, and all its files, to new_slug.'''
+        new_dir = self.page_dir(new_slug)
+        os.rename(self.page_dir(old_slug), new_dir)
+        os.rename(os.path.join(new_dir, old_slug + '.md'),
+                  self.text_path(new_slug))
+
+    def remove(self, slug):
+        '''Remove the page file of slug (and its directory, if empty.)'''
+        os.remove(self.text_path(slug))
+        if not os.listdir(self.page_dir(slug)):
+            os.rmdir(self.page_dir(slug))
+
+    def close(self):
+        pass
+
+
+class SQLiteStorage(object):
+    '''Keep the text of every page in a table of a SQLite database.
+
+    The connection is opened when it's first needed, and shared by the
+    threads of the process (e.g. the live preview server), one query
+    at a time. Each write is committed right away, so other processes
+    (and git) see it.
+
+    '''
+
+    name = 'sqlite'
+    threaded = False
+
+    def __init__(self, source_dir, path):
+        self.source_dir = source_dir
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _query(self, sql, args=(), many=False):
+        '''Run sql, commit, and return the rows it selected.'''
+        with self._lock:
+            if self._conn is None:
+                self._conn = sqlite3.connect(self.path, check_same_thread=False)
+                self._conn.execute('CREATE TABLE IF NOT EXISTS pages ('
+                                   'slug TEXT PRIMARY KEY, text TEXT NOT NULL, '
+                                   'mtime REAL NOT NULL, size INTEGER NOT NULL)')
+            if many:
+                cur = self._conn.executemany(sql, args)
+            else:
+                cur = self._conn.execute(sql, args)
+            rows = cur.fetchall()
+            self._conn.commit()
+            return rows
+
+    def page_dir(self, slug):
+        '''Return the directory of the other files of the page slug.'''
+        return os.path.join(self.source_dir, slug)
+
+    def text_path(self, slug):
+        '''There are no page files: return None.'''
+        return None
+
+    def names(self):
+        '''Return the sorted list of page names.'''
+        return [str(r[0]) for r in
+                self._query('SELECT slug FROM pages ORDER BY slug')]
+
+    def exists(self, slug):
+        return bool(self._query('SELECT 1 FROM pages WHERE slug = ?', (slug,)))
+
+    def read(self, slug):
+        '''Return the text of the page slug (IOError if there's none).'''
+        rows = self._query('SELECT text FROM pages WHERE slug = ?', (slug,))
+        if not rows:
+            raise IOError("no page '%s' in %s" % (slug, self.path))
+        return rows[0][0]
+
+    @staticmethod
+    def _row(slug, text, mtime):
+        if mtime is None:
+            mtime = time.time()
+        return (slug, text, mtime, len(text.encode('utf-8')))
+
+    def write(self, slug, text, mtime=None):
+        '''Write the text of the page slug (mtime defaults to now.)'''
+        self._query('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?)',
+                    self._row(slug, text, mtime))
+
+    def write_many(self, pages):
+        '''Write many (slug, text, mtime) pages, in one transaction.'''
+        self._query('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?)',
+                    (self._row(*p) for p in pages), many=True)
+
+    def sig(self, slug):
+        '''Return [mtime, size] of the page slug (OSError if there's none).'''
+        rows = self._query('SELECT mtime, size FROM pages WHERE slug = ?',
+                           (slug,))
+        if not rows:
+            raise OSError("no page '%s' in %s" % (slug, self.path))
+        return [rows[0][0], rows[0][1]]
+
+    def rename(self, old_slug, new_slug):
+        '''Move the page old_slug, and its files if any, to new_slug.'''
+        if os.path.isdir(self.page_dir(old_slug)):
+            os.rename(self.page_dir(old_slug), self.page_dir(new_slug))
+        self._query('UPDATE pages SET slug = ? WHERE slug = ?',
+                    (new_slug, old_slug))
+
+    def remove(self, slug):
+        self._query('DELETE FROM pages WHERE slug = ?', (slug,))
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+'''This module runs the file writes of a generation in the background.
+
+Rendering a page is CPU work, but writing it and copying its files (and
+the common files, and the themes) is waiting for the disk, which on a
+network filesystem can take as long. A WriteBehind object takes those
+writes as tasks (a function and its arguments), and a pool of threads
+runs them while the generation goes on rendering.
+
+The queue of pending tasks is bounded: when it's full, submit blocks
+until a thread takes a task, so the pages waiting to be written don't
+pile up in memory. flush is a barrier: it waits until every task
+submitted has run (the front pages, feed and sitemap are written after
+one.)
+
+If a task fails, the tasks still pending are dropped, and the error is
+raised in the generation by the next submit, wait or flush (with its
+original traceback), so the build stops instead of going on with a
+broken www.
+
+Classes included:
+
+    - WriteBehind: A bounded queue of write tasks run by a thread pool.
+
+'''
+
+import sys
+import threading
+import Queue
+
+DEFAULT_THREADS = 4
+# tasks waiting to be run, per thread
+DEFAULT_QUEUE_SIZE = 16
+
+
+class _Task(object):
+    '''A function to run with args, and an event set once it has run.'''
+
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+        self.done = threading.Event()
+
+
+class WriteBehind(object):
+    '''Run write tasks in threads threads, with at most queue_size pending.
+
+    With threads == 0, tasks are run right away by submit (there's no
+    queue), so the same code can write synchronously.
+
+    '''
+
+    def __init__(self, threads=DEFAULT_THREADS, queue_size=None):
+        if queue_size is None:
+            queue_size = DEFAULT_QUEUE_SIZE * max(threads, 1)
+        self._queue = Queue.Queue(queue_size)
+        self._error = None  # exc_info of the first task that failed
+        self._lock = threading.Lock()
+        self.tasks_run = 0
+        self._threads = []
+        for i in range(threads):
+            t = threading.Thread(target=self._work)
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    @property
+    def threads(self):
+        '''The number of threads running the tasks.'''
+        return len(self._threads)
+
+    def _work(self):
+        while True:
+            task = self._queue.get()
+            try:
+                if task is None:
+                    return
+                if self._error is None:
+                    self._run(task)
+            finally:
+                if task is not None:
+                    task.done.set()
+                self._queue.task_done()
+
+    def _run(self, task):
+        try:
+            task.func(*task.args)
+        except Exception:
+            with self._lock:
+                if self._error is None:
+                    self._error = sys.exc_info()
+        else:
+            with self._lock:
+                self.tasks_run += 1
+
+    def _raise_error(self):
+        if self._error is not None:
+            (cls, value, tb) = self._error
+            raise cls, value, tb
+
+    def submit(self, func, *args):
+        '''Queue func(*args), and return its task (see wait).
+
+        Block while the queue is full. Raise the error of a task that
+        failed, if any.
+
+        '''
+        self._raise_error()
+        task = _Task(func, args)
+        if not self._threads:
+            self._run(task)
+            task.done.set()
+            self._raise_error()
+        else:
+            self._queue.put(task)
+        return task
+
+    def wait(self, tasks):
+        '''Wait until tasks (returned by submit) have run.'''
+        for t in tasks:
+            t.done.wait()
+        self._raise_error()
+
+    def flush(self):
+        '''Wait until every task submitted has run.'''
+        self._queue.join()
+        self._raise_error()
+
+    def close(self, abort=False):
+        '''Stop the threads, after running the pending tasks.
+
+        With abort, the pending tasks are dropped instead, and no
+        error is raised (it's for a generation that already failed.)
+
+        '''
+        if abort:
+            with self._lock:
+                if self._error is None:
+                    self._error = (RuntimeError, RuntimeError("aborted"), None)
+        for t in self._threads:
+            self._queue.put(None)
+        for t in self._threads:
+            t.join()
+        self._threads = []
+        if not abort:
+            self._raise_error()
@@ -140,5 +140,20 @@ class TestCLIcommands(unittest.TestCase):
         #Maybe it's a little unorthodox to do another assert in the same test... but it's for brevity
         self.assertFalse(site.page_exists_on_disk(p.slug),"old page still exists after rename.")
 
+    def test_do_import_should_add_pages_from_markdown_dir(self):
+        site = s2site.Site(self.temp_dir)
+        site.init_structure()
+        md_dir = tempfile.mkdtemp()
+        for i in range(0, 5):
+            fout = open(os.path.join(md_dir, 'post%d.md' % i), 'w')
+            fout.write("# Imported post %d\n\nSome text.\n" % i)
+            fout.close()
+        args = self.parser.parse_args(['import', md_dir, '-d', self.temp_dir])
+        s2.dispatch(vars(args))  #this triggers call to do_import
+        shutil.rmtree(md_dir)
+        for i in range(0, 5):
+            self.assertTrue(site.page_exists_on_disk(util.make_slug('Imported post %d' % i)),
+                            "imported page does not exist.")
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
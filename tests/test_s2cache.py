@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+import tempfile
+import shutil
+import time
+
+from simplystatic import s2cache
+
+
+class TestMakeKey(unittest.TestCase):
+
+    def test_make_key_same_parts_should_give_same_key(self):
+        self.assertEqual(s2cache.make_key('python', True, u'print 1'),
+                         s2cache.make_key('python', True, u'print 1'),
+                         "make_key gave different keys for the same parts.")
+
+    def test_make_key_should_not_be_ambiguous(self):
+        self.assertNotEqual(s2cache.make_key('ab', 'c'),
+                            s2cache.make_key('a', 'bc'),
+                            "make_key gave the same key for different parts.")
+
+
+class TestDiskCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache = s2cache.DiskCache(os.path.join(self.temp_dir, 'c'), 1000)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_get_missing_key_should_return_none_and_count_miss(self):
+        self.assertEqual(self.cache.get(s2cache.make_key('nope')), None,
+                         "get did not return None for a missing key.")
+        self.assertEqual(self.cache.misses, 1, "miss was not counted.")
+
+    def test_set_then_get_should_return_value_and_count_hit(self):
+        k = s2cache.make_key('k')
+        self.cache.set(k, u'<pre>café</pre>')
+        self.assertEqual(self.cache.get(k), u'<pre>café</pre>',
+                         "get did not return the value that was set.")
+        self.assertEqual(self.cache.hits, 1, "hit was not counted.")
+
+    def test_set_over_max_size_should_evict_least_recently_used(self):
+        keys = [s2cache.make_key(i) for i in range(0, 5)]
+        for k in keys:
+            self.cache.set(k, 'x' * 300)
+            # make sure every entry has a distinct modification time
+            past = time.time() - 100 + keys.index(k)
+            os.utime(self.cache._path(k), (past, past))
+        self.assertTrue(self.cache.size <= 1000,
+                        "cache size went over the maximum.")
+        self.assertEqual(self.cache.get(keys[0]), None,
+                         "the oldest entry was not evicted.")
+        self.assertEqual(self.cache.get(keys[-1]), 'x' * 300,
+                         "the newest entry was evicted.")
+
+
+class TestExportImport(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.temp_dir, 'c')
+        self.cache = s2cache.DiskCache(os.path.join(self.cache_dir, 'html'), 10000)
+        self.key = s2cache.make_key('k')
+        self.cache.set(self.key, u'<p>café</p>')
+        # a file being written by some other build
+        open(os.path.join(self.cache_dir, 'html', 'tmpab12cd'), 'w').write('half')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_export_then_import_should_restore_entries(self):
+        tar_path = os.path.join(self.temp_dir, 'cache.tar.gz')
+        self.assertEqual(s2cache.export_cache(self.cache_dir, tar_path), 1,
+                         "wrong number of files exported.")
+        other = os.path.join(self.temp_dir, 'other')
+        self.assertEqual(s2cache.import_cache(tar_path, other), 1,
+                         "wrong number of files imported.")
+        restored = s2cache.DiskCache(os.path.join(other, 'html'), 10000)
+        self.assertEqual(restored.get(self.key), u'<p>café</p>',
+                         "entry not restored.")
+        self.assertEqual(s2cache.import_cache(tar_path, other), 0,
+                         "existing entries were imported again.")
+
+
+if __name__ == "__main__":
+     unittest.main()
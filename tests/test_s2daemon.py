@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+import sys
+import tempfile
+import shutil
+import threading
+
+from simplystatic import s2site
+from simplystatic import s2daemon
+
+
+class TestDaemon(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.site = s2site.Site(self.temp_dir)
+        self.site.init_structure()
+        self.commands = []
+        self.server = s2daemon.DaemonServer(self.site, self.run_command)
+        self.thread = threading.Thread(target=self.server.serve_until_stopped)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        if self.thread.is_alive():
+            s2daemon.send_request(self.temp_dir, {'stop': True})
+        self.thread.join(5)
+        self.server.server_close()
+        shutil.rmtree(self.temp_dir)
+
+    def run_command(self, argdict):
+        self.commands.append(argdict)
+        if argdict['command'] == 'fail':
+            print "failing"
+            sys.exit(3)
+        print "pages: %d" % len(self.site.get_page_names())
+
+    def test_request_should_run_on_the_warm_site(self):
+        p = self.site.random_page(title="Café page")
+        answer = s2daemon.send_request(self.temp_dir, {'command': 'ls', 'title': u'Café'})
+        self.assertEqual(answer, {'status': 0, 'output': 'pages: 1\n'},
+                         "wrong answer: %r" % answer)
+        self.assertEqual(self.commands, [{'command': 'ls', 'title': 'Caf\xc3\xa9'}],
+                         "command not given byte strings, like the command line.")
+
+    def test_exit_status_and_stop_should_be_sent_back(self):
+        answer = s2daemon.send_request(self.temp_dir, {'command': 'fail'})
+        self.assertEqual(answer, {'status': 3, 'output': 'failing\n'},
+                         "wrong answer for a failing command: %r" % answer)
+        s2daemon.send_request(self.temp_dir, {'stop': True})
+        self.thread.join(5)
+        self.assertFalse(self.thread.is_alive(), "daemon did not stop.")
+        self.assertEqual(self.server.requests_run, 1, "wrong number of commands run.")
+
+    def test_no_daemon_should_return_none(self):
+        other = tempfile.mkdtemp()
+        try:
+            self.assertEqual(s2daemon.send_request(other, {'ping': True}), None,
+                             "answer from a daemon that doesn't exist.")
+        finally:
+            shutil.rmtree(other)
+
+
+if __name__ == "__main__":
+     unittest.main()
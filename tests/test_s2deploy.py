@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+import tempfile
+import shutil
+
+from mock import patch
+
+from simplystatic import s2deploy
+
+
+class TestDeploy(unittest.TestCase):
+    def setUp(self):
+        self.www = tempfile.mkdtemp()
+        self.target = os.path.join(tempfile.mkdtemp(), 'webroot')
+        self.write('index.html', 'front')
+        self.write('page/index.html', '<img src="pic.png">')
+        self.write('page/pic.png', 'png')
+        self.write('old/index.html', 'old page')
+
+    def tearDown(self):
+        shutil.rmtree(self.www)
+        shutil.rmtree(os.path.dirname(self.target))
+
+    def write(self, relpath, text):
+        fn = os.path.join(self.www, relpath)
+        if not os.path.isdir(os.path.dirname(fn)):
+            os.makedirs(os.path.dirname(fn))
+        fout = open(fn, 'w')
+        fout.write(text)
+        fout.close()
+
+    def test_first_deploy_should_copy_everything(self):
+        r = s2deploy.deploy(self.www, self.target)
+        self.assertEqual(r, (['index.html', 'old/index.html', 'page/index.html',
+                              'page/pic.png'], [], []), "wrong change set: %r" % (r,))
+        self.assertEqual(open(os.path.join(self.target, 'page', 'pic.png')).read(),
+                         'png', "file not copied.")
+
+    def test_second_deploy_should_only_copy_changes_and_delete_removed(self):
+        s2deploy.deploy(self.www, self.target)
+        # rewrite with the same content, change one file, remove a page
+        self.write('index.html', 'front')
+        self.write('page/pic.png', 'new png')
+        shutil.rmtree(os.path.join(self.www, 'old'))
+        self.write('new/index.html', 'new page')
+        copied = []
+        orig = s2deploy._copy
+        def counting_copy(src, dest, relpath):
+            copied.append(relpath)
+            orig(src, dest, relpath)
+        with patch.object(s2deploy, '_copy', counting_copy):
+            r = s2deploy.deploy(self.www, self.target, threads=1)
+        self.assertEqual(r, (['new/index.html'], ['page/pic.png'], ['old/index.html']),
+                         "wrong change set: %r" % (r,))
+        self.assertEqual(copied, ['page/pic.png', 'new/index.html'],
+                         "html was not copied last, or unchanged files were copied.")
+        self.assertFalse(os.path.exists(os.path.join(self.target, 'old')),
+                         "removed page (and its empty dir) still deployed.")
+
+    def test_dry_run_should_not_change_target(self):
+        r = s2deploy.deploy(self.www, self.target, dry_run=True)
+        self.assertEqual(len(r[0]), 4, "wrong change set in dry run.")
+        self.assertFalse(os.path.exists(self.target), "dry run created the target.")
+
+
+if __name__ == "__main__":
+     unittest.main()
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+import tempfile
+import shutil
+import subprocess
+import datetime
+
+from simplystatic import s2site
+from simplystatic import s2git
+
+
+def has_git():
+    try:
+        subprocess.call(['git', '--version'], stdout=open(os.devnull, 'w'))
+    except OSError:
+        return False
+    return True
+
+
+@unittest.skipIf(not has_git(), "git is not installed.")
+class TestGitChanges(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.site = s2site.Site(self.temp_dir)
+        self.site.init_structure()
+        self.pages = []
+        for i in range(3):
+            p = self.site.random_page(creation_date=datetime.date(2014, 3, i + 1))
+            p.set_published()
+            p.write()
+            self.pages.append(p)
+        self.git('init', '-q')
+        self.commit()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def git(self, *args):
+        subprocess.check_call(('git', '-c', 'user.name=s2', '-c', 'user.email=s2@example.com')
+                              + args, cwd=self.temp_dir,
+                              stdout=open(os.devnull, 'w'))
+
+    def commit(self):
+        self.git('add', '-A', 'source', 'themes', 'common', 's2/config.yml')
+        self.git('commit', '-q', '-m', 'edit')
+
+    def test_changed_paths_should_list_committed_and_new_files(self):
+        head = s2git.head_commit(self.temp_dir)
+        self.assertEqual(s2git.changed_paths(self.temp_dir, head, ['source']), [],
+                         "changes found right after a commit.")
+        self.pages[0].content = "Changed and committed."
+        self.pages[0].write()
+        self.commit()
+        new_file = os.path.join(self.pages[1].dirs['source_dir'], 'new.txt')
+        open(new_file, 'w').write('not committed')
+        changed = s2git.changed_paths(self.temp_dir, head, ['source'])
+        self.assertEqual(changed, sorted([
+            'source/%s/%s.md' % (self.pages[0].slug, self.pages[0].slug),
+            'source/%s/new.txt' % self.pages[1].slug]), "wrong changes: %r" % changed)
+        self.assertEqual(s2git.changed_paths(self.temp_dir, '0' * 40, ['source']), None,
+                         "changes given for a commit that doesn't exist.")
+
+    def test_generate_from_git_should_generate_only_changed_pages(self):
+        self.assertEqual(self.site.generate_from_git(), None,
+                         "first generation was not a whole one.")
+        self.pages[2].content = "A correction."
+        self.pages[2].write()
+        self.commit()
+        self.assertEqual(self.site.generate_from_git(), [self.pages[2].slug],
+                         "wrong pages generated.")
+        self.assertEqual(self.site.generate_from_git(), [],
+                         "pages generated with no changes.")
+        fout = open(os.path.join(self.site.dirs['common'], 'extra.css'), 'w')
+        fout.write('body {}')
+        fout.close()
+        self.assertEqual(self.site.generate_from_git(), None,
+                         "a common file changed, but not everything was generated.")
+
+    def test_generate_from_git_should_follow_redirects_and_config(self):
+        self.site.generate_from_git()
+        fout = open(os.path.join(self.site.dirs['s2'], s2site.REDIRECTS_FILE), 'w')
+        fout.write('gone: %s\n' % self.pages[0].slug)
+        fout.close()
+        self.git('add', 's2/' + s2site.REDIRECTS_FILE)
+        self.commit()
+        self.assertEqual(self.site.generate_from_git(), None,
+                         "the redirects changed, but not everything was generated.")
+        self.assertTrue(os.path.isfile(os.path.join(self.site.dirs['www'], 'gone',
+                                                    'index.html')),
+                        "redirect page not written.")
+        self.assertEqual(self.site.generate_from_git(), [],
+                         "pages generated with no changes.")
+        self.site.set_config('site_title', 'Another title')
+        self.commit()
+        self.assertEqual(self.site.generate_from_git(), None,
+                         "the config changed, but not everything was generated.")
+
+    def test_generate_from_git_should_follow_s2_templates_and_loose_files(self):
+        self.site.generate_from_git()
+        fout = open(os.path.join(self.site.dirs['s2'], 'piwik_code.html.tpl'), 'w')
+        fout.write('<script>var tracker = 1;</script>')
+        fout.close()
+        self.git('add', 's2/piwik_code.html.tpl')
+        self.commit()
+        self.assertEqual(self.site.generate_from_git(), None,
+                         "an s2 template changed, but not everything was generated.")
+        self.assertEqual(self.site.generate_from_git(), [],
+                         "the build state in s2 made the pages generate again.")
+        fout = open(os.path.join(self.site.dirs['source'], 'notes.txt'), 'w')
+        fout.write('not a page')
+        fout.close()
+        self.commit()
+        self.assertEqual(self.site.generate_from_git(), None,
+                         "a file directly in source changed, but not everything was generated.")
+
+
+if __name__ == "__main__":
+     unittest.main()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+import tempfile
+import shutil
+
+from simplystatic import s2site
+from simplystatic import s2page
+from simplystatic import s2images
+from simplystatic import util
+
+
+class TestNamesAndSrcset(unittest.TestCase):
+    def test_variant_name_should_include_width(self):
+        self.assertEqual(s2images.variant_name('img/photo.jpg', 480),
+                         'img/photo-480w.jpg', "wrong variant name.")
+
+    def test_variant_name_with_ext_should_replace_extension(self):
+        self.assertEqual(s2images.variant_name('photo.png', 480, '.webp'),
+                         'photo-480w.webp', "extension was not replaced.")
+
+    def test_srcset_without_variants_should_return_relpath(self):
+        self.assertEqual(s2images.srcset({}, 'photo.jpg'), 'photo.jpg',
+                         "srcset of an image without variants is not its path.")
+
+    def test_srcset_should_list_variants_of_the_format(self):
+        v = {'photo.jpg': [('photo.jpg', 1000, '.jpg'),
+                           ('photo-480w.jpg', 480, '.jpg'),
+                           ('photo-480w.webp', 480, '.webp')]}
+        self.assertEqual(s2images.srcset(v, 'photo.jpg'),
+                         'photo.jpg 1000w, photo-480w.jpg 480w',
+                         "wrong srcset for the original format.")
+        self.assertEqual(s2images.srcset(v, 'photo.jpg', '.webp'),
+                         'photo-480w.webp 480w', "wrong srcset for webp.")
+
+
+@unittest.skipUnless(s2images.available(), "Pillow is not installed")
+class TestImageStage(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.site = s2site.Site(self.temp_dir)
+        self.site.init_structure()
+        self.site.site_config['image_widths'] = [100, 2000]
+        self.site.site_config['image_webp'] = False
+        self.p1 = s2page.Page(self.site, "This is a new page")
+        self.p1.content = util.random_text()
+        self.p1.set_published()
+        self.p1.write()
+        im = s2images.Image.new('RGB', (400, 300), (200, 30, 30))
+        im.save(os.path.join(self.p1.dirs['source_dir'], 'photo.jpg'))
+
+    def tearDown(self):
+        self.site.get_image_stage().close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_generate_should_create_smaller_variants_only(self):
+        self.p1.generate()
+        wd = self.p1.dirs['www_dir']
+        self.assertTrue(os.path.isfile(os.path.join(wd, 'photo-100w.jpg')),
+                        "the 100w variant was not created.")
+        self.assertFalse(os.path.isfile(os.path.join(wd, 'photo-2000w.jpg')),
+                         "a variant larger than the original was created.")
+        im = s2images.Image.open(os.path.join(wd, 'photo-100w.jpg'))
+        self.assertEqual(im.size, (100, 75), "variant has the wrong size.")
+
+    def test_second_generate_should_use_cached_variants(self):
+        self.p1.generate()
+        cache = self.site.get_cache('images')
+        misses = cache.misses
+        p2 = s2page.Page(self.site, self.p1.slug, isslug=True)
+        p2.generate()
+        self.assertEqual(cache.misses, misses,
+                         "unchanged images were looked up again.")
+        self.assertTrue(os.path.isfile(os.path.join(p2.dirs['www_dir'],
+                                                    'photo-100w.jpg')),
+                        "cached variant was not copied.")
+        self.assertEqual(p2.srcset('photo.jpg'),
+                         'photo-100w.jpg 100w, photo.jpg 400w',
+                         "wrong srcset for the page image.")
+
+    def test_unreadable_images_should_just_be_copied(self):
+        sd = self.p1.dirs['source_dir']
+        open(os.path.join(sd, 'broken.png'), 'w').write('not an image')
+        data = open(os.path.join(sd, 'photo.jpg'), 'rb').read()
+        open(os.path.join(sd, 'cut.jpg'), 'wb').write(data[:len(data) // 2])
+        self.p1.generate()
+        wd = self.p1.dirs['www_dir']
+        self.assertTrue(os.path.isfile(os.path.join(wd, 'broken.png')),
+                        "unreadable image was not copied.")
+        self.assertTrue(os.path.isfile(os.path.join(wd, 'cut.jpg')),
+                        "truncated image was not copied.")
+        self.assertFalse(os.path.isfile(os.path.join(wd, 'cut-100w.jpg')),
+                         "variant of a truncated image was written.")
+        self.assertEqual(self.p1.srcset('cut.jpg'), 'cut.jpg',
+                         "srcset lists variants of a truncated image.")
+        self.assertTrue(os.path.isfile(os.path.join(wd, 'photo-100w.jpg')),
+                        "variant of the good image was not created.")
+
+
+if __name__ == "__main__":
+     unittest.main()
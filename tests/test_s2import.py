@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+import tempfile
+import shutil
+import json
+from StringIO import StringIO
+
+from simplystatic import s2site
+from simplystatic import s2page
+from simplystatic import s2import
+from simplystatic import util
+
+
+class TestReaders(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write(self, name, text):
+        fout = open(os.path.join(self.temp_dir, name), 'w')
+        fout.write(text)
+        fout.close()
+
+    def test_front_matter_should_give_fields(self):
+        self.write('a.md', "---\ntitle: My post\ndate: 2013-05-02\n"
+                           "tags: [one, two]\nstatus: published\n---\nHello\n")
+        r = s2import.normalize_record(
+                s2import.parse_markdown_file(os.path.join(self.temp_dir, 'a.md')))
+        self.assertEqual(r['title'], u'My post', "wrong title from front matter.")
+        self.assertEqual(r['date'], u'2013-05-02', "wrong date from front matter.")
+        self.assertEqual(r['tags'], [u'one', u'two'], "wrong tags from front matter.")
+        self.assertEqual(r['status'], u'published', "wrong status from front matter.")
+        self.assertEqual(r['body'], u'Hello', "wrong body.")
+
+    def test_no_front_matter_should_use_heading_and_file_name(self):
+        self.write('2012-01-31-some-post.md', "# The heading\n\nText\n")
+        self.write('other_post.md', "Just text\n")
+        recs = list(s2import.read_markdown_dir(self.temp_dir))
+        self.assertEqual(recs[0]['title'], u'The heading', "title not taken from heading.")
+        self.assertEqual(recs[0]['date'], '2012-01-31', "date not taken from file name.")
+        self.assertEqual(recs[0]['body'], u'Text', "heading was not removed from body.")
+        self.assertEqual(recs[1]['title'], 'other post', "title not taken from file name.")
+
+    def test_read_jsonl_should_skip_blank_lines(self):
+        recs = list(s2import.read_jsonl(StringIO('{"title": "a"}\n\n{"title": "b"}\n')))
+        self.assertEqual([r['title'] for r in recs], ['a', 'b'], "wrong records from JSON lines.")
+
+    def test_read_jsonl_should_give_error_records_for_bad_lines(self):
+        recs = list(s2import.read_jsonl(StringIO('{"title": "a"}\n{"title": \n[1, 2]\n')))
+        self.assertEqual(len(recs), 3, "bad lines were dropped.")
+        for (n, rec) in [(2, recs[1]), (3, recs[2])]:
+            try:
+                s2import.normalize_record(rec)
+            except ValueError as e:
+                self.assertTrue(('line %d ' % n) in str(e),
+                                "no line number in the error: %s" % e)
+            else:
+                self.fail("bad line %d was not rejected." % n)
+
+    def test_record_without_title_should_raise_ValueError(self):
+        self.assertRaises(ValueError, s2import.normalize_record, {'body': 'x'})
+
+    def test_record_with_bad_date_should_raise_ValueError(self):
+        self.assertRaises(ValueError, s2import.normalize_record,
+                          {'title': 'x', 'date': '3/3/70'})
+
+
+class TestBulkImport(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.site = s2site.Site(self.temp_dir)
+        self.site.init_structure()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_bulk_import_should_write_loadable_pages(self):
+        recs = [{'title': 'Post number %d' % i, 'date': '2014-02-%02d' % (i + 1),
+                 'tags': 'a, b', 'status': 'published', 'body': 'Body %d' % i}
+                for i in range(0, 25)]
+        (imported, skipped) = self.site.bulk_import(recs, threads=3, batch_size=4)
+        self.assertEqual(len(imported), 25, "not all the pages were imported.")
+        self.assertEqual(skipped, [], "valid records were skipped.")
+        p = s2page.Page(self.site, util.make_slug('Post number 7'), isslug=True)
+        self.assertEqual(p.title, u'Post number 7', "imported page has the wrong title.")
+        self.assertEqual(p.creation_date, u'2014-02-08', "imported page has the wrong date.")
+        self.assertEqual(p.tags, [u'a', u'b'], "imported page has the wrong tags.")
+        self.assertTrue(p.published, "imported page is not published.")
+        self.assertEqual(p.content.strip(), u'Body 7', "imported page has the wrong content.")
+
+    def test_bulk_import_should_skip_collisions(self):
+        self.site.random_page(title="Already here")
+        recs = [{'title': 'Already here!'}, {'title': 'New one'}, {'title': 'New  one'}]
+        (imported, skipped) = self.site.bulk_import(recs)
+        self.assertEqual(imported, [u'new_one'], "wrong pages imported.")
+        self.assertEqual(len(skipped), 2, "collisions were not skipped.")
+
+    def test_bulk_import_should_skip_bad_json_lines(self):
+        fin = StringIO('{"title": "Good one"}\nnot json\n[1, 2]\n{"title": "Another"}\n')
+        (imported, skipped) = self.site.bulk_import(s2import.read_jsonl(fin))
+        self.assertEqual(sorted(imported), [u'another', u'good_one'],
+                         "good records after bad lines were not imported.")
+        self.assertEqual([title for (title, reason) in skipped], [None, None],
+                         "bad lines were not skipped.")
+        self.assertTrue('line 2 ' in skipped[0][1] and 'line 3 ' in skipped[1][1],
+                        "wrong reasons: %r" % skipped)
+
+    def test_bulk_import_should_update_catalog(self):
+        self.site.bulk_import([{'title': 'A page', 'status': 'published'}])
+        data = json.load(open(os.path.join(self.site.dirs['s2'], 'catalog.json')))
+        self.assertTrue(data['pages']['a_page']['published'], "catalog was not updated.")
+
+    def test_catalog_should_pick_up_pages_written_later(self):
+        self.site.bulk_import([{'title': 'A page', 'status': 'published'}])
+        p = self.site.random_page(title="Written by hand")
+        p.set_published()
+        p.write()
+        self.assertTrue(p.slug in self.site.get_catalog().published(),
+                        "catalog does not include a page written after the import.")
+
+
+if __name__ == "__main__":
+     unittest.main()
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+import tempfile
+import shutil
+
+from simplystatic import s2links
+
+
+class TestCheckLinks(unittest.TestCase):
+    def setUp(self):
+        self.www = tempfile.mkdtemp()
+        self.write('index.html', '<a href="page/">ok</a>\n'
+                                 '<a href="../page/#intro">ok, clamped at root</a>\n'
+                                 '<a href="http://example.com/nothere">external</a>\n'
+                                 '<a href="mailto:me@example.com">mail</a>\n'
+                                 '<a href="gone/">broken</a>\n')
+        self.write('page/index.html', '<h1 id="intro">Intro</h1>\n'
+                                      '<img src="pic.png" srcset="pic.png 1x, pic-2x.png 2x"/>\n'
+                                      '<a href="/index.html#nowhere">bad anchor</a>\n'
+                                      '<a href="#intro">same page</a>\n')
+        self.write('page/pic.png', 'png')
+
+    def tearDown(self):
+        shutil.rmtree(self.www)
+
+    def write(self, relpath, text):
+        fn = os.path.join(self.www, relpath)
+        if not os.path.isdir(os.path.dirname(fn)):
+            os.makedirs(os.path.dirname(fn))
+        fout = open(fn, 'w')
+        fout.write(text)
+        fout.close()
+
+    def test_resolve_should_handle_relative_root_and_dirs(self):
+        files = set(['index.html', 'page/index.html', 'page/pic.png'])
+        self.assertEqual(s2links.resolve('page/index.html', 'pic.png', files),
+                         ('page/pic.png', ''), "relative url resolved wrongly.")
+        self.assertEqual(s2links.resolve('page/index.html', '/page#x', files),
+                         ('page/index.html', 'x'), "directory url resolved wrongly.")
+        self.assertEqual(s2links.resolve('index.html', '../../', files),
+                         ('index.html', ''), "'..' went above the root.")
+        self.assertEqual(s2links.resolve('index.html', '//cdn.example.com/x.js', files),
+                         None, "url of another site was resolved.")
+
+    def test_check_links_should_report_broken_links_by_page(self):
+        report = s2links.check_links(self.www, processes=1)
+        self.assertEqual(report, {'index.html': [(5, 'gone/', 'missing file')],
+                                  'page/index.html': [(2, 'pic-2x.png', 'missing file'),
+                                                      (3, '/index.html#nowhere', 'missing anchor')]},
+                         "wrong link report: %r" % report)
+
+    def test_check_links_with_pool_should_give_same_report(self):
+        self.assertEqual(s2links.check_links(self.www, processes=2),
+                         s2links.check_links(self.www, processes=1),
+                         "the process pool changed the report.")
+
+    def test_check_links_on_some_pages_should_only_report_those(self):
+        report = s2links.check_links(self.www, pages=['index.html'], processes=1)
+        self.assertEqual(report.keys(), ['index.html'], "other pages were checked.")
+
+
+if __name__ == "__main__":
+     unittest.main()
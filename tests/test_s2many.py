@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+import tempfile
+import shutil
+import glob
+
+from simplystatic import s2site
+from simplystatic import s2many
+
+
+class TestGenerateMany(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.sites = []
+        for name in ('one', 'two'):
+            d = os.path.join(self.temp_dir, name)
+            os.mkdir(d)
+            site = s2site.Site(d)
+            site.init_structure()
+            p = site.random_page(content="Same content in both sites.")
+            p.set_published()
+            p.write()
+            self.sites.append(d)
+        os.mkdir(os.path.join(self.temp_dir, 'not_a_site'))
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_find_sites_should_find_sites_in_dir_or_list(self):
+        self.assertEqual(s2many.find_sites(self.temp_dir), self.sites,
+                         "wrong sites found in directory.")
+        self.assertEqual(s2many.find_sites(os.path.join(self.sites[1], 'source')),
+                         [self.sites[1]], "site not found from a directory inside it.")
+        listfile = os.path.join(self.temp_dir, 'sites.txt')
+        fout = open(listfile, 'w')
+        fout.write('# my sites\n%s\n\n%s\n' % (self.sites[1], self.sites[0]))
+        fout.close()
+        self.assertEqual(s2many.find_sites(listfile), [self.sites[1], self.sites[0]],
+                         "wrong sites found in list file.")
+
+    def test_generate_many_should_generate_all_and_share_caches(self):
+        cache_dir = os.path.join(self.temp_dir, 'shared')
+        results = list(s2many.generate_many(self.sites, processes=1,
+                                            cache_dir=cache_dir))
+        self.assertEqual([r['ok'] for r in results], [True, True],
+                         "sites not generated: %r" % results)
+        for d in self.sites:
+            self.assertTrue(os.path.isfile(os.path.join(d, 'www', 'index.html')),
+                            "site %s not generated." % d)
+        self.assertEqual(results[1]['caches']['html'][1], 0,
+                         "second site did not reuse the html of the first one.")
+        # the same theme files were compiled once, in the shared dir
+        mains = glob.glob(os.path.join(cache_dir, 'mako', '*', 'main.html.tpl.py'))
+        self.assertEqual(len(mains), 1, "theme compiled %d times." % len(mains))
+
+    def test_generate_many_with_pool_should_report_failures(self):
+        bad = os.path.join(self.temp_dir, 'two', 's2', 'config.yml')
+        fout = open(bad, 'w')
+        fout.write('{ this is not : yaml')
+        fout.close()
+        results = list(s2many.generate_many(self.sites, processes=2))
+        ok = dict([(r['dir'], r['ok']) for r in results])
+        self.assertEqual(ok, {self.sites[0]: True, self.sites[1]: False},
+                         "wrong results: %r" % results)
+
+
+if __name__ == "__main__":
+     unittest.main()
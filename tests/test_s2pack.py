@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+import tempfile
+import shutil
+import threading
+import urllib2
+import BaseHTTPServer
+
+from simplystatic import s2site
+from simplystatic import s2pack
+from simplystatic import s2server
+from simplystatic import s2deploy
+
+
+class TestPack(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.www = os.path.join(self.temp_dir, 'www')
+        self.write('index.html', '<p>front</p>' * 100)
+        self.write('page/index.html', '<p>page</p>')
+        self.write('page/pic.png', '\x89PNG' + 'x' * 50)
+        self.pack_path = os.path.join(self.temp_dir, 'site.pack')
+        self.assertEqual(s2pack.write_pack(self.www, self.pack_path), 3,
+                         "wrong number of files packed.")
+        self.pack = s2pack.PackReader(self.pack_path)
+
+    def tearDown(self):
+        self.pack.close()
+        shutil.rmtree(self.temp_dir)
+
+    def write(self, relpath, text):
+        fn = os.path.join(self.www, relpath)
+        if not os.path.isdir(os.path.dirname(fn)):
+            os.makedirs(os.path.dirname(fn))
+        fout = open(fn, 'wb')
+        fout.write(text)
+        fout.close()
+
+    def test_read_should_return_original_contents(self):
+        self.assertEqual(self.pack.paths(), ['index.html', 'page/index.html', 'page/pic.png'],
+                         "wrong paths in pack.")
+        self.assertEqual(self.pack.lookup('index.html')[2], 'gzip',
+                         "compressible file not gzipped.")
+        self.assertEqual(self.pack.lookup('page/pic.png')[2], '', "image was gzipped.")
+        self.assertEqual(self.pack.read('index.html'), '<p>front</p>' * 100,
+                         "wrong contents for a gzipped file.")
+        self.assertEqual(self.pack.read('nothere.html'), None, "missing file found.")
+
+    def test_extract_should_restore_the_tree(self):
+        dest = os.path.join(self.temp_dir, 'out')
+        self.pack.extract(dest)
+        self.assertEqual(s2deploy.build_manifest(dest), s2deploy.build_manifest(self.www),
+                         "extracted tree differs from the original.")
+
+    def test_not_a_pack_should_raise_valueerror(self):
+        self.assertRaises(ValueError, s2pack.PackReader,
+                          os.path.join(self.www, 'page', 'pic.png'))
+
+    def test_server_should_serve_from_pack(self):
+        handler = s2server.make_pack_handler_class(None, self.pack_path)
+        httpd = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), handler)
+        t = threading.Thread(target=httpd.serve_forever)
+        t.daemon = True
+        t.start()
+        try:
+            base = 'http://127.0.0.1:%d/' % httpd.server_address[1]
+            self.assertEqual(urllib2.urlopen(base + 'page/').read(), '<p>page</p>',
+                             "page not served from the pack.")
+            req = urllib2.Request(base, headers={'Accept-Encoding': 'gzip'})
+            r = urllib2.urlopen(req)
+            self.assertEqual(r.info().get('Content-Encoding'), 'gzip',
+                             "stored gzip not sent to a client that accepts it.")
+            self.assertEqual(r.read(), self.pack.raw(self.pack.lookup('index.html'))[:],
+                             "wrong gzipped body.")
+            self.assertRaises(urllib2.HTTPError, urllib2.urlopen, base + 'nothere.html')
+        finally:
+            handler.pack.close()
+            httpd.shutdown()
+            httpd.server_close()
+
+
+class TestSitePack(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.site = s2site.Site(self.temp_dir)
+        self.site.init_structure()
+        p = self.site.random_page()
+        p.set_published()
+        p.write()
+        self.slug = p.slug
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_pack_www_should_move_the_site_into_the_pack(self):
+        self.site.generate()
+        pack_path = os.path.join(self.temp_dir, 'site.pack')
+        self.site.pack_www(pack_path)
+        self.assertEqual(os.listdir(self.site.dirs['www']), [], "www was not emptied.")
+        pack = s2pack.PackReader(pack_path)
+        self.assertTrue(pack.lookup(self.slug + '/index.html') is not None,
+                        "page not in the pack.")
+        pack.close()
+
+    def test_generate_pages_after_pack_should_generate_everything(self):
+        self.site.generate()
+        self.site.pack_www(os.path.join(self.temp_dir, 'site.pack'))
+        self.assertEqual(self.site.generate_pages([self.slug]), [self.slug],
+                         "wrong pages generated.")
+        for f in os.listdir(self.site.dirs['common']):
+            self.assertTrue(os.path.exists(os.path.join(self.site.dirs['www'], f)),
+                            "common file %s missing: only the page was generated "
+                            "into the empty www." % f)
+
+
+if __name__ == "__main__":
+     unittest.main()
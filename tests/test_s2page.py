@@ -11,6 +11,12 @@ import string
 import yaml
 import datetime
 import uuid
+import json
+import base64
+import hashlib
+import codecs
+
+import pygments
 
 from simplystatic import s2site
 from simplystatic import s2page
@@ -80,6 +86,64 @@ class TestInstRenderAndGenerate(unittest.TestCase):
         r2 = p2.render()
         self.assertEqual(r1,r2,"render gave different rendition after reading from file.")
 
+    def test_render_to_file_should_write_same_rendition(self):
+        self.p1.content = u"Ñandú y pingüino."
+        fn = os.path.join(self.temp_dir, 'out.html')
+        self.assertEqual(self.p1.render(fn), None, "render to a file returned the rendition.")
+        written = codecs.open(fn, 'r', 'utf-8').read()
+        self.assertEqual(written, self.p1.render(),
+                         "the file has a different rendition.")
+
+    def test_render_same_code_should_hit_highlight_cache(self):
+        code = "```python\nprint 'hello'\n```\n"
+        self.p1.content = "Some code:\n\n" + code
+        self.p1.render()
+        cache = self.site.get_cache('highlight')
+        self.assertEqual(cache.hits, 0, "highlight cache hit on first render.")
+        # different text, same code block
+        self.p1.content = "The same code:\n\n" + code
+        self.p1.render()
+        self.assertEqual(cache.hits, 1, "highlight cache not hit for the same code.")
+
+    def test_render_twice_should_hit_html_cache(self):
+        r1 = self.p1.render()
+        cache = self.site.get_cache('html')
+        self.assertEqual(cache.hits, 0, "html cache hit on first render.")
+        r2 = self.p1.render()
+        self.assertEqual(cache.hits, 1, "html cache not hit on second render.")
+        self.assertEqual(r1, r2, "cached html gave a different rendition.")
+
+    def test_pygments_upgrade_should_miss_html_cache(self):
+        self.p1.body_html()
+        cache = self.site.get_cache('html')
+        old = pygments.__version__
+        pygments.__version__ = old + '.upgraded'
+        try:
+            self.p1.body_html()
+        finally:
+            pygments.__version__ = old
+        self.assertEqual(cache.hits, 0, "html highlighted by another Pygments reused.")
+        self.p1.body_html()
+        self.assertEqual(cache.hits, 1, "html cache not hit with the same Pygments.")
+
+    def test_plain_profile_should_not_highlight_code(self):
+        self.p1.content = "```python\nprint 'hello'\n```\n"
+        self.p1._config['md_profile'] = [u'plain']
+        html = self.p1.body_html()
+        self.assertFalse('codehilite' in html, "plain profile highlighted code.")
+
+    def test_math_profile_should_keep_math_for_mathjax(self):
+        self.p1.content = "Euler: $e^{i\\pi} + 1 = 0$\n"
+        self.p1._config['md_profile'] = [u'math']
+        html = self.p1.body_html()
+        self.assertTrue('<mathjax>$e^{i\\pi} + 1 = 0$</mathjax>' in html,
+                        "math profile did not protect the formula.")
+
+    def test_same_profile_should_reuse_converter(self):
+        md1 = self.site.get_md_converter(s2page.MD_PROFILES['code'])
+        md2 = self.site.get_md_converter(s2page.MD_PROFILES['code'])
+        self.assertTrue(md1 is md2, "converter was not reused for the same profile.")
+
     def test_generate_should_create_directory_in_www(self):
         self.p1.set_published()
         #self.p1.write()  #not necessary here to write the source...
@@ -139,6 +203,70 @@ class TestInstRenderAndGenerate(unittest.TestCase):
         self.assertEqual(cwwwset.difference(csourceset),set([]),"after generate, not all the files are in the page www directory.")
 
 
+    def test_generate_notebook_page_should_extract_images(self):
+        self.p1.set_published()
+        self.p1.write()
+        img = 'fake png data ' * 100
+        nb = {'nbformat': 4, 'metadata': {}, 'cells': [
+                {'cell_type': 'markdown', 'metadata': {}, 'source': ['# A notebook']},
+                {'cell_type': 'code', 'metadata': {}, 'execution_count': 1,
+                 'source': ['plot()'],
+                 'outputs': [{'output_type': 'display_data', 'metadata': {},
+                              'data': {'image/png': base64.b64encode(img),
+                                       'text/plain': ['<Figure>']}}]}]}
+        fout = open(os.path.join(self.p1.dirs['source_dir'], 'nb.ipynb'), 'w')
+        fout.write(json.dumps(nb))
+        fout.close()
+        self.p1._config['notebook'] = [u'nb.ipynb']
+        self.p1.generate()
+        imgname = hashlib.sha1(img).hexdigest() + '.png'
+        self.assertTrue(os.path.isfile(os.path.join(self.p1.dirs['www_dir'], imgname)),
+                        "notebook image was not extracted to the page www dir.")
+        html = open(self.p1.dirs['www_filename']).read()
+        self.assertTrue('src="%s"' % imgname in html, "html does not link to the notebook image.")
+        self.assertFalse(base64.b64encode(img) in html, "notebook image was inlined in the html.")
+        self.assertFalse(os.path.isfile(os.path.join(self.p1.dirs['www_dir'], 'nb.ipynb')),
+                         "notebook source was copied to www.")
+
+    def write_notebook(self, cells):
+        fout = open(os.path.join(self.p1.dirs['source_dir'], 'nb.ipynb'), 'w')
+        fout.write(json.dumps({'nbformat': 4, 'metadata': {}, 'cells': cells}))
+        fout.close()
+        self.p1._config['notebook'] = [u'nb.ipynb']
+
+    def test_pygments_upgrade_should_miss_notebook_cache(self):
+        self.p1.write()
+        self.write_notebook([{'cell_type': 'code', 'metadata': {}, 'execution_count': 1,
+                              'source': ['print 1'], 'outputs': []}])
+        self.p1.body_html()
+        cache = self.site.get_cache('notebook')
+        old = pygments.__version__
+        pygments.__version__ = old + '.upgraded'
+        try:
+            self.p1.body_html()
+        finally:
+            pygments.__version__ = old
+        self.assertEqual(cache.hits, 0, "notebook highlighted by another Pygments reused.")
+        self.p1.body_html()
+        self.assertEqual(cache.hits, 1, "notebook cache not hit with the same Pygments.")
+
+    def test_notebook_images_should_be_written_even_if_evicted(self):
+        self.p1.set_published()
+        self.p1.write()
+        imgs = ['fake png data %d ' % i * 100 for i in range(3)]
+        self.write_notebook([{'cell_type': 'code', 'metadata': {}, 'execution_count': i,
+                              'source': ['plot()'],
+                              'outputs': [{'output_type': 'display_data', 'metadata': {},
+                                           'data': {'image/png': base64.b64encode(img)}}]}
+                             for (i, img) in enumerate(imgs)])
+        # room for less than one image
+        self.site.site_config['nbimages_cache_mb'] = 1000.0 / (1024 * 1024)
+        self.p1.generate()
+        for img in imgs:
+            imgname = hashlib.sha1(img).hexdigest() + '.png'
+            self.assertTrue(os.path.isfile(os.path.join(self.p1.dirs['www_dir'], imgname)),
+                            "notebook image evicted from the cache was not written.")
+
     def test_rename_with_existing_title_should_raise_ValueError(self):
         self.p1.write()
         newpagetitle = "Some new page here"
@@ -182,6 +310,31 @@ class TestInstRenderAndGenerate(unittest.TestCase):
         newcontent = self.p1.content
         self.assertEqual(newcontent,oldcontent,"The content of the page has changed after rename.")
 
+    def test_rename_should_keep_other_files(self):
+        self.p1.write()
+        fout = open(os.path.join(self.p1.dirs['source_dir'], 'photo.png'), 'w')
+        fout.write('not really a png')
+        fout.close()
+        self.p1.rename("Some new page here")
+        self.assertTrue(os.path.isfile(os.path.join(self.p1.dirs['source_dir'], 'photo.png')),
+                        "a file of the page directory was lost in the rename.")
+
+    def test_rename_should_record_redirect(self):
+        self.p1.write()
+        self.p1.rename("Some new page here")
+        self.assertEqual(self.site.get_redirects(), {self.p1slug: self.p1.slug},
+                         "the rename was not recorded as a redirect.")
+
+    def test_rename_generated_page_should_leave_redirect_page(self):
+        self.p1.set_published()
+        self.p1.write()
+        self.p1.generate()
+        self.p1.rename("Some new page here")
+        self.assertTrue(os.path.isfile(self.p1.dirs['www_filename']),
+                        "the renamed page was not generated again.")
+        old = open(os.path.join(self.site.dirs['www'], self.p1slug, 'index.html')).read()
+        self.assertTrue('url=../%s/' % self.p1.slug in old, "no redirect page at the old slug.")
+
 
 class TestVariousGetAndSet(unittest.TestCase):
     def setUp(self):
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+import tempfile
+import shutil
+import codecs
+
+from simplystatic import s2site
+from simplystatic import s2related
+
+
+def vec(tags, title=u''):
+    return s2related.page_vector({'title': title, 'tags': tags})
+
+
+class TestRelatedPages(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.site = s2site.Site(self.temp_dir)
+        self.site.init_structure()
+        self.vectors = {u'a': vec([u'python', u'web']),
+                        u'b': vec([u'python', u'web', u'css']),
+                        u'c': vec([u'python']),
+                        u'd': vec([u'cooking'], u'Baking bread'),
+                        u'e': vec([u'cooking', u'web'], u'Bread online')}
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_page_vector_should_weight_tags_over_title_terms(self):
+        self.assertEqual(vec([u' Python'], u'The Python way'),
+                         {u'tag:python': 2.0, u'python': 1.0, u'way': 1.0},
+                         "wrong page vector.")
+
+    def test_compute_should_rank_by_similarity(self):
+        r = s2related.RelatedPages(self.site, 2, use_numpy=False).compute(self.vectors)
+        self.assertEqual(r[u'a'], [u'b', u'c'], "wrong related pages for a.")
+        self.assertEqual(r[u'd'], [u'e'], "pages with nothing in common were related.")
+
+    def test_numpy_and_python_should_give_same_result(self):
+        if s2related.numpy is None:
+            raise unittest.SkipTest("numpy/scipy not installed")
+        py = s2related.RelatedPages(self.site, 3, use_numpy=False).compute(self.vectors)
+        os.remove(os.path.join(self.site.dirs['s2'], s2related.STATE_FILE))
+        np = s2related.RelatedPages(self.site, 3, use_numpy=True).compute(self.vectors)
+        self.assertEqual(py, np, "the numpy result differs from the pure python one.")
+
+    def test_second_compute_should_only_redo_affected_pages(self):
+        s2related.RelatedPages(self.site, 2).compute(self.vectors)
+        self.vectors[u'd'] = vec([u'cooking', u'css'], u'Baking bread')
+        rp = s2related.RelatedPages(self.site, 2)
+        r = rp.compute(self.vectors)
+        self.assertTrue(rp.computed < len(self.vectors),
+                        "all pages were compared again (%d)." % rp.computed)
+        os.remove(os.path.join(self.site.dirs['s2'], s2related.STATE_FILE))
+        self.assertEqual(r, s2related.RelatedPages(self.site, 2).compute(self.vectors),
+                         "incremental result differs from a full computation.")
+
+    def test_generate_should_link_related_pages(self):
+        self.site.site_config['related_pages'] = 3
+        p1 = self.site.random_page(title="Arduino leds", tags=[u'electronics'])
+        p1.set_published()
+        p1.write()
+        p2 = self.site.random_page(title="Arduino motors", tags=[u'electronics'])
+        p2.set_published()
+        p2.write()
+        self.site.generate()
+        html = codecs.open(os.path.join(self.site.dirs['www'], p1.slug,
+                                        'index.html'), 'r', 'utf-8').read()
+        self.assertTrue(u'href="../%s/"' % p2.slug in html,
+                        "related page not linked.")
+
+    def test_page_vector_should_include_content_terms(self):
+        v = s2related.page_vector({'title': u'Bread', 'tags': []},
+                                  u'Sourdough bread needs sourdough starter.')
+        self.assertEqual(v[u'bread'], s2related.TITLE_WEIGHT + s2related.BODY_WEIGHT,
+                         "content term not added to the title term.")
+        self.assertTrue(v[u'sourdough'] > v[u'starter'] > 0,
+                        "content terms not weighted by their count.")
+
+    def test_page_vectors_should_only_read_changed_pages(self):
+        p1 = self.site.random_page(title="First page", content="Tomatoes and basil.")
+        p2 = self.site.random_page(title="Second page", content="Basil pesto.")
+        entries = self.site.get_catalog().entries
+        slugs = [p1.slug, p2.slug]
+        rp = s2related.RelatedPages(self.site, 1)
+        vectors = rp.page_vectors(entries, slugs)
+        self.assertTrue(u'basil' in vectors[p1.slug], "content terms missing.")
+        rp.compute(vectors)
+        p2.content = u"Garlic pesto."
+        p2.write()
+        entries = self.site.get_catalog().entries
+        rp = s2related.RelatedPages(self.site, 1)
+        vectors = rp.page_vectors(entries, slugs)
+        self.assertEqual(rp.read, 1, "unchanged pages were read again.")
+        self.assertTrue(u'garlic' in vectors[p2.slug], "changed page not read again.")
+
+
+if __name__ == "__main__":
+     unittest.main()
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+import tempfile
+import shutil
+import json
+
+from mock import patch
+
+from simplystatic import s2site
+from simplystatic import s2search
+
+
+class TestTokenize(unittest.TestCase):
+    def test_tokenize_should_drop_stopwords_short_words_and_numbers(self):
+        self.assertEqual(s2search.tokenize(u'The Quick fox, a 2014 x-ray!'),
+                         [u'quick', u'fox', u'ray'], "wrong terms.")
+
+    def test_shard_name_should_be_hex_of_utf8(self):
+        self.assertEqual(s2search.shard_name(u'ñu'), 'c3b175', "wrong shard name.")
+
+
+class TestSearchIndex(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.site = s2site.Site(self.temp_dir)
+        self.site.init_structure()
+        self.p1 = self.site.random_page(title="Arduino projects",
+                                        content="Blinking leds with an arduino board.",
+                                        tags=[u'electronics'])
+        self.p1.set_published()
+        self.p1.write()
+        self.p2 = self.site.random_page(title="Baking bread",
+                                        content="Flour, water and salt.")
+        self.p2.set_published()
+        self.p2.write()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def lookup(self, term):
+        sdir = os.path.join(self.site.dirs['www'], 'search')
+        docs = json.load(open(os.path.join(sdir, 'docs.json')))
+        name = s2search.shard_name(term[:docs['prefixLength']])
+        if not name in docs['shards']:
+            return []
+        shard = json.load(open(os.path.join(sdir, name + '.json')))
+        return [docs['docs'][d]['url'] for (d, score) in shard.get(term, [])]
+
+    def test_generate_should_write_sharded_index(self):
+        self.site.generate()
+        self.assertEqual(self.lookup(u'arduino'), [self.p1.slug + '/'],
+                         "page not found by a term of its title and body.")
+        self.assertEqual(self.lookup(u'electronics'), [self.p1.slug + '/'],
+                         "page not found by its tag.")
+        self.assertEqual(self.lookup(u'flour'), [self.p2.slug + '/'],
+                         "page not found by a term of its body.")
+
+    def test_second_generate_should_only_index_changed_pages(self):
+        self.site.generate()
+        self.p2.content = "Rye and yeast."
+        self.p2.write()
+        indexed = []
+        orig = s2search.SearchIndexer._page_terms
+        def counting_page_terms(indexer, page, body_html=None):
+            indexed.append(page.slug)
+            return orig(indexer, page, body_html)
+        with patch.object(s2search.SearchIndexer, '_page_terms', counting_page_terms):
+            s2site.Site(self.temp_dir).generate()
+        self.assertEqual(indexed, [self.p2.slug], "unchanged pages were indexed again.")
+        self.assertEqual(self.lookup(u'yeast'), [self.p2.slug + '/'],
+                         "changed page was not indexed again.")
+        self.assertEqual(self.lookup(u'flour'), [], "old terms of a changed page are still indexed.")
+
+    def test_notebook_change_should_index_the_page_again(self):
+        nb = os.path.join(self.p1.dirs['source_dir'], 'nb.ipynb')
+        open(nb, 'w').write('{}')
+        self.p1._config['notebook'] = [u'nb.ipynb']
+        sig = [1.0, 10]
+        indexed = []
+        def page_terms(indexer, page, body_html=None):
+            indexed.append(page.slug)
+            return {u'term': 1}
+        with patch.object(s2search.SearchIndexer, '_page_terms', page_terms):
+            indexer = s2search.SearchIndexer(self.site)
+            indexer.add(self.p1, sig)
+            indexer.save()
+            indexer = s2search.SearchIndexer(self.site)
+            indexer.add(self.p1, sig)
+            self.assertEqual(indexed, [self.p1.slug], "unchanged page indexed again.")
+            open(nb, 'w').write('{"cells": []}')
+            indexer = s2search.SearchIndexer(self.site)
+            indexer.add(self.p1, sig)
+        self.assertEqual(indexed, [self.p1.slug] * 2,
+                         "page not indexed again after its notebook changed.")
+
+    def test_targeted_generation_should_remove_old_shards(self):
+        self.site.generate()
+        stale = os.path.join(self.site.dirs['www'], 'search', 'ffff.json')
+        open(stale, 'w').write('{}')
+        self.site.generate_pages([self.p1.slug])
+        self.assertFalse(os.path.exists(stale), "shard of an older index left behind.")
+        self.assertEqual(self.lookup(u'flour'), [self.p2.slug + '/'],
+                         "page missing from the index rewritten.")
+
+
+if __name__ == "__main__":
+     unittest.main()
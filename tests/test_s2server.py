@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+import tempfile
+import shutil
+import threading
+import socket
+import urllib2
+import BaseHTTPServer
+
+from simplystatic import s2site
+from simplystatic import s2server
+
+
+class TestRedirects(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.site = s2site.Site(self.temp_dir)
+        self.site.init_structure()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def target(self, path):
+        return s2server.redirect_target(path, self.site.get_redirects())
+
+    def test_old_slug_should_redirect_to_new_slug(self):
+        self.site.add_redirect('old_one', 'new_one')
+        self.assertEqual(self.target('/old_one/index.html?x=1'), '/new_one/index.html?x=1',
+                         "old slug was not redirected.")
+
+    def test_other_paths_should_not_redirect(self):
+        self.site.add_redirect('old_one', 'new_one')
+        self.assertEqual(self.target('/new_one/'), None, "a current slug was redirected.")
+
+    def test_chained_renames_should_redirect_to_last_slug(self):
+        self.site.add_redirect('a', 'b')
+        self.site.add_redirect('b', 'c')
+        self.assertEqual(self.site.get_redirects(), {'a': 'c', 'b': 'c'},
+                         "chained redirects were not collapsed.")
+
+    def test_renaming_back_should_drop_redirect(self):
+        self.site.add_redirect('a', 'b')
+        self.site.add_redirect('b', 'a')
+        self.assertEqual(self.site.get_redirects(), {'b': 'a'},
+                         "redirect from a slug in use was kept.")
+
+
+class TestLivePreview(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.site = s2site.Site(self.temp_dir)
+        self.site.init_structure()
+        self.p1 = self.site.random_page(title="Live page", content="First version.")
+        self.p1.set_published()
+        self.p1.write()
+        self.draft = self.site.random_page(title="Draft page", content="Not yet.")
+        self.draft.write()
+        self.preview = s2server.LivePreview(self.site, max_pages=1)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_render_page_should_cache_until_source_changes(self):
+        html = self.preview.render_page(self.p1.slug)
+        self.assertTrue('First version.' in html, "page not rendered.")
+        self.preview.render_page(self.p1.slug)
+        self.assertEqual((self.preview.hits, self.preview.misses), (1, 1),
+                         "second request was not served from the cache.")
+        self.p1.content = "Second version, longer."
+        self.p1.write()
+        self.assertTrue('Second version' in self.preview.render_page(self.p1.slug),
+                        "changed page was served from the cache.")
+        self.assertEqual(os.listdir(self.site.dirs['www']), [], "live preview wrote to www.")
+
+    def test_drafts_should_need_the_flag_and_lru_should_evict(self):
+        self.preview.render_page(self.p1.slug)
+        self.assertEqual(self.preview.render_page(self.draft.slug), None,
+                         "draft shown without the flag.")
+        self.assertTrue('Not yet.' in self.preview.render_page(self.draft.slug, drafts=True),
+                        "draft not shown with the flag.")
+        self.preview.render_page(self.p1.slug)
+        self.assertEqual(self.preview.misses, 3, "least recently used page not evicted.")
+        self.assertEqual(self.preview.hits, 1, "draft not served from the cache.")
+
+    def test_concurrent_renders_should_be_consistent(self):
+        results = []
+        def render(slug):
+            for i in range(10):
+                results.append(self.preview.render_page(slug, drafts=True))
+        threads = [threading.Thread(target=render, args=(slug,))
+                   for slug in [self.p1.slug, self.draft.slug] * 3]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(30)
+        self.assertEqual(len(results), 60, "some renders did not finish.")
+        self.assertEqual(len(set(results)), 2, "concurrent renders gave different pages.")
+        self.assertEqual(self.preview.hits + self.preview.misses, 60,
+                         "cache counters lost updates.")
+
+    def test_handler_should_serve_pages_and_source_files(self):
+        open(os.path.join(self.p1.dirs['source_dir'], 'data.txt'), 'w').write('data')
+        handler = s2server.make_live_handler_class(self.site)
+        httpd = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), handler)
+        t = threading.Thread(target=httpd.serve_forever)
+        t.daemon = True
+        t.start()
+        try:
+            base = 'http://127.0.0.1:%d/' % httpd.server_address[1]
+            self.assertTrue('First version.' in urllib2.urlopen(base + self.p1.slug + '/').read(),
+                            "page not served.")
+            self.assertEqual(urllib2.urlopen(base + self.p1.slug + '/data.txt').read(), 'data',
+                             "page file not served from the source.")
+            self.assertTrue(self.p1.slug in urllib2.urlopen(base).read(),
+                            "front page does not list the page.")
+            self.assertRaises(urllib2.HTTPError, urllib2.urlopen,
+                              base + self.p1.slug + '/' + self.p1.slug + '.md')
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+
+
+class TestLiveReload(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.site = s2site.Site(self.temp_dir)
+        self.site.init_structure()
+        self.p1 = self.site.random_page(title="Reloaded page", content="First version.")
+        self.p1.set_published()
+        self.p1.write()
+        self.site.generate()
+        self.notifier = s2server.ChangeNotifier(self.site)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def edit_and_generate(self):
+        self.p1.content = "Second version, longer."
+        self.p1.write()
+        self.site.generate()
+
+    def test_inject_reload_script_should_go_before_body_end(self):
+        self.assertEqual(s2server.inject_reload_script('<p>x</p></BODY></html>'),
+                         '<p>x</p>' + s2server.RELOAD_TAG + '</BODY></html>',
+                         "script not injected before </body>.")
+
+    def test_notifier_should_report_changed_urls(self):
+        self.assertFalse(self.notifier.check(), "generation noticed with no generation.")
+        self.edit_and_generate()
+        self.assertTrue(self.notifier.check(), "generation not noticed.")
+        (version, urls) = self.notifier.wait(0, 1)
+        self.assertEqual(version, 1, "wrong version.")
+        self.assertTrue('/' + self.p1.slug + '/' in urls, "page not in %r" % urls)
+        self.assertEqual(self.notifier.wait(1, 0.05), None, "no new generation, but wait returned.")
+
+    def test_dev_server_should_inject_script_and_stream_changes(self):
+        handler = s2server.make_live_handler_class(self.site, notifier=self.notifier)
+        httpd = s2server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        t = threading.Thread(target=httpd.serve_forever)
+        t.daemon = True
+        t.start()
+        try:
+            base = 'http://127.0.0.1:%d' % httpd.server_address[1]
+            html = urllib2.urlopen(base + '/' + self.p1.slug + '/').read()
+            self.assertTrue(s2server.RELOAD_TAG in html, "reload script not injected.")
+            conn = socket.create_connection(httpd.server_address, 5)
+            conn.sendall('GET %s HTTP/1.0\r\n\r\n' % s2server.EVENTS_PATH)
+            events = conn.makefile('rb', 0)
+            while events.readline().strip():
+                pass   # headers
+            self.assertEqual(events.readline(), 'retry: 1000\n', "event stream not started.")
+            events.readline()
+            self.edit_and_generate()
+            self.notifier.check()
+            self.assertEqual(events.readline(), 'event: changed\n', "no change event sent.")
+            self.assertTrue(self.p1.slug in events.readline(), "page not in the changes.")
+            events.close()
+            conn.close()
+        finally:
+            self.notifier.stop()
+            httpd.shutdown()
+            httpd.server_close()
+
+
+if __name__ == "__main__":
+     unittest.main()
@@ -14,9 +14,11 @@ import datetime
 import uuid
 import types
 import math
+import json
 
 from simplystatic import s2site
 from simplystatic import s2page
+from simplystatic import s2deploy
 from simplystatic import util
 
 # GLOBAL AUXILIARY FUNCTIONS for the tests #
@@ -405,6 +407,54 @@ class TestGenerateAndRename(unittest.TestCase):
         wset = set([os.path.split(f)[1] for f in wlist])
         self.assertEqual(sset.difference(wset),set([]),"generate did not create the right files in www.")
 
+    def test_generate_twice_should_give_same_output_and_no_changes(self):
+        self.s2.site_config['site_url'] = 'http://example.com'
+        for i in range(0, 5):
+            p = self.s2.random_page()
+            p.set_published()
+            p.write()
+        self.s2.generate()
+        first = s2deploy.build_manifest(self.s2.dirs['www'])
+        self.s2.generate()
+        self.assertEqual(s2deploy.build_manifest(self.s2.dirs['www']), first,
+                         "generating again gave a different output.")
+        changes = open(os.path.join(self.s2.dirs['s2'], 'last_build_changes.txt')).read()
+        self.assertEqual(changes, '', "changes listed with no change: %r" % changes)
+
+    def test_generate_should_convert_each_page_once(self):
+        for i in range(0, 3):
+            p = self.s2.random_page()
+            p.set_published()
+            p.write()
+        calls = []
+        real_body_html = s2page.Page.body_html
+        def body_html(page):
+            calls.append(page.slug)
+            return real_body_html(page)
+        s2page.Page.body_html = body_html
+        try:
+            self.s2.generate()
+        finally:
+            s2page.Page.body_html = real_body_html
+        self.assertEqual(sorted(calls), sorted(set(calls)),
+                         "body html got more than once for a page: %r" % calls)
+        self.assertEqual(len(calls), 3, "not every page was converted.")
+
+    def test_generate_should_list_changed_urls(self):
+        self.s2.site_config['site_url'] = 'http://example.com'
+        p = self.s2.random_page()
+        p.set_published()
+        p.write()
+        self.s2.generate()
+        p.content = "New content."
+        p.write()
+        self.s2.generate()
+        changes = open(os.path.join(self.s2.dirs['s2'], 'last_build_changes.txt')).read()
+        self.assertTrue('changed\thttp://example.com/%s/\n' % p.slug in changes,
+                        "changed page url not listed: %r" % changes)
+        self.assertEqual(self.s2.get_build_changes()[1].count(p.slug + '/index.html'), 1,
+                         "changed page file not recorded.")
+
     # TEST generate should copy the common dir 
     def test_generate_should_copy_common_dir_to_www(self):
         '''Verify that all files and directories in common are copied 
@@ -503,5 +553,168 @@ class TestFrontMatter(unittest.TestCase):
         rfset = set(rflist)
         self.assertEqual(rfset,efset,"generate_front did not create the right set of front-matter files.")
 
+    def stable_gpi(self, n):
+        return [{'slug': 'slug%03d' % i, 'title': 'title %d' % i,
+                 'date': '2014-01-01', 'in_toc': True}
+                for i in range(n - 1, -1, -1)]   # newest first
+
+    def test_stable_front_should_number_pages_from_the_oldest(self):
+        pages = list(self.site.renderfront_chronological_stable(self.stable_gpi(25), 10))
+        self.assertEqual([p['fname'] for p in pages], ['index.html', '2.html', '1.html'],
+                         "wrong stable front page files.")
+        self.assertTrue('slug009' in pages[2]['content'] and
+                        not 'slug010' in pages[2]['content'],
+                        "1.html does not have the oldest pages.")
+        self.assertEqual(pages[0]['next_page_url'], '2.html', "wrong link from index.html.")
+
+    def test_stable_front_should_not_rewrite_older_pages(self):
+        self.site.site_config['front_pagination'] = 'stable'
+        self.site.generate_front(self.stable_gpi(30), 10)
+        old = os.path.join(self.site.dirs['www'], '1.html')
+        newer = os.path.join(self.site.dirs['www'], '2.html')
+        os.utime(old, (0, 0))
+        os.utime(newer, (0, 0))
+        self.site.generate_front(self.stable_gpi(31), 10)
+        self.assertEqual(os.path.getmtime(old), 0, "unchanged front page was written.")
+        self.assertNotEqual(os.path.getmtime(newer), 0, "changed front page was not written.")
+        self.assertTrue(os.path.isfile(os.path.join(self.site.dirs['www'], '3.html')),
+                        "new front page was not written.")
+
+class TestBuildCacheDir(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.temp_dir, 'buildcache')
+        os.environ[s2site.CACHE_DIR_ENV] = self.cache_dir
+        self.site = s2site.Site(self.temp_dir)
+        self.site.init_structure()
+        p = self.site.random_page()
+        p.set_published()
+        p.write()
+
+    def tearDown(self):
+        del os.environ[s2site.CACHE_DIR_ENV]
+        shutil.rmtree(self.temp_dir)
+
+    def test_cache_dir_should_keep_templates_and_caches_across_sites(self):
+        self.site.generate()
+        self.assertTrue(os.path.isdir(os.path.join(self.cache_dir, 'html')),
+                        "html cache not in the build cache dir.")
+        self.assertTrue(self.site.template_misses > 0, "no template compiled.")
+        # a new site object (a new run) starts warm
+        site = s2site.Site(self.temp_dir)
+        site.generate()
+        self.assertEqual((site.template_misses, site.caches['html'].misses), (0, 0),
+                         "second run did not reuse the build cache.")
+
+    def test_config_cache_dir_should_be_relative_to_base(self):
+        del os.environ[s2site.CACHE_DIR_ENV]
+        self.site.site_config['cache_dir'] = 'ci_cache'
+        self.assertEqual(self.site.cache_dir, os.path.join(self.temp_dir, 'ci_cache'),
+                         "wrong build cache dir from the config.")
+        os.environ[s2site.CACHE_DIR_ENV] = self.cache_dir
+        self.assertEqual(self.site.cache_dir, self.cache_dir,
+                         "environment variable did not take precedence.")
+
+
+class TestGeneratePages(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.site = s2site.Site(self.temp_dir)
+        self.site.init_structure()
+        self.pages = []
+        for i in range(12):
+            p = self.site.random_page(creation_date=datetime.date(2014, 2, i + 1))
+            p.set_published()
+            p.write()
+            self.pages.append(p)
+        self.site.generate()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def assert_same_as_generate(self):
+        targeted = s2deploy.build_manifest(self.site.dirs['www'])
+        manifest_path = os.path.join(self.site.dirs['s2'], s2site.BUILD_MANIFEST_FILE)
+        recorded = s2deploy.read_manifest_file(manifest_path)['files']
+        self.assertEqual(recorded, targeted, "wrong manifest recorded.")
+        self.site.generate()
+        self.assertEqual(targeted, s2deploy.build_manifest(self.site.dirs['www']),
+                         "targeted generation differs from a whole one.")
+
+    def test_changed_page_should_update_page_and_listings(self):
+        p = self.pages[3]
+        p.content = "A correction, urgently."
+        p.write()
+        self.assertEqual(self.site.generate_pages([p.slug]), [p.slug],
+                         "wrong pages generated.")
+        (added, changed, removed) = self.site.get_build_changes()
+        self.assertTrue(p.slug + '/index.html' in changed, "page not changed.")
+        summary = json.load(open(os.path.join(self.site.dirs['s2'],
+                                              s2site.BUILD_SUMMARY_FILE)))
+        entry = [e for e in summary['feed'] if e['slug'] == p.slug][0]
+        self.assertTrue('A correction' in entry['content'], "feed entry not updated.")
+        self.assertFalse(self.pages[4].slug + '/index.html' in changed,
+                         "another page was changed.")
+        self.assert_same_as_generate()
+
+    def test_unpublished_page_should_be_removed(self):
+        p = self.pages[0]
+        p._config['status'][0] = 'draft'
+        p.write()
+        self.assertEqual(self.site.generate_pages([p.slug]), [], "draft generated.")
+        self.assertFalse(os.path.isdir(os.path.join(self.site.dirs['www'], p.slug)),
+                         "draft left in www.")
+        sitemap = open(os.path.join(self.site.dirs['www'], 'sitemap.txt')).read()
+        self.assertFalse(p.slug in sitemap, "draft left in the sitemap.")
+        self.assert_same_as_generate()
+
+    def test_no_summary_should_generate_everything(self):
+        os.remove(os.path.join(self.site.dirs['s2'], s2site.BUILD_SUMMARY_FILE))
+        self.assertEqual(len(self.site.generate_pages([self.pages[0].slug])), 12,
+                         "whole site not generated without a summary.")
+        self.assertRaises(ValueError, self.site.generate_pages, ['no_such_page'])
+
+
+class TestShardedGeneration(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.site = s2site.Site(self.temp_dir)
+        self.site.init_structure()
+        self.site.site_config['related_pages'] = 2
+        for i in range(12):
+            p = self.site.random_page(creation_date=datetime.date(2014, 1, i + 1))
+            p.set_published()
+            p.write()
+        self.slugs = self.site.get_page_names()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_shard_of_should_split_all_pages(self):
+        shards = [s2site.shard_of(slug, 3) for slug in self.slugs]
+        self.assertEqual(shards, [s2site.shard_of(unicode(slug), 3) for slug in self.slugs],
+                         "shard depends on the type of the slug.")
+        self.assertTrue(len(set(shards)) > 1, "all pages went to the same shard.")
+
+    def test_merged_shards_should_equal_single_generation(self):
+        self.site.generate()
+        single = s2deploy.build_manifest(self.site.dirs['www'])
+        self.site._wipe_www_dir()
+        total = 0
+        for i in range(3):
+            total += self.site.generate_shard(i, 3)
+        self.assertEqual(total, len(self.slugs), "shards did not generate all the pages.")
+        self.assertFalse(os.path.isfile(os.path.join(self.site.dirs['www'], 'atom.xml')),
+                         "a shard wrote the feed.")
+        self.assertEqual(self.site.merge_shards(), 3, "wrong number of shards merged.")
+        self.assertEqual(s2deploy.build_manifest(self.site.dirs['www']), single,
+                         "merged site differs from a single generation.")
+
+    def test_merge_with_missing_shard_should_raise_valueerror(self):
+        self.site.generate_shard(0, 2)
+        self.assertRaises(ValueError, self.site.merge_shards)
+        self.assertRaises(ValueError, self.site.generate_shard, 2, 2)
+
+
 if __name__ == "__main__":
      unittest.main()
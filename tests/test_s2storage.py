@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+import tempfile
+import shutil
+
+from simplystatic import s2site
+from simplystatic import s2page
+from simplystatic import s2storage
+
+
+class TestSQLiteStorage(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.site = s2site.Site(self.temp_dir)
+        self.site.init_structure()
+        self.site.set_config('storage', 'sqlite')
+        self.db = os.path.join(self.site.dirs['s2'], s2storage.DB_FILE)
+
+    def tearDown(self):
+        self.site.storage.close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_pages_should_be_kept_in_the_database(self):
+        p = self.site.random_page(title="Café con leche")
+        p.content = u"Some café."
+        p.set_published()
+        p.write()
+        self.assertTrue(os.path.isfile(self.db), "database not created.")
+        self.assertEqual(os.listdir(self.site.dirs['source']), [],
+                         "page directory created for a page without files.")
+        self.assertEqual(self.site.get_page_names(), [p.slug], "wrong page names.")
+        self.assertTrue(self.site.page_exists_on_disk(p.slug), "page not found.")
+        self.assertFalse(self.site.page_exists_on_disk('nothere'), "missing page found.")
+        other = s2site.Site(self.temp_dir)
+        q = s2page.Page(other, p.slug, isslug=True)
+        self.assertEqual(q.title, u"Café con leche", "wrong title read.")
+        self.assertEqual(q.content.strip(), u"Some café.", "wrong content read.")
+        other.storage.close()
+        self.site.generate()
+        self.assertTrue(os.path.isfile(os.path.join(self.site.dirs['www'], p.slug,
+                                                    'index.html')),
+                        "page not generated.")
+
+    def test_rename_should_move_the_page_and_its_files(self):
+        p = self.site.random_page(title="Old title")
+        p.write()
+        os.mkdir(p.dirs['source_dir'])
+        open(os.path.join(p.dirs['source_dir'], 'pic.png'), 'w').write('png')
+        self.site.rename_page(p.slug, "New title")
+        self.assertEqual(self.site.get_page_names(), ['new_title'],
+                         "page not renamed in the database.")
+        self.assertTrue(os.path.isfile(os.path.join(self.site.dirs['source'],
+                                                    'new_title', 'pic.png')),
+                        "the files of the page were not moved.")
+
+    def test_bulk_import_should_write_to_the_database(self):
+        recs = [{'title': 'Post %d' % i, 'status': 'published'} for i in range(10)]
+        (imported, skipped) = self.site.bulk_import(recs, threads=4, batch_size=3)
+        self.assertEqual(len(imported), 10, "not all the pages were imported.")
+        self.assertEqual(len(self.site.get_page_names()), 10, "pages not in the database.")
+        self.assertEqual(len(self.site.get_catalog().entries), 10,
+                         "pages not in the catalog.")
+
+
+class TestMigrate(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.site = s2site.Site(self.temp_dir)
+        self.site.init_structure()
+        self.pages = [self.site.random_page() for i in range(3)]
+        self.pic = os.path.join(self.pages[0].dirs['source_dir'], 'pic.png')
+        open(self.pic, 'w').write('png')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def texts(self):
+        return dict([(s, self.site.storage.read(s)) for s in self.site.get_page_names()])
+
+    def test_migrate_should_keep_pages_both_ways(self):
+        before = self.texts()
+        catalog = dict(self.site.get_catalog().entries)
+        self.assertEqual(s2storage.migrate(self.site, 'sqlite'), 3,
+                         "wrong number of pages moved.")
+        self.assertEqual(s2site.Site(self.temp_dir).site_config['storage'], 'sqlite',
+                         "storage not saved in the config.")
+        self.assertEqual(self.texts(), before, "pages changed by the migration to sqlite.")
+        self.assertEqual(os.listdir(self.site.dirs['source']), [self.pages[0].slug],
+                         "page files left behind.")
+        self.assertTrue(os.path.isfile(self.pic), "the files of a page were removed.")
+        self.assertEqual(self.site.get_catalog().entries, catalog,
+                         "catalog changed by the migration.")
+        self.assertRaises(ValueError, s2storage.migrate, self.site, 'sqlite')
+
+        self.assertEqual(s2storage.migrate(self.site, 'files'), 3,
+                         "wrong number of pages moved back.")
+        self.assertEqual(self.texts(), before, "pages changed by the migration to files.")
+        self.assertFalse(os.path.exists(os.path.join(self.site.dirs['s2'],
+                                                     s2storage.DB_FILE)),
+                         "database left behind.")
+        for p in self.pages:
+            self.assertTrue(os.path.isfile(os.path.join(self.site.dirs['source'],
+                                                        p.slug, p.slug + '.md')),
+                            "page file not written back.")
+
+    def test_unknown_storage_should_raise_valueerror(self):
+        self.assertRaises(ValueError, s2storage.get_storage, self.site, 'nosql')
+
+
+if __name__ == "__main__":
+     unittest.main()
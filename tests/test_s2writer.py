@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+import tempfile
+import shutil
+import threading
+
+from simplystatic import s2site
+from simplystatic import s2deploy
+from simplystatic import s2page
+from simplystatic import s2writer
+
+
+class TestWriteBehind(unittest.TestCase):
+    def test_full_queue_should_block_submit(self):
+        gate = threading.Event()
+        started = threading.Event()
+        done = []
+        w = s2writer.WriteBehind(threads=1, queue_size=1)
+        w.submit(lambda: started.set() or gate.wait())
+        started.wait(5)           # the thread took it, and waits
+        w.submit(done.append, 1)  # fills the queue
+        t = threading.Thread(target=w.submit, args=(done.append, 2))
+        t.daemon = True
+        t.start()
+        t.join(0.2)
+        self.assertTrue(t.is_alive(), "submit did not block on a full queue.")
+        gate.set()
+        t.join(5)
+        w.flush()
+        self.assertEqual(done, [1, 2], "tasks not run in order after the flush.")
+        w.close()
+        self.assertEqual(w.tasks_run, 3, "wrong number of tasks run.")
+
+    def test_failed_task_should_raise_and_drop_the_rest(self):
+        gate = threading.Event()
+        done = []
+        w = s2writer.WriteBehind(threads=1)
+        w.submit(gate.wait)
+        w.submit(os.remove, '/nonexistent/file')
+        w.submit(done.append, 1)
+        gate.set()
+        self.assertRaises(OSError, w.flush)
+        self.assertEqual(done, [], "task run after a failed one.")
+        self.assertRaises(OSError, w.submit, done.append, 2)
+        w.close(abort=True)
+
+    def test_no_threads_should_run_right_away(self):
+        done = []
+        w = s2writer.WriteBehind(threads=0)
+        w.submit(done.append, 1)
+        self.assertEqual(done, [1], "task not run by submit.")
+        self.assertRaises(OSError, w.submit, os.remove, '/nonexistent/file')
+        w.close(abort=True)
+
+
+class TestSiteWriteBehind(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.site = s2site.Site(self.temp_dir)
+        self.site.init_structure()
+        for i in range(5):
+            p = self.site.random_page()
+            p.set_published()
+            p.write()
+            os.mkdir(os.path.join(p.dirs['source_dir'], 'files'))
+            open(os.path.join(p.dirs['source_dir'], 'files', 'a.txt'), 'w').write('a')
+            open(os.path.join(p.dirs['source_dir'], 'b.txt'), 'w').write('b')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_background_writes_should_give_the_same_site(self):
+        self.site.site_config['io_threads'] = 0
+        self.site.generate()
+        before = s2deploy.build_manifest(self.site.dirs['www'])
+        self.site.site_config['io_threads'] = 3
+        self.site.site_config['io_queue_size'] = 2
+        self.site.generate()
+        self.assertEqual(s2deploy.build_manifest(self.site.dirs['www']), before,
+                         "the site written in the background is different.")
+        self.assertFalse(self.site.writing_behind, "writer left running.")
+
+    def test_pages_should_render_to_their_files_in_the_writer(self):
+        threads = []
+        def render_to_file(template, filename, **data):
+            if not data['isFrontPage']:
+                threads.append(threading.current_thread())
+            real_render_to_file(template, filename, **data)
+        def render(page, filename=None):
+            raise AssertionError("page rendered to a string.")
+        real_render_to_file = s2page.render_to_file
+        real_render = s2page.Page.render
+        s2page.render_to_file = render_to_file
+        s2page.Page.render = render
+        try:
+            self.site.site_config['io_threads'] = 2
+            self.site.generate()
+        finally:
+            s2page.render_to_file = real_render_to_file
+            s2page.Page.render = real_render
+        for slug in self.site.get_page_names():
+            self.assertTrue(os.path.isfile(os.path.join(self.site.dirs['www'], slug,
+                                                        'index.html')),
+                            "page %s not written." % slug)
+        self.assertEqual(len(threads), 5, "pages not rendered to their files.")
+        self.assertFalse(threading.current_thread() in threads,
+                         "pages rendered outside of the writer threads.")
+
+    def test_failed_write_should_stop_the_generation(self):
+        os.symlink(os.path.join(self.temp_dir, 'nothere.css'),
+                   os.path.join(self.site.dirs['common'], 'broken.css'))
+        self.assertRaises(IOError, self.site.generate)
+        self.assertFalse(os.path.exists(os.path.join(self.site.dirs['s2'],
+                                                     s2site.BUILD_SUMMARY_FILE)),
+                         "the generation went on after a failed write.")
+        self.assertFalse(self.site.writing_behind, "writer left running.")
+
+
+if __name__ == "__main__":
+     unittest.main()